@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import functools;
+import operator;
+import threading;
+
+from enum import IntEnum;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+FRAME_HEADER_COMMAND    = 0x33
+FRAME_HEADER_QUERY      = 0xAA
+FRAME_SIZE              = 20
+FRAME_MAX_PAYLOAD       = FRAME_SIZE - 3
+SEGMENT_COUNT_MAX       = 16
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+class ELedCommand(IntEnum):
+    SetPower        = 0x01
+    SetBrightness   = 0x04
+    SetColor        = 0x05
+
+class ELedMode(IntEnum):
+    Manual     = 0x02
+    Microphone = 0x06
+    Scenes     = 0x05
+    Manual2    = 0x0D
+    Segment    = 0x15
+
+class EColorLayout(IntEnum):
+    Basic   = 0
+    Manual2 = 1
+    Segment = 2
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# How a model expects its brightness and color frames
+class ModelLayout:
+    # Constructor
+    def __init__(self, p_BrightnessMax, p_ColorLayout):
+        self.BrightnessMax  = p_BrightnessMax;
+        self.ColorLayout    = p_ColorLayout;
+
+    # Brightness 0-1 to device value
+    def BrightnessValue(self, p_Value):
+        if self.BrightnessMax == 100:
+            return int(p_Value * 100);
+
+        return round(p_Value * 0xFF);
+
+    # SetColor payload for this layout
+    def ColorPayload(self, p_R, p_G, p_B, p_TK, p_Segment):
+        if self.ColorLayout == EColorLayout.Manual2:
+            return (ELedMode.Manual2, p_R, p_G, p_B, (p_TK >> 8) & 0xFF, p_TK & 0xFF, 0, 0, 0);
+        elif self.ColorLayout == EColorLayout.Segment:
+            return (ELedMode.Segment, 0x01, p_R, p_G, p_B, (p_TK >> 8) & 0xFF, p_TK & 0xFF, 0, 0, 0, (p_Segment >> 8) & 0xFF, p_Segment & 0xFF);
+
+        # Todo figure out WW control
+        return (ELedMode.Manual, p_R, p_G, p_B);
+
+DEFAULT_LAYOUT = ModelLayout(0xFF, EColorLayout.Basic);
+
+MODEL_LAYOUTS = {
+    "H6008":    ModelLayout(100,  EColorLayout.Manual2),
+    "H613A":    ModelLayout(100,  EColorLayout.Manual2),
+    "H613D":    ModelLayout(100,  EColorLayout.Manual2),
+    "H6159r2":  ModelLayout(0xFF, EColorLayout.Manual2),
+    "H6172":    ModelLayout(100,  EColorLayout.Segment),
+    "H618F":    ModelLayout(100,  EColorLayout.Segment),
+};
+
+def GetLayout(p_Model):
+    return MODEL_LAYOUTS.get(p_Model, DEFAULT_LAYOUT);
+
+# Group { segment index: (r, g, b) } by color, one (color, segment mask) per distinct color
+def GroupSegments(p_Colors):
+    l_Masks = {};
+
+    for l_Index, l_Color in p_Colors.items():
+        if not 0 <= l_Index < SEGMENT_COUNT_MAX:
+            raise ValueError(f'[GoveeBleCodec.GroupSegments] Segment out of range {l_Index}');
+
+        l_Masks[l_Color] = l_Masks.get(l_Color, 0) | (1 << l_Index);
+
+    return sorted(l_Masks.items(), key= lambda x: x[1]);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Build 20 bytes frames, finished frames are kept in a bounded LRU
+class FrameCodec:
+    # Constructor
+    def __init__(self, p_CacheSize = 1024):
+        self._Buffer    = bytearray(FRAME_SIZE);
+        self._Lock      = threading.Lock();
+        self._Cached    = functools.lru_cache(maxsize= p_CacheSize)(self._Build);
+
+    # Encode a frame, p_Payload must be a tuple of ints or bytes
+    def Encode(self, p_CMD, p_Payload, p_Header = FRAME_HEADER_COMMAND):
+        return self._Cached(p_Header, p_CMD, p_Payload);
+
+    # Cache hits, misses and current size
+    def GetCacheInfo(self):
+        return self._Cached.cache_info();
+
+    def _Build(self, p_Header, p_CMD, p_Payload):
+        if not isinstance(p_CMD, int):
+            raise ValueError('[GoveeBleCodec.FrameCodec::Encode] Invalid command');
+        if len(p_Payload) > FRAME_MAX_PAYLOAD:
+            raise ValueError('[GoveeBleCodec.FrameCodec::Encode] Payload too long');
+
+        l_End = 2 + len(p_Payload);
+
+        with self._Lock:
+            l_Buffer = self._Buffer;
+
+            try:
+                l_Buffer[0]         = p_Header & 0xFF;
+                l_Buffer[1]         = p_CMD & 0xFF;
+                l_Buffer[2:l_End]   = p_Payload;
+            except (TypeError, ValueError):
+                l_Buffer[2:l_End]   = _ZEROS[2:l_End];
+                raise ValueError('[GoveeBleCodec.FrameCodec::Encode] Invalid payload');
+
+            l_Buffer[l_End:FRAME_SIZE]  = _ZEROS[l_End:FRAME_SIZE];
+            l_Buffer[FRAME_SIZE - 1]    = functools.reduce(operator.xor, l_Buffer);
+
+            return bytes(l_Buffer);
+
+_ZEROS = bytes(FRAME_SIZE);
+
+# (header, command, payload) of a notification, None if it is not a valid frame
+def DecodeFrame(p_Frame):
+    if len(p_Frame) != FRAME_SIZE or functools.reduce(operator.xor, p_Frame) != 0:
+        return None;
+
+    return p_Frame[0], p_Frame[1], bytes(p_Frame[2:FRAME_SIZE - 1]);
+
+# Shared by every client
+CODEC = FrameCodec();
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+import functools;
+import math;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+MIRED_MIN = 25
+MIRED_MAX = 1000
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+@functools.lru_cache(maxsize= 1024)
+def convert_K_to_RGB(colour_temperature):
+    """
+    Converts from K to RGB, algorithm courtesy of
+    http://www.tannerhelland.com/4435/convert-temperature-rgb-algorithm-code/
+    """
+    #range check
+    if colour_temperature < 1000:
+        colour_temperature = 1000
+    elif colour_temperature > 40000:
+        colour_temperature = 40000
+
+    tmp_internal = colour_temperature / 100.0
+
+    # red
+    if tmp_internal <= 66:
+        red = 255
+    else:
+        tmp_red = 329.698727446 * math.pow(tmp_internal - 60, -0.1332047592)
+        if tmp_red < 0:
+            red = 0
+        elif tmp_red > 255:
+            red = 255
+        else:
+            red = tmp_red
+
+    # green
+    if tmp_internal <=66:
+        tmp_green = 99.4708025861 * math.log(tmp_internal) - 161.1195681661
+        if tmp_green < 0:
+            green = 0
+        elif tmp_green > 255:
+            green = 255
+        else:
+            green = tmp_green
+    else:
+        tmp_green = 288.1221695283 * math.pow(tmp_internal - 60, -0.0755148492)
+        if tmp_green < 0:
+            green = 0
+        elif tmp_green > 255:
+            green = 255
+        else:
+            green = tmp_green
+
+    # blue
+    if tmp_internal >=66:
+        blue = 255
+    elif tmp_internal <= 19:
+        blue = 0
+    else:
+        tmp_blue = 138.5177312231 * math.log(tmp_internal - 10) - 305.0447927307
+        if tmp_blue < 0:
+            blue = 0
+        elif tmp_blue > 255:
+            blue = 255
+        else:
+            blue = tmp_blue
+
+    return int(red), int(green), int(blue);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# convert_K_to_RGB for every integer mired value, 40000K down to 1000K
+MIRED_RGB_TABLE = tuple(convert_K_to_RGB(1000000 / l_Mired) for l_Mired in range(MIRED_MIN, MIRED_MAX + 1));
+
+# Table lookup at the closest mired value
+def convert_K_to_RGB_Fast(p_Kelvin):
+    l_Mired = int(round(1000000 / p_Kelvin));
+    l_Mired = MIRED_MIN if l_Mired < MIRED_MIN else MIRED_MAX if l_Mired > MIRED_MAX else l_Mired;
+
+    return MIRED_RGB_TABLE[l_Mired - MIRED_MIN];
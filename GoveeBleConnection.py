@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+import asyncio;
+import collections;
+import heapq;
+import itertools;
+import random;
+import time;
+
+from enum import IntEnum;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+class EConnectPriority(IntEnum):
+    Pending = 0
+    Idle    = 1
+
+# A device commanded this many times within the window stays connected when the pool is full
+POOL_HOT_USES   = 3
+POOL_HOT_WINDOW = 600.0
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Serialize connection attempts on a single adapter
+class ConnectionScheduler:
+    # Constructor
+    def __init__(self, p_Adapter, p_MaxInFlight = 2, p_BackoffBase = 1.0, p_BackoffMax = 60.0):
+        self.Adapter                = p_Adapter;
+        self.LastReconnectAllTime   = None;
+
+        self._MaxInFlight           = max(1, p_MaxInFlight);
+        self._BackoffBase           = p_BackoffBase;
+        self._BackoffMax            = p_BackoffMax;
+        self._InFlight              = 0;
+        self._Waiters               = [];
+        self._Sequence              = itertools.count();
+        self._Clients               = set();
+        self._Connected             = set();
+        self._Parked                = set();
+        self._OutageStart           = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Register(self, p_Client):
+        self._Clients.add(p_Client);
+
+        if self._OutageStart is None:
+            self._OutageStart = time.time();
+
+    def Unregister(self, p_Client):
+        self._Clients.discard(p_Client);
+        self._Connected.discard(p_Client);
+        self._Parked.discard(p_Client);
+        self._CheckAllConnected();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Wait for a connection slot, lower priority value goes first
+    async def Acquire(self, p_Priority):
+        if self._InFlight < self._MaxInFlight and len(self._Waiters) == 0:
+            self._InFlight += 1;
+            return;
+
+        l_Future = asyncio.get_event_loop().create_future();
+        heapq.heappush(self._Waiters, (p_Priority, next(self._Sequence), l_Future));
+
+        try:
+            await l_Future;
+        except asyncio.CancelledError:
+            # Slot was handed over right before the cancel, give it back
+            if l_Future.done() and not l_Future.cancelled():
+                self.Release();
+            raise;
+
+    # Give back a connection slot to the next waiter
+    def Release(self):
+        while len(self._Waiters) > 0:
+            _, _, l_Future = heapq.heappop(self._Waiters);
+
+            if not l_Future.done():
+                l_Future.set_result(None);
+                return;
+
+        self._InFlight = max(0, self._InFlight - 1);
+
+    # Exponential backoff with jitter for the Nth consecutive failure
+    def GetBackoff(self, p_Reconnect):
+        l_Delay = min(self._BackoffMax, self._BackoffBase * (2 ** max(0, min(p_Reconnect - 1, 16))));
+        return l_Delay / 2 + random.uniform(0, l_Delay / 2);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def OnConnected(self, p_Client):
+        self._Connected.add(p_Client);
+        self._Parked.discard(p_Client);
+        self._CheckAllConnected();
+
+    # Disconnected on purpose by the pool, it counts as back
+    def OnParked(self, p_Client):
+        self._Connected.discard(p_Client);
+        self._Parked.add(p_Client);
+        self._CheckAllConnected();
+
+    def OnDisconnected(self, p_Client):
+        if p_Client not in self._Connected:
+            return;
+
+        self._Connected.discard(p_Client);
+
+        if self._OutageStart is None:
+            self._OutageStart = time.time();
+
+    # Report how long it took to get every device back
+    def _CheckAllConnected(self):
+        if self._OutageStart is None or len(self._Clients) == 0 or len(self._Connected) + len(self._Parked) < len(self._Clients):
+            return;
+
+        self.LastReconnectAllTime   = time.time() - self._OutageStart;
+        self._OutageStart           = None;
+
+        print(f"[GoveeBleConnection.ConnectionScheduler] Adapter {self.Adapter}: all {len(self._Clients)} devices connected in {self.LastReconnectAllTime:.2f}s" + (f", {len(self._Parked)} parked" if len(self._Parked) > 0 else ""));
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Cap the links open at once on an adapter, the least recently commanded idle
+# device is disconnected to make room and reconnects when a command arrives
+class ConnectionPool:
+    # Constructor
+    def __init__(self, p_Adapter, p_MaxConnections = None, p_Pinned = ()):
+        self.Adapter        = p_Adapter;
+        self.MaxConnections = p_MaxConnections;
+
+        self._Pinned        = set(l_DeviceID.upper() for l_DeviceID in p_Pinned);
+        self._Members       = collections.OrderedDict();
+        self._Evicting      = set();
+        self._Uses          = {};
+        self._Waiters       = [];
+        self._Hits          = 0;
+        self._Misses        = 0;
+        self._Evictions     = 0;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Take a free link slot, False when the pool is full
+    def TryReserve(self, p_Client):
+        if p_Client not in self._Members:
+            if self.MaxConnections is not None and len(self._Members) + len(self._Evicting) >= self.MaxConnections:
+                return False;
+
+            self._Members[p_Client] = time.time();
+
+        return True;
+
+    # Wait for a link slot, idle members are parked when the pool is full
+    async def Reserve(self, p_Client):
+        if p_Client in self._Members:
+            return;
+
+        while self.MaxConnections is not None and len(self._Members) + len(self._Evicting) >= self.MaxConnections:
+            # One eviction at a time, its slot is free once the victim is disconnected
+            if len(self._Evicting) == 0:
+                self._Evict();
+
+            l_Future = asyncio.get_event_loop().create_future();
+            self._Waiters.append(l_Future);
+
+            try:
+                await asyncio.wait_for(l_Future, 1.0);
+            except asyncio.TimeoutError:
+                pass;
+            finally:
+                if l_Future in self._Waiters:
+                    self._Waiters.remove(l_Future);
+
+        self._Members[p_Client] = time.time();
+
+    # The client is disconnected, parked or closed
+    def Leave(self, p_Client):
+        self._Members.pop(p_Client, None);
+        self._Evicting.discard(p_Client);
+        self._WakeWaiters();
+
+    # A command went out, p_Hit when the link was already up
+    def Touch(self, p_Client, p_Hit):
+        if p_Hit:
+            self._Hits += 1;
+        else:
+            self._Misses += 1;
+
+        l_Now   = time.time();
+        l_Uses  = self._Uses.setdefault(p_Client.GetDeviceID(), collections.deque(maxlen= POOL_HOT_USES));
+        l_Uses.append(l_Now);
+
+        if p_Client in self._Members:
+            self._Members[p_Client] = l_Now;
+            self._Members.move_to_end(p_Client);
+
+        # It may have been the only member busy with a command
+        self._WakeWaiters();
+
+    def IsPinned(self, p_Client):
+        return p_Client.GetDeviceID().upper() in self._Pinned;
+
+    # Commanded often lately
+    def IsHot(self, p_Client):
+        l_Uses = self._Uses.get(p_Client.GetDeviceID());
+        return l_Uses is not None and len(l_Uses) == POOL_HOT_USES and (time.time() - l_Uses[0]) <= POOL_HOT_WINDOW;
+
+    def GetStats(self):
+        return {
+            "connections":  len(self._Members),
+            "max":          self.MaxConnections,
+            "hot":          sum(1 for l_Client in self._Members if self.IsHot(l_Client)),
+            "hits":         self._Hits,
+            "misses":       self._Misses,
+            "evictions":    self._Evictions,
+        };
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Least recently used idle member, hot ones only when every idle member is hot
+    def _Evict(self):
+        l_Candidates = [l_Client for l_Client in self._Members if not l_Client.IsBusy() and not self.IsPinned(l_Client)];
+        if len(l_Candidates) == 0:
+            return;
+
+        l_Cold      = [l_Client for l_Client in l_Candidates if not self.IsHot(l_Client)];
+        l_Victim    = (l_Cold or l_Candidates)[0];
+
+        del self._Members[l_Victim];
+        self._Evicting.add(l_Victim);
+        self._Evictions += 1;
+
+        print(f"[GoveeBleConnection.ConnectionPool] Adapter {self.Adapter}: parking idle device {l_Victim.GetDeviceID()}");
+
+        l_Victim.Park();
+
+    def _WakeWaiters(self):
+        for l_Future in self._Waiters:
+            if not l_Future.done():
+                l_Future.set_result(None);
+
+        self._Waiters = [];
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Spread devices across several adapters
+class AdapterBalancer:
+    # Constructor
+    def __init__(self, p_Adapters, p_MaxInFlight = 2, p_MigrateAfter = 3, p_MaxConnections = None, p_Pinned = ()):
+        if len(p_Adapters) == 0:
+            p_Adapters = [None];
+
+        self.Adapters       = list(p_Adapters);
+
+        self._MigrateAfter  = p_MigrateAfter;
+        self._Schedulers    = { l_Adapter: ConnectionScheduler(l_Adapter, p_MaxInFlight) for l_Adapter in self.Adapters };
+        self._Pools         = { l_Adapter: ConnectionPool(l_Adapter, p_MaxConnections, p_Pinned) for l_Adapter in self.Adapters };
+        self._FailureRate   = { l_Adapter: 0.0 for l_Adapter in self.Adapters };
+        self._Assignments   = {};
+        self._RSSI          = {};
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def GetScheduler(self, p_Adapter):
+        return self._Schedulers[p_Adapter];
+
+    def GetPool(self, p_Adapter):
+        return self._Pools[p_Adapter];
+
+    # Pool counters summed over every adapter
+    def GetPoolStats(self):
+        l_Stats = collections.Counter();
+
+        for l_Pool in self._Pools.values():
+            l_Stats.update({ l_Key: l_Value for l_Key, l_Value in l_Pool.GetStats().items() if l_Key != "max" });
+
+        return dict(l_Stats);
+
+    # Pick the best adapter for a device, optionally avoiding its current one or keeping a known good one
+    def Assign(self, p_DeviceID, p_Exclude = None, p_Prefer = None):
+        l_Candidates = [l_Adapter for l_Adapter in self.Adapters if l_Adapter != p_Exclude];
+        if len(l_Candidates) == 0:
+            l_Candidates = self.Adapters;
+
+        self._Assignments.pop(p_DeviceID, None);
+
+        if p_Prefer in l_Candidates:
+            l_Adapter = p_Prefer;
+        else:
+            l_Adapter = min(l_Candidates, key= lambda x: self._Score(p_DeviceID, x));
+        self._Assignments[p_DeviceID] = l_Adapter;
+
+        return l_Adapter;
+
+    def Unassign(self, p_DeviceID):
+        self._Assignments.pop(p_DeviceID, None);
+
+    # Should a device with this many consecutive failures move elsewhere
+    def ShouldMigrate(self, p_Reconnect):
+        return len(self.Adapters) > 1 and p_Reconnect >= self._MigrateAfter;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def ReportConnect(self, p_Adapter, p_Success):
+        if p_Adapter not in self._FailureRate:
+            return;
+
+        self._FailureRate[p_Adapter] = self._FailureRate[p_Adapter] * 0.8 + (0.0 if p_Success else 0.2);
+
+    def ReportRSSI(self, p_DeviceID, p_Adapter, p_RSSI):
+        self._RSSI[(p_DeviceID.upper(), p_Adapter)] = p_RSSI;
+
+    # Last signal strength of a device seen from an adapter, None if never heard
+    def GetRSSI(self, p_DeviceID, p_Adapter):
+        return self._RSSI.get((p_DeviceID.upper(), p_Adapter));
+
+    # Scan every adapter once to learn which devices they can hear best
+    async def Survey(self, p_Timeout = 5.0):
+        from bleak import BleakScanner;
+
+        async def _Scan(p_Adapter):
+            try:
+                if p_Adapter is not None:
+                    l_Results = await BleakScanner.discover(timeout= p_Timeout, return_adv= True, adapter= p_Adapter);
+                else:
+                    l_Results = await BleakScanner.discover(timeout= p_Timeout, return_adv= True);
+
+                for l_Device, l_AdvertisementData in l_Results.values():
+                    self.ReportRSSI(l_Device.address, p_Adapter, l_AdvertisementData.rssi);
+
+            except Exception as l_Exception:
+                print(f"[GoveeBleConnection.AdapterBalancer::Survey] Error on adapter {p_Adapter}: {l_Exception}");
+
+        await asyncio.gather(*[_Scan(l_Adapter) for l_Adapter in self.Adapters]);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Lower is better, each assigned device weights like 10 dB of signal
+    def _Score(self, p_DeviceID, p_Adapter):
+        l_Load  = sum(1 for l_Adapter in self._Assignments.values() if l_Adapter == p_Adapter);
+        l_RSSI  = self._RSSI.get((p_DeviceID.upper(), p_Adapter), -90);
+
+        return l_Load * 10 + self._FailureRate[p_Adapter] * 50 - l_RSSI;
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+import asyncio;
+import json;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+COORDINATION_TOPIC  = "goveeblemqtt/nodes/";
+ANY_ZONE_PREFIX     = "goveeblemqtt/any/";
+
+# Signal strength of a device a node does not hear
+RSSI_UNKNOWN        = -100
+# dB lost per missing point of link quality, a link failing half its writes weights like 20 dB
+QUALITY_WEIGHT      = 40
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Last advertisement of a node
+class NodeAdvert:
+    # Constructor
+    def __init__(self, p_Node, p_Payload, p_Received):
+        self.Node       = p_Node;
+        self.Zone       = p_Payload.get("zone");
+        self.Devices    = p_Payload.get("devices", {});
+        self.Owned      = p_Payload.get("owned", {});
+        self.Released   = p_Payload.get("released", {});
+        self.Received   = p_Received;
+
+# Higher is better placed
+def GetScore(p_Info):
+    if p_Info is None:
+        return RSSI_UNKNOWN - QUALITY_WEIGHT;
+
+    l_RSSI = p_Info.get("rssi");
+
+    return (l_RSSI if l_RSSI is not None else RSSI_UNKNOWN) - (1.0 - p_Info.get("quality", 1.0)) * QUALITY_WEIGHT;
+
+# Elect one owner per device among zone servers sharing a broker. Every node advertises
+# what it hears and what it owns on a retained topic, cleared by its last will. A device
+# is owned by one node, a better placed node only takes it over when the owner releases
+# it, so two nodes never fight over a light
+class Coordinator:
+    # Constructor
+    def __init__(self, p_Node, p_Zone, p_MqttClient, p_GetVisible, p_GetOwnedState, p_OnOwn, p_OnRelease, p_Interval = 10.0, p_Margin = 8.0, p_HoldTime = 60.0):
+        self.Node               = p_Node;
+        self.Zone               = p_Zone;
+
+        self._MqttClient        = p_MqttClient;
+        self._GetVisible        = p_GetVisible;
+        self._GetOwnedState     = p_GetOwnedState;
+        self._OnOwn             = p_OnOwn;
+        self._OnRelease         = p_OnRelease;
+        self._Interval          = p_Interval;
+        self._Margin            = p_Margin;
+        self._HoldTime          = p_HoldTime;
+        self._Adverts           = {};
+        self._Models            = {};
+        self._Owned             = {};
+        self._LastStates        = {};
+        self._Released          = {};
+        self._ReadyAt           = None;
+        self._Handoffs          = 0;
+        self._Task              = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def GetTopic(self):
+        return COORDINATION_TOPIC + self.Node;
+
+    def Start(self, p_Loop):
+        self._Task = p_Loop.create_task(self._Coroutine());
+
+    # Clear the advert, the other nodes take the devices over right away
+    async def Stop(self):
+        if self._Task is not None:
+            self._Task.cancel();
+            await asyncio.gather(self._Task, return_exceptions= True);
+            self._Task = None;
+
+        try:
+            self._MqttClient.publish(self.GetTopic(), b"", retain= True);
+        except Exception as l_Exception:
+            print(f"[GoveeBleCoordinator.Coordinator::Stop] Error: {l_Exception}");
+
+    # Retained adverts of the other nodes arrive right after subscribing, wait for them before electing
+    def OnBrokerConnected(self):
+        if self._ReadyAt is None:
+            self._ReadyAt = time.time() + min(self._Interval, 3.0);
+
+        self._PublishAdvert();
+
+    # A device commanded on the zone agnostic topic, its model is needed to create its client.
+    # p_State is a saved state restored if this node claims it and no other node knows better
+    def Learn(self, p_DeviceID, p_Model, p_State = None):
+        self._Models[p_DeviceID] = p_Model;
+
+        if p_State is not None:
+            self._LastStates.setdefault(p_DeviceID, p_State);
+
+    def IsOwner(self, p_DeviceID):
+        return p_DeviceID in self._Owned;
+
+    # Should this node handle a command, claims the device if nobody owns it and this node is the best placed
+    def ClaimForCommand(self, p_DeviceID):
+        if p_DeviceID in self._Owned:
+            return True;
+
+        if not self._IsReady() or len(self._GetOwners(p_DeviceID)) > 0:
+            return False;
+
+        if self._GetWinner(p_DeviceID) != self.Node:
+            return False;
+
+        self._Claim(p_DeviceID);
+        self._PublishAdvert();
+
+        return True;
+
+    def GetInfo(self):
+        return {
+            "node":     self.Node,
+            "nodes":    sorted([self.Node] + list(self._Adverts.keys())),
+            "owned":    len(self._Owned),
+            "handoffs": self._Handoffs,
+        };
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Advert of another node, an empty payload is its last will or a clean stop
+    def OnAdvert(self, p_Node, p_Payload):
+        if p_Node == self.Node:
+            return;
+
+        if len(p_Payload) == 0:
+            if self._Adverts.pop(p_Node, None) is not None:
+                print(f"[GoveeBleCoordinator.Coordinator] Node {p_Node} left");
+                self._Elect();
+
+            return;
+
+        l_Payload = json.loads(p_Payload.decode("utf-8","ignore"));
+
+        if p_Node not in self._Adverts:
+            print(f"[GoveeBleCoordinator.Coordinator] Node {p_Node} joined, zone {l_Payload.get('zone')}");
+
+        l_Advert = self._Adverts[p_Node] = NodeAdvert(p_Node, l_Payload, time.time());
+
+        # Models and last states let this node take a device over without a new command
+        for l_DeviceID, l_Owned in list(l_Advert.Owned.items()) + list(l_Advert.Released.items()):
+            if l_Owned.get("model") is not None:
+                self._Models.setdefault(l_DeviceID, l_Owned["model"]);
+
+            if l_Owned.get("state") is not None:
+                self._LastStates[l_DeviceID] = l_Owned["state"];
+
+        self._Elect();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    async def _Coroutine(self):
+        while True:
+            self._ExpireNodes();
+            self._Elect();
+            self._PublishAdvert();
+
+            await asyncio.sleep(self._Interval);
+
+    # Nodes that died without their last will being delivered
+    def _ExpireNodes(self):
+        l_Now = time.time();
+
+        for l_Node, l_Advert in list(self._Adverts.items()):
+            if (l_Now - l_Advert.Received) > self._Interval * 3:
+                print(f"[GoveeBleCoordinator.Coordinator] Node {l_Node} timed out");
+                del self._Adverts[l_Node];
+
+    def _PublishAdvert(self):
+        l_Visible   = self._GetVisible();
+        l_Owned     = {};
+
+        for l_DeviceID in self._Owned:
+            l_Owned[l_DeviceID] = { "model": self._Models.get(l_DeviceID), "state": self._GetOwnedState(l_DeviceID) };
+
+        # Handed over devices stay listed a few rounds, the new owner restores their state
+        for l_DeviceID, (l_Time, _) in list(self._Released.items()):
+            if (time.time() - l_Time) > self._Interval * 3 or l_DeviceID in self._Owned:
+                del self._Released[l_DeviceID];
+
+        l_Payload = {
+            "zone":     self.Zone,
+            "time":     round(time.time()),
+            "devices":  l_Visible,
+            "owned":    l_Owned,
+            "released": { l_DeviceID: { "model": self._Models.get(l_DeviceID), "state": l_State } for l_DeviceID, (_, l_State) in self._Released.items() },
+        };
+
+        try:
+            self._MqttClient.publish(self.GetTopic(), json.dumps(l_Payload), retain= True);
+        except Exception as l_Exception:
+            print(f"[GoveeBleCoordinator.Coordinator::_PublishAdvert] Error: {l_Exception}");
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # { node: device info } of every live node hearing the device, this node included
+    def _GetCandidates(self, p_DeviceID, p_Visible = None):
+        l_Visible       = p_Visible if p_Visible is not None else self._GetVisible();
+        l_Candidates    = { l_Node: l_Advert.Devices[p_DeviceID] for l_Node, l_Advert in self._Adverts.items() if p_DeviceID in l_Advert.Devices };
+
+        if p_DeviceID in l_Visible:
+            l_Candidates[self.Node] = l_Visible[p_DeviceID];
+
+        return l_Candidates;
+
+    def _GetOwners(self, p_DeviceID):
+        l_Owners = [l_Node for l_Node, l_Advert in self._Adverts.items() if p_DeviceID in l_Advert.Owned];
+
+        if p_DeviceID in self._Owned:
+            l_Owners.append(self.Node);
+
+        return l_Owners;
+
+    # Best placed node, the lowest node name breaks ties and takes devices nobody hears
+    def _GetWinner(self, p_DeviceID, p_Candidates = None):
+        l_Candidates = p_Candidates if p_Candidates is not None else self._GetCandidates(p_DeviceID);
+
+        if len(l_Candidates) == 0:
+            return min([self.Node] + list(self._Adverts.keys()));
+
+        return min(l_Candidates.items(), key= lambda x: (-GetScore(x[1]), x[0]))[0];
+
+    # Same inputs give the same result on every node
+    def _Elect(self):
+        if not self._IsReady():
+            return;
+
+        l_Visible   = self._GetVisible();
+        l_Changed   = False;
+
+        for l_DeviceID in list(self._Models.keys()):
+            l_Candidates    = self._GetCandidates(l_DeviceID, l_Visible);
+            l_Owners        = self._GetOwners(l_DeviceID);
+
+            # Claimed twice, the best placed keeps it
+            if self.Node in l_Owners and len(l_Owners) > 1:
+                l_Keep = min(l_Owners, key= lambda x: (-GetScore(l_Candidates.get(x)), x));
+
+                if l_Keep != self.Node:
+                    self._Release(l_DeviceID, l_Keep);
+                    l_Changed = True;
+
+            # Hand off to a clearly better placed node, not before holding the device a while
+            elif self.Node in l_Owners:
+                l_Others = { l_Node: l_Info for l_Node, l_Info in l_Candidates.items() if l_Node != self.Node };
+                if len(l_Others) == 0 or (time.time() - self._Owned[l_DeviceID]) < self._HoldTime:
+                    continue;
+
+                l_Best = self._GetWinner(l_DeviceID, l_Others);
+
+                if GetScore(l_Others[l_Best]) > GetScore(l_Candidates.get(self.Node)) + self._Margin:
+                    self._Release(l_DeviceID, l_Best);
+                    l_Changed = True;
+
+            # Nobody owns it, the best placed node takes it
+            elif len(l_Owners) == 0 and self._GetWinner(l_DeviceID, l_Candidates) == self.Node:
+                self._Claim(l_DeviceID);
+                l_Changed = True;
+
+        if l_Changed:
+            self._PublishAdvert();
+
+    def _IsReady(self):
+        return self._ReadyAt is not None and time.time() >= self._ReadyAt;
+
+    def _Claim(self, p_DeviceID):
+        print(f"[GoveeBleCoordinator.Coordinator] Node {self.Node} owns device {p_DeviceID}");
+
+        self._Owned[p_DeviceID] = time.time();
+        self._OnOwn(p_DeviceID, self._Models.get(p_DeviceID), self._LastStates.pop(p_DeviceID, None));
+
+    def _Release(self, p_DeviceID, p_To):
+        print(f"[GoveeBleCoordinator.Coordinator] Node {self.Node} hands device {p_DeviceID} over to {p_To}");
+
+        # The new owner picks the last state from the advert
+        self._Released[p_DeviceID] = (time.time(), self._GetOwnedState(p_DeviceID));
+        del self._Owned[p_DeviceID];
+        self._Handoffs += 1;
+
+        self._OnRelease(p_DeviceID);
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+import asyncio;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+GOVEE_NAME_PREFIXES = ("ihoment_", "Govee_", "Minger_", "GBK_");
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Last advertisement of a device on an adapter
+class DiscoveryEntry:
+    # Constructor
+    def __init__(self, p_Device, p_RSSI, p_LastSeen):
+        self.Device     = p_Device;
+        self.RSSI       = p_RSSI;
+        self.LastSeen   = p_LastSeen;
+
+# Scan every adapter in the background and keep the BLEDevice of recently seen lights,
+# a client connecting from a cached BLEDevice skips the scan bleak would run on its own
+class DiscoveryCache:
+    # Constructor
+    def __init__(self, p_Adapters, p_TTL = 120.0, p_OutOfRangeAfter = 300.0, p_OnRSSI = None):
+        self._Adapters          = list(p_Adapters) if len(p_Adapters) > 0 else [None];
+        self._TTL               = p_TTL;
+        self._OutOfRangeAfter   = p_OutOfRangeAfter;
+        self._OnRSSI            = p_OnRSSI;
+        self._Entries           = {};
+        self._Watched           = set();
+        self._LastContact       = {};
+        self._OutOfRange        = set();
+        self._ScanningSince     = {};
+        self._Hits              = 0;
+        self._Misses            = 0;
+        self._Tasks             = [];
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Start(self, p_Loop):
+        for l_Adapter in self._Adapters:
+            self._Tasks.append(p_Loop.create_task(self._ScanCoroutine(l_Adapter)));
+
+        self._Tasks.append(p_Loop.create_task(self._EvictCoroutine()));
+
+    async def Stop(self):
+        for l_Task in self._Tasks:
+            l_Task.cancel();
+
+        await asyncio.gather(*self._Tasks, return_exceptions= True);
+        self._Tasks = [];
+
+    # Track a configured device, it gets flagged when it is not heard anymore
+    def Watch(self, p_DeviceID):
+        self._Watched.add(p_DeviceID.upper());
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Cached BLEDevice, None when the device was not heard recently on this adapter
+    def Get(self, p_DeviceID, p_Adapter):
+        l_Entry = self._Entries.get((p_DeviceID.upper(), p_Adapter));
+
+        if l_Entry is None or (time.time() - l_Entry.LastSeen) > self._TTL:
+            self._Misses += 1;
+            return None;
+
+        self._Hits += 1;
+        return l_Entry.Device;
+
+    # Connected devices stop advertising, a live link counts as being heard
+    def ReportContact(self, p_DeviceID):
+        self._LastContact[p_DeviceID.upper()] = time.time();
+
+    # Not heard on any adapter for a while although the scanners are running
+    def IsOutOfRange(self, p_DeviceID):
+        l_Now = time.time();
+
+        if len(self._ScanningSince) == 0 or (l_Now - min(self._ScanningSince.values())) < self._OutOfRangeAfter:
+            return False;
+
+        l_DeviceID = p_DeviceID.upper();
+
+        if (l_Now - self._LastContact.get(l_DeviceID, 0)) <= self._OutOfRangeAfter:
+            return False;
+
+        for l_Adapter in self._Adapters:
+            l_Entry = self._Entries.get((l_DeviceID, l_Adapter));
+
+            if l_Entry is not None and (l_Now - l_Entry.LastSeen) <= self._OutOfRangeAfter:
+                return False;
+
+        return True;
+
+    # Best signal strength of every device heard lately, { DEVICE ID: rssi }
+    def GetVisible(self):
+        l_Now       = time.time();
+        l_Visible   = {};
+
+        for (l_DeviceID, _), l_Entry in list(self._Entries.items()):
+            if (l_Now - l_Entry.LastSeen) <= self._OutOfRangeAfter:
+                l_Visible[l_DeviceID] = max(l_Visible.get(l_DeviceID, l_Entry.RSSI), l_Entry.RSSI);
+
+        return l_Visible;
+
+    def GetOutOfRange(self):
+        return set(self._OutOfRange);
+
+    def GetCacheInfo(self):
+        return { "devices": len(self._Entries), "hits": self._Hits, "misses": self._Misses, "out_of_range": len(self._OutOfRange) };
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _OnDetection(self, p_Adapter, p_Device, p_AdvertisementData):
+        l_DeviceID  = p_Device.address.upper();
+        l_Name      = p_Device.name or p_AdvertisementData.local_name or "";
+
+        if l_DeviceID not in self._Watched and not l_Name.startswith(GOVEE_NAME_PREFIXES):
+            return;
+
+        self._Entries[(l_DeviceID, p_Adapter)] = DiscoveryEntry(p_Device, p_AdvertisementData.rssi, time.time());
+
+        if l_DeviceID in self._OutOfRange:
+            self._OutOfRange.discard(l_DeviceID);
+            print(f"[GoveeBleDiscovery.DiscoveryCache] Device {l_DeviceID} back in range on adapter {p_Adapter}");
+
+        if self._OnRSSI is not None:
+            self._OnRSSI(l_DeviceID, p_Adapter, p_AdvertisementData.rssi);
+
+    # Keep a scanner running on one adapter, restarted if it fails
+    async def _ScanCoroutine(self, p_Adapter):
+        from bleak import BleakScanner;
+
+        while True:
+            l_Scanner = None;
+
+            try:
+                l_Callback = lambda p_Device, p_AdvertisementData: self._OnDetection(p_Adapter, p_Device, p_AdvertisementData);
+
+                if p_Adapter is not None:
+                    l_Scanner = BleakScanner(detection_callback= l_Callback, adapter= p_Adapter);
+                else:
+                    l_Scanner = BleakScanner(detection_callback= l_Callback);
+
+                await l_Scanner.start();
+                self._ScanningSince.setdefault(p_Adapter, time.time());
+
+                # Runs until cancelled
+                await asyncio.Event().wait();
+
+            except asyncio.CancelledError:
+                raise;
+
+            except Exception as l_Exception:
+                print(f"[GoveeBleDiscovery.DiscoveryCache::_ScanCoroutine] Error on adapter {p_Adapter}: {l_Exception}");
+                self._ScanningSince.pop(p_Adapter, None);
+
+            finally:
+                if l_Scanner is not None:
+                    try:
+                        await l_Scanner.stop();
+                    except Exception:
+                        pass;
+
+            await asyncio.sleep(10);
+
+    # Drop stale entries and flag watched devices nobody hears anymore
+    async def _EvictCoroutine(self):
+        while True:
+            await asyncio.sleep(min(self._TTL, 30));
+
+            l_Now = time.time();
+
+            for l_Key, l_Entry in list(self._Entries.items()):
+                if (l_Now - l_Entry.LastSeen) > max(self._TTL, self._OutOfRangeAfter):
+                    del self._Entries[l_Key];
+
+            for l_DeviceID in self._Watched:
+                if l_DeviceID not in self._OutOfRange and self.IsOutOfRange(l_DeviceID):
+                    self._OutOfRange.add(l_DeviceID);
+                    print(f"[GoveeBleDiscovery.DiscoveryCache] Device {l_DeviceID} out of range, not heard for {self._OutOfRangeAfter:.0f}s");
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import threading;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Hold a set of clients while a command is applied to all of them, then
+# release them together and report how far apart their writes landed
+class FanOut:
+    # Constructor
+    def __init__(self, p_Name, p_ReportTimeout = 5.0):
+        self.Name           = p_Name;
+
+        self._ReportTimeout = p_ReportTimeout;
+        self._Clients       = [];
+        self._Expected      = 0;
+        self._Writes        = [];
+        self._ReleaseTime   = None;
+        self._Reported      = False;
+        self._Lock          = threading.Lock();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Add(self, p_Client):
+        if p_Client in self._Clients:
+            return;
+
+        p_Client.Hold();
+        self._Clients.append(p_Client);
+
+    # Let every client flush, they all wake in the same loop iteration
+    def Release(self, p_Loop = None):
+        # Frames are built now so the writers only have to send them
+        for l_Client in self._Clients:
+            l_Client.PrepareFrames();
+
+        self._Expected      = sum(1 for l_Client in self._Clients if l_Client.HasPending() and l_Client.IsConnected());
+        self._ReleaseTime   = time.time();
+
+        for l_Client in self._Clients:
+            if l_Client.HasPending() and l_Client.IsConnected():
+                l_Client.Release(self);
+            else:
+                l_Client.Release(None);
+
+        if self._Expected == 0:
+            self._Reported = True;
+        elif p_Loop is not None:
+            p_Loop.call_later(self._ReportTimeout, self._Report);
+
+    # First write of a released client, p_Start is when it was issued. A write issued
+    # before the release (keep alive, earlier state) is not the fan out one, returns False
+    def OnWrite(self, p_Client, p_Start, p_End):
+        if self._ReleaseTime is None or p_Start < self._ReleaseTime:
+            return False;
+
+        with self._Lock:
+            self._Writes.append((p_Start, p_End));
+
+            if len(self._Writes) < self._Expected:
+                return True;
+
+        self._Report();
+
+        return True;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _Report(self):
+        with self._Lock:
+            if self._Reported:
+                return;
+
+            self._Reported = True;
+
+            if len(self._Writes) == 0:
+                print(f"[GoveeBleGroup.FanOut::_Report] {self.Name}: no write out of {self._Expected} devices");
+                return;
+
+            l_Issued    = [l_Write[0] for l_Write in self._Writes];
+            l_Landed    = [l_Write[1] for l_Write in self._Writes];
+
+            print(f"[GoveeBleGroup.FanOut::_Report] {self.Name}: {len(self._Writes)}/{self._Expected} devices,"
+                  f" issue skew {(max(l_Issued) - min(l_Issued)) * 1000:.1f}ms,"
+                  f" write skew {(max(l_Landed) - min(l_Landed)) * 1000:.1f}ms,"
+                  f" release to last write {(max(l_Landed) - self._ReleaseTime) * 1000:.1f}ms");
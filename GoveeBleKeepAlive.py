@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+import asyncio;
+import heapq;
+import itertools;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Single timer heap driving the keep alive of every device
+class KeepAliveScheduler:
+    # Constructor
+    def __init__(self, p_DefaultInterval = 1.0, p_ModelIntervals = None, p_MaxFactor = 3.0, p_LatencyThreshold = 0.15):
+        self._DefaultInterval   = p_DefaultInterval;
+        self._ModelIntervals    = p_ModelIntervals if p_ModelIntervals is not None else {};
+        self._MaxFactor         = p_MaxFactor;
+        self._LatencyThreshold  = p_LatencyThreshold;
+        self._Heap              = [];
+        self._Sequence          = itertools.count();
+        self._Entries           = {};
+        self._Intervals         = {};
+        self._Latency           = {};
+        self._Event             = None;
+        self._Task              = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Start(self, p_Loop):
+        self._Event = asyncio.Event();
+        self._Task  = p_Loop.create_task(self._Coroutine());
+
+    async def Stop(self):
+        if self._Task is None:
+            return;
+
+        self._Task.cancel();
+
+        try:
+            await self._Task;
+        except asyncio.CancelledError:
+            pass;
+
+        self._Task = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Register(self, p_Client):
+        l_Interval = self.GetBaseInterval(p_Client.GetModel());
+        self._Intervals[p_Client] = l_Interval;
+
+        # Golden ratio offsets keep first pings spread whatever the device count
+        l_Sequence = next(self._Sequence);
+        l_Offset   = (l_Sequence * 0.6180339887) % 1.0;
+
+        self._Push(p_Client, time.time() + l_Interval * (1.0 + l_Offset), l_Sequence);
+
+    def Unregister(self, p_Client):
+        self._Entries.pop(p_Client, None);
+        self._Intervals.pop(p_Client, None);
+
+    def GetBaseInterval(self, p_Model):
+        return self._ModelIntervals.get(p_Model, self._DefaultInterval);
+
+    # Current interval of a device, stretched when the adapter is slow
+    def GetInterval(self, p_Client, p_Adapter):
+        l_Interval = self._Intervals.get(p_Client, self._DefaultInterval);
+        l_Latency  = self._Latency.get(p_Adapter, 0.0);
+
+        if l_Latency > self._LatencyThreshold:
+            l_Interval *= l_Latency / self._LatencyThreshold;
+
+        return l_Interval;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Write latency sample from a device
+    def ReportWrite(self, p_Adapter, p_Latency):
+        l_Previous = self._Latency.get(p_Adapter);
+        self._Latency[p_Adapter] = p_Latency if l_Previous is None else l_Previous * 0.9 + p_Latency * 0.1;
+
+    # Keep alive went through, the link tolerates a slightly longer interval
+    def ReportKeepAlive(self, p_Client):
+        if p_Client not in self._Intervals:
+            return;
+
+        l_Max = self.GetBaseInterval(p_Client.GetModel()) * self._MaxFactor;
+        self._Intervals[p_Client] = min(l_Max, self._Intervals[p_Client] * 1.1);
+
+    # Link dropped, go back to the base interval
+    def ReportDisconnect(self, p_Client):
+        if p_Client not in self._Intervals:
+            return;
+
+        self._Intervals[p_Client] = self.GetBaseInterval(p_Client.GetModel());
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _Push(self, p_Client, p_Due, p_Sequence = None):
+        if p_Sequence is None:
+            p_Sequence = next(self._Sequence);
+
+        self._Entries[p_Client] = p_Sequence;
+        heapq.heappush(self._Heap, (p_Due, p_Sequence, p_Client));
+
+        # New earliest deadline, wake the timer
+        if self._Event is not None and self._Heap[0][1] == p_Sequence:
+            self._Event.set();
+
+    async def _Coroutine(self):
+        while True:
+            self._Event.clear();
+
+            if len(self._Heap) == 0:
+                await self._Event.wait();
+                continue;
+
+            l_Due, l_Sequence, l_Client = self._Heap[0];
+            l_Now = time.time();
+
+            if l_Due > l_Now:
+                try:
+                    await asyncio.wait_for(self._Event.wait(), l_Due - l_Now);
+                except asyncio.TimeoutError:
+                    pass;
+
+                continue;
+
+            heapq.heappop(self._Heap);
+
+            # Unregistered or rescheduled since
+            if self._Entries.get(l_Client) != l_Sequence:
+                continue;
+
+            try:
+                l_Interval  = self.GetInterval(l_Client, l_Client.GetAdapter());
+                l_Next      = l_Client.GetLastSent() + l_Interval;
+
+                # A real command went out recently, that was our keep alive
+                if l_Next > l_Now:
+                    self._Push(l_Client, l_Next);
+                    continue;
+
+                l_Client.RequestKeepAlive();
+                self._Push(l_Client, l_Now + l_Interval);
+
+            except Exception as l_Exception:
+                print(f"[GoveeBleKeepAlive.KeepAliveScheduler::_Coroutine] Error: {l_Exception}");
+                self._Push(l_Client, l_Now + self._DefaultInterval);
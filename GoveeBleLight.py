@@ -3,100 +3,64 @@ import asyncio;
 import json;
 import threading;
 import time;
-import math;
 
 from enum import IntEnum;
 from bleak import BleakClient;
+from GoveeBleConnection import EConnectPriority;
+from GoveeBleCodec import ELedCommand, ELedMode, CODEC, FRAME_HEADER_QUERY;
+from GoveeBleColor import convert_K_to_RGB;
+from GoveeBleMetrics import METRICS;
+from GoveeBleRecorder import RECORDER;
+from GoveeBleTransition import LightOutput, Transition;
+
+import GoveeBleCodec;
 
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
 UUID_CONTROL_CHARACTERISTIC = '00010203-0405-0607-0809-0a0b0c0d2b11'
+UUID_NOTIFY_CHARACTERISTIC  = '00010203-0405-0607-0809-0a0b0c0d2b10'
+
+# Seconds between acknowledged writes in EWriteMode.NoResponseVerified
+WRITE_VERIFY_INTERVAL = 30
+# Minimum seconds between two state publishes of a device
+PUBLISH_MIN_INTERVAL = 0.25
+# Seconds an optimistically published state has to reach the light before it is reverted
+OPTIMISTIC_TIMEOUT = 30
+# Minimum seconds between two state publishes while a stream drives the device, and stream end detection
+STREAM_PUBLISH_INTERVAL = 2.0
+STREAM_IDLE_AFTER = 1.0
+# Transition frame period bounds in seconds, adapted to the measured write latency
+TRANSITION_MIN_PERIOD = 0.05
+TRANSITION_MAX_PERIOD = 0.5
+# Unanswered status queries before keep alives go back to rewriting the state
+QUERY_MAX_UNANSWERED = 3
+# Past that, one keep alive out of this many is still a query, an answer brings the queries back
+QUERY_RETRY_EVERY = 10
+# Seconds between range checks of a device the scanners do not hear anymore
+OUT_OF_RANGE_RETRY_INTERVAL = 10
 
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
-class ELedCommand(IntEnum):
-    SetPower        = 0x01
-    SetBrightness   = 0x04
-    SetColor        = 0x05
-
-class ELedMode(IntEnum):
-    Manual     = 0x02
-    Microphone = 0x06
-    Scenes     = 0x05
-    Manual2    = 0x0D
-    Segment    = 0x15
-
 class EControlMode(IntEnum):
     Color       = 0x01
     Temperature = 0x02
 
-def convert_K_to_RGB(colour_temperature):
-    """
-    Converts from K to RGB, algorithm courtesy of
-    http://www.tannerhelland.com/4435/convert-temperature-rgb-algorithm-code/
-    """
-    #range check
-    if colour_temperature < 1000:
-        colour_temperature = 1000
-    elif colour_temperature > 40000:
-        colour_temperature = 40000
-
-    tmp_internal = colour_temperature / 100.0
-
-    # red
-    if tmp_internal <= 66:
-        red = 255
-    else:
-        tmp_red = 329.698727446 * math.pow(tmp_internal - 60, -0.1332047592)
-        if tmp_red < 0:
-            red = 0
-        elif tmp_red > 255:
-            red = 255
-        else:
-            red = tmp_red
-
-    # green
-    if tmp_internal <=66:
-        tmp_green = 99.4708025861 * math.log(tmp_internal) - 161.1195681661
-        if tmp_green < 0:
-            green = 0
-        elif tmp_green > 255:
-            green = 255
-        else:
-            green = tmp_green
-    else:
-        tmp_green = 288.1221695283 * math.pow(tmp_internal - 60, -0.0755148492)
-        if tmp_green < 0:
-            green = 0
-        elif tmp_green > 255:
-            green = 255
-        else:
-            green = tmp_green
-
-    # blue
-    if tmp_internal >=66:
-        blue = 255
-    elif tmp_internal <= 19:
-        blue = 0
-    else:
-        tmp_blue = 138.5177312231 * math.log(tmp_internal - 10) - 305.0447927307
-        if tmp_blue < 0:
-            blue = 0
-        elif tmp_blue > 255:
-            blue = 255
-        else:
-            blue = tmp_blue
+class EWriteMode(IntEnum):
+    Default             = 0
+    NoResponse          = 1
+    NoResponseVerified  = 2
 
-    return int(red), int(green), int(blue);
+# Per model opt-in for write without response, { "H6008": EWriteMode.NoResponse }
+WRITE_MODES = {}
 
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
 class Client:
     # Constructor
-    def __init__(self, p_DeviceID, p_Model, p_MqttClient, p_MqttTopic, p_Adapter):
+    def __init__(self, p_DeviceID, p_Model, p_MqttClient, p_MqttTopic, p_Adapter, p_Loop = None, p_Balancer = None, p_KeepAlive = None, p_Registry = None, p_Discovery = None):
         self.ControlMode        = EControlMode.Color;
         self.State              = 0;
         self.Brightness         = 1;
@@ -108,20 +72,70 @@ class Client:
 
         self._DeviceID          = p_DeviceID;
         self._Model             = p_Model;
+        self._Layout            = GoveeBleCodec.GetLayout(p_Model);
+        self._WriteMode         = WRITE_MODES.get(p_Model, EWriteMode.Default);
+        self._Characteristic    = None;
+        self._NoResponse        = False;
+        self._LastVerified      = 0;
         self._Client            = None;
         self._Adapter           = p_Adapter;
         self._Reconnect         = 0;
+        self._Balancer          = p_Balancer;
+        self._Scheduler         = None;
+        self._Pool              = None;
+        self._Parked            = False;
         self._MqttClient        = p_MqttClient;
         self._MqttTopic         = p_MqttTopic;
         self._DirtyState        = False;
         self._DirtyBrightness   = False;
         self._DirtyColor        = False;
+        self._DirtySegments     = {};
+        self._SegmentsPainted   = False;
         self._LastSent          = time.time();
+        self._PayloadKey        = None;
+        self._Payload           = None;
+        self._LastPublished     = None;
+        self._LastPublishTime   = 0;
+        self._PublishPending    = False;
+        self._StreamUntil       = 0;
+        self._Confirmed         = self.GetState();
+        self._OptimisticSince   = None;
+        self._Transition        = None;
+        self._TransitionOutput  = None;
+        self._FadedOut          = False;
+        self._WriteLatency      = 0.0;
+        self._LinkQuality       = 1.0;
+        self._Held              = False;
+        self._FanOut            = None;
         self._PingRoll          = 0;
+        self._Notify            = False;
+        self._QueryUnanswered   = 0;
+        self._KeepAlive         = p_KeepAlive;
+        self._KeepAliveDue      = False;
+        self._Registry          = p_Registry;
+        self._Discovery         = p_Discovery;
+        self._Loop              = None;
+        self._LoopThreadID      = None;
+        self._WakeEvent         = None;
         self._ThreadCond        = True;
-        self._Thread            = threading.Thread(target= self._ThreadStarter);
+        self._Thread            = None;
+        self._Task              = None;
+
+        # A known adapter is kept, it reached this device before
+        if p_Balancer is not None:
+            self._Adapter   = p_Balancer.Assign(p_DeviceID, p_Prefer= p_Adapter);
+            self._Scheduler = p_Balancer.GetScheduler(self._Adapter);
+            self._Pool      = p_Balancer.GetPool(self._Adapter);
 
-        self._Thread.start();
+        if p_Discovery is not None:
+            p_Discovery.Watch(p_DeviceID);
+
+        # Shared loop mode, run as a task on the caller's event loop
+        if p_Loop is not None:
+            self._Task = p_Loop.create_task(self._ThreadCoroutine());
+        else:
+            self._Thread = threading.Thread(target= self._ThreadStarter);
+            self._Thread.start();
     # Destructor
     def __del__(self):
         self.Close();
@@ -131,6 +145,11 @@ class Client:
 
     # Properly close the client
     def Close(self):
+        if self._Task is not None:
+            self._ThreadCond = False;
+            self._Wake();
+            return;
+
         if self._Thread is None:
             return;
 
@@ -138,12 +157,151 @@ class Client:
 
         try:
             self._ThreadCond = False;
+            self._Wake();
             self._Thread.join(10);
         except:
             pass;
 
         self._Thread = None;
 
+    # Properly close the client from the shared event loop
+    async def CloseAsync(self):
+        if self._Task is None:
+            self.Close();
+            return;
+
+        print("[GoveeBleLight.Client::CloseAsync] Closing device " + self._DeviceID + "...");
+
+        self._ThreadCond = False;
+        self._Wake();
+
+        try:
+            await asyncio.wait_for(self._Task, 10);
+        except Exception:
+            pass;
+
+        self._Task = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def IsConnected(self):
+        l_Client = self._Client;
+        return l_Client is not None and l_Client.is_connected;
+
+    def GetDeviceID(self):
+        return self._DeviceID;
+
+    def GetModel(self):
+        return self._Model;
+
+    def GetAdapter(self):
+        return self._Adapter;
+
+    def GetLastSent(self):
+        return self._LastSent;
+
+    # Recent share of successful writes and connection attempts, 0-1
+    def GetLinkQuality(self):
+        return self._LinkQuality;
+
+    def GetStateTopic(self):
+        return self._MqttTopic;
+
+    # Publish the state on another topic from now on
+    def SetStateTopic(self, p_MqttTopic):
+        self._MqttTopic = p_MqttTopic;
+        self.PublishState();
+
+    def HasPending(self):
+        return self._HasPending();
+
+    # Something is about to be sent, the link must stay up
+    def IsBusy(self):
+        return self._HasPending() or self._Transition is not None or self._Held;
+
+    # Disconnect until the next command, the connection pool needs the slot
+    def Park(self):
+        self._Parked = True;
+        self._Wake();
+
+    # Keep pending changes until Release, used to fan out group commands
+    def Hold(self):
+        self._Held = True;
+
+    # Flush held changes, the first write is reported to p_FanOut
+    def Release(self, p_FanOut = None):
+        self._FanOut    = p_FanOut;
+        self._Held      = False;
+        self._Wake();
+
+    # Encode pending frames ahead of the flush, the writer then gets them from the codec cache
+    def PrepareFrames(self):
+        try:
+            if self._DirtyState:
+                self._Frame_SetPower(self.State);
+            if self._DirtyBrightness:
+                self._Frame_SetBrightness(self.Brightness);
+            if self._DirtyColor:
+                self._Frame_SetColor();
+            if len(self._DirtySegments) > 0:
+                self._Frame_SetSegments(self._DirtySegments);
+
+        except ValueError:
+            pass;
+
+    # State fields as stored in the device registry
+    def GetState(self):
+        return {
+            "state":        self.State,
+            "brightness":   self.Brightness,
+            "mode":         int(self.ControlMode),
+            "r":            self.R,
+            "g":            self.G,
+            "b":            self.B,
+            "temperature":  self.Temperature,
+        };
+
+    # Start from a saved state, it is sent to the light once connected
+    def RestoreState(self, p_State):
+        self._ApplyState(p_State);
+
+        # Last known state of the light, commands that never reach it revert to this
+        self._Confirmed = self.GetState();
+
+        self._DirtyState        = True;
+        self._DirtyBrightness   = True;
+        self._DirtyColor        = True;
+        self._Wake();
+
+    # Publish the current state now, ignoring the publish interval
+    def PublishState(self):
+        self._LastPublished     = None;
+        self._LastPublishTime   = 0;
+        self._Publish();
+
+    # Publish commanded changes before they are written, reverted if they can't be written in time
+    def PublishOptimistic(self):
+        if not self._HasPending():
+            return;
+
+        if self._OptimisticSince is None:
+            self._OptimisticSince = time.time();
+
+        self._LastPublishTime = 0;
+        self._Publish();
+
+    # Ask the device coroutine to send a keep alive frame
+    def RequestKeepAlive(self):
+        # Link lost while idle, the coroutine reconnects it
+        if not self.IsConnected():
+            if not self._Parked:
+                self._Wake();
+            return;
+
+        self._KeepAliveDue = True;
+        self._Wake();
+
     # ////////////////////////////////////////////////////////////////////////////
     # ////////////////////////////////////////////////////////////////////////////
 
@@ -154,12 +312,20 @@ class Client:
         self.State = 1 if p_State else 0;
         self._DirtyState = True;
 
+        # Brightness was faded to 0 before power off, restore it
+        if self.State == 1 and self._FadedOut:
+            self._FadedOut          = False;
+            self._DirtyBrightness   = True;
+
+        self._Wake();
+
     def SetBrightness(self, p_Value):
         if not 0 <= float(p_Value) <= 1:
             raise ValueError(f'SetBrightness: Brightness out of range: {p_Value}')
 
         self.Brightness         = p_Value;
         self._DirtyBrightness   = True;
+        self._Wake();
 
     def SetSegment(self, p_Segment):
         if p_Segment == -1 or p_Segment == 0:
@@ -174,6 +340,13 @@ class Client:
         self.Temperature = l_ColorTempK;
         self._DirtyColor = True;
 
+        # The whole strip is repainted, pending segment colors are obsolete
+        if self.Segment == -1:
+            self._DirtySegments     = {};
+            self._SegmentsPainted   = False;
+
+        self._Wake();
+
     def SetColorRGB(self, p_R, p_G, p_B):
         if not isinstance(p_R, int) or p_R < 0 or p_R > 255:
            raise ValueError(f'SetColorRGB: p_R out of range {p_R}');
@@ -188,60 +361,144 @@ class Client:
         self.B              = p_B;
         self._DirtyColor    = True;
 
+        # The whole strip is repainted, pending segment colors are obsolete
+        if self.Segment == -1:
+            self._DirtySegments     = {};
+            self._SegmentsPainted   = False;
+
+        self._Wake();
+
+    # Color many segments at once, { segment index: (r, g, b) }
+    def SetSegmentColors(self, p_Colors):
+        if self._Layout.ColorLayout != GoveeBleCodec.EColorLayout.Segment:
+            raise ValueError(f'SetSegmentColors: Model {self._Model} has no segment control');
+
+        for l_Index, (l_R, l_G, l_B) in p_Colors.items():
+            if not isinstance(l_Index, int) or l_Index < 0 or l_Index >= GoveeBleCodec.SEGMENT_COUNT_MAX:
+                raise ValueError(f'SetSegmentColors: Segment out of range {l_Index}');
+            if not all(isinstance(x, int) and 0 <= x <= 255 for x in (l_R, l_G, l_B)):
+                raise ValueError(f'SetSegmentColors: Color out of range {(l_R, l_G, l_B)}');
+
+        # Latest color of each segment wins, only the changed ones are kept
+        self._DirtySegments.update({ l_Index: tuple(l_Color) for l_Index, l_Color in p_Colors.items() });
+        self._Wake();
+
+    # Frames of a stream follow, no fade and fewer state publishes
+    def SetStreaming(self):
+        self._StreamUntil = time.time() + STREAM_IDLE_AFTER;
+
+        if self._Transition is not None:
+            self.SetTransition(0);
+
+    # Fade the next changes over p_Duration seconds, 0 jumps straight to the target
+    def SetTransition(self, p_Duration):
+        if p_Duration is None or float(p_Duration) <= 0:
+            # Cancel, the target is sent as is
+            if self._Transition is not None:
+                self._Transition        = None;
+                self._DirtyBrightness   = True;
+                self._DirtyColor        = True;
+                self._Wake();
+
+            return;
+
+        # Start from what the light displays right now, retargets an ongoing transition
+        self._Transition = Transition(self._GetCurrentOutput(), p_Duration);
+        self._Wake();
+
     # ////////////////////////////////////////////////////////////////////////////
     # ////////////////////////////////////////////////////////////////////////////
 
     # Thread main aync coroutine
     async def _ThreadCoroutine(self):
+        self._Loop          = asyncio.get_event_loop();
+        self._LoopThreadID  = threading.get_ident();
+        self._WakeEvent     = asyncio.Event();
+
+        if self._Balancer is not None:
+            self._Scheduler.Register(self);
+        if self._KeepAlive is not None:
+            self._KeepAlive.Register(self);
+
         while self._ThreadCond:
             try:
+                # Evicted from the pool, stay disconnected until a command arrives
+                if self._Parked:
+                    await self._Park();
+
+                    if not self._HasPending():
+                        await self._WaitForWork(None);
+                        continue;
+
+                l_WasConnected = self.IsConnected();
+
                 if not await self._Connect():
-                    time.sleep(2);
+                    self._CheckOptimistic();
+
+                    if not self._Parked:
+                        await asyncio.sleep(self._GetReconnectDelay());
                     continue;
 
-                l_Changed = True;
+                if self._Held:
+                    await self._WaitForWork(None);
+                    continue;
 
-                if self._DirtyState:
-                    if not await self._Send_SetPower(self.State):
-                        time.sleep(1);
-                        continue;
+                l_Flushed = await self._Flush();
 
-                    self._DirtyState = False;
-                elif self._DirtyBrightness:
-                    if not await self._Send_SetBrightness(self.Brightness):
-                        time.sleep(1);
-                        continue;
+                if l_Flushed is None:
+                    self._CheckOptimistic();
 
-                    self._DirtyBrightness = False;
-                elif self._DirtyColor:
-                    if not await self._Send_SetColor():
-                        time.sleep(1);
-                        continue;
+                    await asyncio.sleep(1);
+                    continue;
+
+                if l_Flushed:
+                    if self._Pool is not None:
+                        self._Pool.Touch(self, l_WasConnected);
+
+                    # Everything commanded reached the light
+                    if not self._HasPending() and self._Transition is None:
+                        self._Confirmed         = self.GetState();
+                        self._OptimisticSince   = None;
 
-                    self._DirtyColor = False;
+                    self._Publish();
+                    continue;
+
+                # Keep alive, timed by the shared scheduler when there is one
+                if self._KeepAlive is not None:
+                    l_KeepAliveDue      = self._KeepAliveDue;
+                    self._KeepAliveDue  = False;
                 else:
-                    l_Changed = False;
+                    l_KeepAliveDue = (time.time() - self._LastSent) >= 1;
 
-                    # Keep alive
-                    if (time.time() - self._LastSent) >= 1:
-                        l_AsyncRes = False;
-                        self._PingRoll += 1;
+                if l_KeepAliveDue:
+                    l_AsyncRes = False;
+                    self._PingRoll += 1;
 
-                        if self._PingRoll % 3 == 0 or self.State == 0:
-                            l_AsyncRes = await self._Send_SetPower(self.State);
-                        elif self._PingRoll % 3 == 1:
-                            l_AsyncRes = await self._Send_SetBrightness(self.Brightness);
-                        elif self._PingRoll % 3 == 2:
-                            l_AsyncRes = await self._Send_SetColor();
+                    # Status query, the answer tells if the light drifted from our state
+                    if self._Notify and (self._QueryUnanswered < QUERY_MAX_UNANSWERED or self._PingRoll % QUERY_RETRY_EVERY == 0):
+                        l_AsyncRes = await self._Send_Query();
 
-                    time.sleep(0.1);
-                    continue;
+                    # A whole strip color would erase painted segments
+                    elif self.State == 1 and self._PingRoll % 3 == 1:
+                        l_AsyncRes = await self._Send_SetBrightness(self.Brightness);
+                    elif self.State == 1 and self._PingRoll % 3 == 2 and not self._SegmentsPainted:
+                        l_AsyncRes = await self._Send_SetColor();
+                    else:
+                        l_AsyncRes = await self._Send_SetPower(self.State);
+
+                    if l_AsyncRes:
+                        METRICS.ObserveKeepAlive(self._DeviceID);
 
-                if l_Changed:
-                    print(self.BuildMqttPayload());
-                    self._MqttClient.publish(self._MqttTopic, self.BuildMqttPayload());
+                    if l_AsyncRes and self._KeepAlive is not None:
+                        self._KeepAlive.ReportKeepAlive(self);
 
-                time.sleep(0.01);
+                if self._PublishPending:
+                    self._Publish();
+
+                if self._KeepAlive is not None:
+                    await self._WaitForWork(self._GetPublishTimeout(None if self.IsConnected() else 1));
+                else:
+                    await self._WaitForWork(self._GetPublishTimeout(self._LastSent + 1 - time.time()));
 
             except Exception as l_Exception:
                 print(f"[GoveeBleLight.Client::_ThreadCoroutine] Error: {l_Exception}");
@@ -254,7 +511,7 @@ class Client:
 
                 self._Client = None;
 
-                time.sleep(2);
+                await asyncio.sleep(2);
 
         try:
             if self._Client is not None:
@@ -266,6 +523,350 @@ class Client:
 
         self._Client = None;
 
+        if self._Balancer is not None:
+            self._Scheduler.Unregister(self);
+            self._Pool.Leave(self);
+            self._Balancer.Unassign(self._DeviceID);
+        if self._KeepAlive is not None:
+            self._KeepAlive.Unregister(self);
+
+    # State fields from GetState, nothing is marked to be sent
+    def _ApplyState(self, p_State):
+        self.State          = 1 if p_State.get("state", self.State) else 0;
+        self.Brightness     = p_State.get("brightness", self.Brightness);
+        self.ControlMode    = EControlMode(p_State.get("mode", self.ControlMode));
+        self.R              = p_State.get("r", self.R);
+        self.G              = p_State.get("g", self.G);
+        self.B              = p_State.get("b", self.B);
+        self.Temperature    = p_State.get("temperature", self.Temperature);
+
+    # Send all pending changes back to back, None on failure
+    async def _Flush(self):
+        if self._Transition is not None:
+            return await self._FlushTransition();
+
+        if self._NoResponse:
+            return await self._FlushPipelined();
+
+        l_Flushed = False;
+
+        # Flags are cleared before sending so a Set* landing during the write is not lost
+        if self._DirtyState:
+            self._DirtyState = False;
+
+            if not await self._Send_SetPower(self.State):
+                self._DirtyState = True;
+                return None;
+
+            l_Flushed = True;
+
+        if self._DirtyBrightness:
+            self._DirtyBrightness = False;
+
+            if not await self._Send_SetBrightness(self.Brightness):
+                self._DirtyBrightness = True;
+                return None;
+
+            l_Flushed = True;
+
+        if self._DirtyColor:
+            self._DirtyColor = False;
+
+            if not await self._Send_SetColor():
+                self._DirtyColor = True;
+                return None;
+
+            l_Flushed = True;
+
+        if len(self._DirtySegments) > 0:
+            l_Segments          = self._DirtySegments;
+            self._DirtySegments = {};
+
+            if not await self._Send_SetSegments(l_Segments):
+                self._RestoreSegments(l_Segments);
+                return None;
+
+            self._SegmentsPainted   = True;
+            l_Flushed               = True;
+
+        return l_Flushed;
+
+    # Same as _Flush but all frames are in flight at once
+    async def _FlushPipelined(self):
+        l_State         = self._DirtyState;
+        l_Brightness    = self._DirtyBrightness;
+        l_Color         = self._DirtyColor;
+        l_Segments      = self._DirtySegments;
+        l_Frames        = [];
+
+        if l_State:
+            l_Frames.append(self._Frame_SetPower(self.State));
+        if l_Brightness:
+            l_Frames.append(self._Frame_SetBrightness(self.Brightness));
+        if l_Color:
+            l_Frames.append(self._Frame_SetColor());
+        if len(l_Segments) > 0:
+            l_Frames.extend(self._Frame_SetSegments(l_Segments));
+
+        if len(l_Frames) == 0:
+            return False;
+
+        self._DirtyState        = False;
+        self._DirtyBrightness   = False;
+        self._DirtyColor        = False;
+        self._DirtySegments     = {};
+
+        if not await self._WriteFrames(l_Frames):
+            self._DirtyState        = self._DirtyState or l_State;
+            self._DirtyBrightness   = self._DirtyBrightness or l_Brightness;
+            self._DirtyColor        = self._DirtyColor or l_Color;
+            self._RestoreSegments(l_Segments);
+            return None;
+
+        if len(l_Segments) > 0:
+            self._SegmentsPainted = True;
+
+        return True;
+
+    # Step a transition until it ends, is replaced or cancelled
+    async def _FlushTransition(self):
+        # Nothing to fade while the light stays off
+        if self.State == 0 and not self._DirtyState:
+            self._Transition        = None;
+            self._TransitionOutput  = None;
+            return await self._Flush();
+
+        l_Transition        = self._Transition;
+        l_LastBrightness    = None;
+        l_LastColor         = None;
+
+        # The target is the published state
+        self._Publish();
+
+        # Fading in, set the starting brightness before the light turns on
+        if self._DirtyState and self.State == 1:
+            self._DirtyState = False;
+
+            l_Output            = l_Transition.Sample(time.time(), self._GetTargetOutput());
+            l_LastBrightness    = self._Frame_SetBrightness(max(l_Output.Brightness, 0.01));
+
+            if not await self._WriteFrames([l_LastBrightness, self._Frame_SetPower(1)]):
+                self._DirtyState = True;
+                return None;
+
+        while self._Transition is l_Transition and self._ThreadCond:
+            l_Now       = time.time();
+            l_Output    = l_Transition.Sample(l_Now, self._GetTargetOutput());
+            l_Frames    = [];
+
+            self._DirtyBrightness   = False;
+            self._DirtyColor        = False;
+            self._KeepAliveDue      = False;
+
+            # Only frames that differ once quantized are written
+            l_Brightness    = self._Frame_SetBrightness(max(l_Output.Brightness, 0.01));
+            l_Color         = self._Frame_Color(l_Output.R, l_Output.G, l_Output.B, l_Output.Temperature);
+
+            if l_Brightness != l_LastBrightness:
+                l_Frames.append(l_Brightness);
+            # Brightness only fade over painted segments, keep their colors
+            if l_Color != l_LastColor and not self._SegmentsPainted:
+                l_Frames.append(l_Color);
+
+            if len(l_Frames) > 0 and not await self._WriteFrames(l_Frames):
+                self._DirtyBrightness   = True;
+                self._DirtyColor        = True;
+                return None;
+
+            l_LastBrightness        = l_Brightness;
+            l_LastColor             = l_Color;
+            self._TransitionOutput  = l_Output;
+
+            if l_Transition.IsDone(l_Now):
+                break;
+
+            # Frame rate follows the link, a busy link gets fewer frames
+            l_Period = min(TRANSITION_MAX_PERIOD, max(TRANSITION_MIN_PERIOD, self._WriteLatency * max(1, len(l_Frames)) * 1.5));
+            await self._WaitForFrame(l_Period);
+
+        # Replaced or cancelled, the main loop picks up the new work
+        if self._Transition is not l_Transition:
+            return True;
+
+        self._Transition        = None;
+        self._TransitionOutput  = None;
+
+        # Faded out, now turn off
+        if self._DirtyState and self.State == 0:
+            self._DirtyState = False;
+
+            if not await self._Send_SetPower(0):
+                self._DirtyState = True;
+                return None;
+
+            self._FadedOut = True;
+
+        return True;
+
+    # Output the light shows now, in the middle of a transition if there is one
+    def _GetCurrentOutput(self):
+        if self._TransitionOutput is not None:
+            return self._TransitionOutput;
+
+        # No fade frame written yet, the state fields already hold the new target
+        if self._Transition is not None:
+            return self._Transition.From;
+
+        return self._GetTargetOutput();
+
+    # Output matching the current state fields
+    def _GetTargetOutput(self):
+        l_Brightness = self.Brightness if self.State == 1 else 0;
+
+        if self.ControlMode == EControlMode.Temperature:
+            return LightOutput(l_Brightness, None, None, None, self.Temperature);
+
+        return LightOutput(l_Brightness, self.R, self.G, self.B);
+
+    # Write several frames, pipelined when writes are unacknowledged
+    async def _WriteFrames(self, p_Frames):
+        if self._NoResponse:
+            return all(await asyncio.gather(*[self._Write(l_Frame) for l_Frame in p_Frames]));
+
+        for l_Frame in p_Frames:
+            if not await self._Write(l_Frame):
+                return False;
+
+        return True;
+
+    def _HasPending(self):
+        return self._DirtyState or self._DirtyBrightness or self._DirtyColor or len(self._DirtySegments) > 0;
+
+    # Put back segment colors that failed to send, newer ones set meanwhile win
+    def _RestoreSegments(self, p_Segments):
+        l_Segments = dict(p_Segments);
+        l_Segments.update(self._DirtySegments);
+
+        self._DirtySegments = l_Segments;
+
+    # Publish the state if it changed, at most once every PUBLISH_MIN_INTERVAL
+    def _Publish(self):
+        l_Now = time.time();
+
+        # Too soon, the coroutine will publish the latest state when the interval expires.
+        # Checked first, a stream changes the color on every frame and would build a payload each time
+        if (l_Now - self._LastPublishTime) < self._GetPublishInterval():
+            self._PublishPending = True;
+            return;
+
+        l_Payload = self.BuildMqttPayload();
+
+        if l_Payload == self._LastPublished:
+            self._PublishPending = False;
+            return;
+
+        self._PublishPending    = False;
+        self._LastPublished     = l_Payload;
+        self._LastPublishTime   = l_Now;
+
+        print(l_Payload);
+        self._MqttClient.publish(self._MqttTopic, l_Payload, retain= True);
+
+        if self._Registry is not None:
+            self._Registry.Update(self._DeviceID, state= self.GetState());
+
+    # Optimistic state still not written, go back to the last state the light got and say why
+    def _CheckOptimistic(self):
+        if self._OptimisticSince is None or (time.time() - self._OptimisticSince) < OPTIMISTIC_TIMEOUT:
+            return;
+
+        l_Error = "write failed" if self.IsConnected() else "device unreachable";
+
+        print(f"[GoveeBleLight.Client::_CheckOptimistic] Device {self._DeviceID}: {l_Error}, dropping commands of the last {time.time() - self._OptimisticSince:.0f}s");
+
+        self._OptimisticSince   = None;
+        self._Transition        = None;
+        self._DirtyState        = False;
+        self._DirtyBrightness   = False;
+        self._DirtyColor        = False;
+        self._DirtySegments     = {};
+
+        self._ApplyState(self._Confirmed);
+
+        l_Payload           = json.loads(self.BuildMqttPayload());
+        l_Payload["error"]  = l_Error;
+        l_Payload           = json.dumps(l_Payload);
+
+        self._PublishPending    = False;
+        self._LastPublished     = l_Payload;
+        self._LastPublishTime   = time.time();
+
+        print(l_Payload);
+        self._MqttClient.publish(self._MqttTopic, l_Payload, retain= True);
+
+        if self._Registry is not None:
+            self._Registry.Update(self._DeviceID, state= self.GetState());
+
+    # Shorten a wait timeout so a delayed publish goes out on time
+    def _GetPublishTimeout(self, p_Timeout):
+        if not self._PublishPending:
+            return p_Timeout;
+
+        l_Timeout = self._LastPublishTime + self._GetPublishInterval() - time.time();
+
+        return l_Timeout if p_Timeout is None else min(p_Timeout, l_Timeout);
+
+    def _GetPublishInterval(self):
+        return STREAM_PUBLISH_INTERVAL if time.time() < self._StreamUntil else PUBLISH_MIN_INTERVAL;
+
+    # Delay before the next connection attempt
+    def _GetReconnectDelay(self):
+        if self._Discovery is not None and self._Discovery.IsOutOfRange(self._DeviceID):
+            return OUT_OF_RANGE_RETRY_INTERVAL;
+
+        if self._Balancer is None:
+            return 2;
+
+        return self._Scheduler.GetBackoff(self._Reconnect);
+
+    # Sleep until a Set* call lands or the timeout expires, None waits forever
+    async def _WaitForWork(self, p_Timeout):
+        if ((self._HasPending() or self._KeepAliveDue) and not self._Held) or not self._ThreadCond:
+            return;
+
+        try:
+            await asyncio.wait_for(self._WakeEvent.wait(), max(p_Timeout, 0) if p_Timeout is not None else None);
+        except asyncio.TimeoutError:
+            pass;
+
+        self._WakeEvent.clear();
+
+    # Sleep until the next transition frame or a Set* call, changes pending during
+    # the transition (power off at the end of a fade out, segments) wait for it
+    async def _WaitForFrame(self, p_Timeout):
+        if not self._ThreadCond:
+            return;
+
+        try:
+            await asyncio.wait_for(self._WakeEvent.wait(), max(p_Timeout, 0));
+        except asyncio.TimeoutError:
+            pass;
+
+        self._WakeEvent.clear();
+
+    # Wake up the device coroutine, can be called from any thread
+    def _Wake(self):
+        if self._WakeEvent is None:
+            return;
+
+        if threading.get_ident() == self._LoopThreadID:
+            self._WakeEvent.set();
+        else:
+            try:
+                self._Loop.call_soon_threadsafe(self._WakeEvent.set);
+            except RuntimeError:
+                pass;
+
     # Thread starter function
     def _ThreadStarter(self):
         while self._ThreadCond:
@@ -286,6 +887,84 @@ class Client:
         if self._Client != None and self._Client.is_connected:
             return True;
 
+        if self._KeepAlive is not None:
+            self._KeepAlive.ReportDisconnect(self);
+
+        if self._Balancer is None:
+            return await self._DoConnect();
+
+        self._Scheduler.OnDisconnected(self);
+
+        # No scanner heard it for a while, don't burn a connection slot
+        if self._Discovery is not None and self._Discovery.IsOutOfRange(self._DeviceID):
+            return False;
+
+        # Full pool, a command waits for an idle device to be parked, an idle device waits for a command
+        if self._HasPending():
+            await self._Pool.Reserve(self);
+        elif not self._Pool.TryReserve(self):
+            self._Parked = True;
+            self._Scheduler.OnParked(self);
+            return False;
+
+        self._Parked = False;
+
+        # Devices with pending commands connect first
+        await self._Scheduler.Acquire(EConnectPriority.Pending if self._HasPending() else EConnectPriority.Idle);
+
+        try:
+            l_Connected = await self._DoConnect();
+        finally:
+            self._Scheduler.Release();
+
+        self._Balancer.ReportConnect(self._Adapter, l_Connected);
+
+        if l_Connected:
+            self._Scheduler.OnConnected(self);
+            return True;
+
+        # Don't hold a slot while backing off
+        self._Pool.Leave(self);
+
+        if self._Balancer.ShouldMigrate(self._Reconnect):
+            self._Migrate();
+
+        return l_Connected;
+
+    # Move to another adapter after repeated failures
+    def _Migrate(self):
+        l_Adapter = self._Balancer.Assign(self._DeviceID, self._Adapter);
+        if l_Adapter == self._Adapter:
+            return;
+
+        print(f"[GoveeBleLight.Client::_Migrate] Moving device {self._DeviceID} from adapter {self._Adapter} to {l_Adapter}");
+
+        self._Scheduler.Unregister(self);
+        self._Pool.Leave(self);
+
+        self._Adapter   = l_Adapter;
+        self._Scheduler = self._Balancer.GetScheduler(l_Adapter);
+        self._Pool      = self._Balancer.GetPool(l_Adapter);
+        self._Reconnect = 0;
+
+        self._Scheduler.Register(self);
+
+    # Drop the link and give the pool slot back
+    async def _Park(self):
+        if self._Client is not None:
+            print("[GoveeBleLight.Client::_Park] Disconnecting idle device " + self._DeviceID);
+
+            try:
+                await self._Client.disconnect();
+            except Exception:
+                pass;
+
+            self._Client = None;
+
+        self._Pool.Leave(self);
+        self._Scheduler.OnParked(self);
+
+    async def _DoConnect(self):
         print("[GoveeBleLight.Client::Connect] re/connecting to device " + self._DeviceID);
 
         try:
@@ -296,35 +975,186 @@ class Client:
             pass;
 
         self._Client = None;
+        l_Start      = time.time();
+
+        # A cached BLEDevice skips the scan bleak runs for a bare address
+        l_Target = self._DeviceID;
+        if self._Discovery is not None:
+            l_Target = self._Discovery.Get(self._DeviceID, self._Adapter) or self._DeviceID;
 
         try:
+            # An idle device waits without timeout, a dropped link has to wake it up
             if self._Adapter is not None:
-                self._Client = BleakClient(self._DeviceID, adapter= self._Adapter);
+                self._Client = BleakClient(l_Target, adapter= self._Adapter, disconnected_callback= lambda _: self._Wake());
             else:
-                self._Client = BleakClient(self._DeviceID);
+                self._Client = BleakClient(l_Target, disconnected_callback= lambda _: self._Wake());
 
             await self._Client.connect();
             self._Reconnect = 0;
 
             print("[GoveeBleLight.Client::Connect] Connected to device " + self._DeviceID);
 
+            METRICS.ObserveConnect(self._DeviceID, self._Adapter, time.time() - l_Start, True, 0);
+
+            if self._Discovery is not None:
+                self._Discovery.ReportContact(self._DeviceID);
+
+            if self._Registry is not None:
+                self._Registry.Update(self._DeviceID, model= self._Model, adapter= self._Adapter, rssi= self._Balancer.GetRSSI(self._DeviceID, self._Adapter) if self._Balancer is not None else None);
+
+            self._ResolveCharacteristic();
+            await self._StartNotify();
+
             return self._Client.is_connected;
 
         except Exception as l_Exception:
-            self._Client = None;
+            self._Client        = None;
+            self._Reconnect    += 1;
+            self._LinkQuality   = self._LinkQuality * 0.9;
             print(f"[GoveeBleLight.Client::_Connect] Error: {l_Exception}");
 
+            METRICS.ObserveConnect(self._DeviceID, self._Adapter, time.time() - l_Start, False, self._Reconnect);
+
         return False;
 
+    # Look up the control characteristic once, for write without response
+    def _ResolveCharacteristic(self):
+        self._Characteristic    = None;
+        self._NoResponse        = False;
+
+        if self._WriteMode == EWriteMode.Default:
+            return;
+
+        try:
+            self._Characteristic = self._Client.services.get_characteristic(UUID_CONTROL_CHARACTERISTIC);
+        except Exception as l_Exception:
+            print(f"[GoveeBleLight.Client::_ResolveCharacteristic] Error: {l_Exception}");
+
+        if self._Characteristic is None:
+            return;
+
+        if "write-without-response" in self._Characteristic.properties:
+            self._NoResponse    = True;
+            self._LastVerified  = time.time();
+        else:
+            print("[GoveeBleLight.Client::_ResolveCharacteristic] Device " + self._DeviceID + " doesn't support write without response");
+
+    # Status answers come on the notify characteristic, without it keep alives rewrite the state
+    async def _StartNotify(self):
+        self._Notify            = False;
+        self._QueryUnanswered   = 0;
+
+        try:
+            await self._Client.start_notify(UUID_NOTIFY_CHARACTERISTIC, self._OnNotify);
+            self._Notify = True;
+
+        except Exception as l_Exception:
+            print(f"[GoveeBleLight.Client::_StartNotify] Device {self._DeviceID} has no status notifications: {l_Exception}");
+
+    # Status answer, adopt what the light reports unless we are about to change it
+    def _OnNotify(self, _, p_Data):
+        l_Frame = GoveeBleCodec.DecodeFrame(p_Data);
+        if l_Frame is None or l_Frame[0] != FRAME_HEADER_QUERY:
+            return;
+
+        self._QueryUnanswered = 0;
+
+        if self._HasPending() or self._Transition is not None or self._Held:
+            return;
+
+        _, l_CMD, l_Payload = l_Frame;
+        l_Drift = False;
+
+        if l_CMD == ELedCommand.SetPower:
+            l_State = 1 if l_Payload[0] else 0;
+
+            if l_State != self.State:
+                self.State  = l_State;
+                l_Drift     = True;
+
+        elif l_CMD == ELedCommand.SetBrightness:
+            # Same device value means no drift, our value is finer than the device one
+            if l_Payload[0] != self._Layout.BrightnessValue(self.Brightness):
+                self.Brightness = min(1, l_Payload[0] / self._Layout.BrightnessMax);
+                l_Drift         = True;
+
+        elif l_CMD == ELedCommand.SetColor and l_Payload[0] in (ELedMode.Manual, ELedMode.Manual2):
+            l_R, l_G, l_B = l_Payload[1], l_Payload[2], l_Payload[3];
+
+            # White from a color temperature reads back as 255,255,255
+            if self.ControlMode == EControlMode.Temperature and (l_R, l_G, l_B) == (0xFF, 0xFF, 0xFF):
+                return;
+
+            if self.ControlMode != EControlMode.Color or (l_R, l_G, l_B) != (self.R, self.G, self.B):
+                self.ControlMode    = EControlMode.Color;
+                self.R              = l_R;
+                self.G              = l_G;
+                self.B              = l_B;
+                l_Drift             = True;
+
+        if l_Drift:
+            print("[GoveeBleLight.Client::_OnNotify] Device " + self._DeviceID + " changed outside of Mqtt");
+
+            self._Confirmed = self.GetState();
+            self._Publish();
+
     # ////////////////////////////////////////////////////////////////////////////
     # ////////////////////////////////////////////////////////////////////////////
 
-    async def _Send_SetPower(self, p_State):
+    def _Frame_SetPower(self, p_State):
         if not isinstance(p_State, int) or p_State < 0 or p_State > 1:
            raise ValueError('Invalid command')
 
+        return CODEC.Encode(ELedCommand.SetPower, (1 if p_State else 0,));
+
+    def _Frame_SetBrightness(self, p_Value):
+        if not 0 <= float(p_Value) <= 1:
+            raise ValueError(f'SetBrightness: Brightness out of range: {p_Value}')
+
+        return CODEC.Encode(ELedCommand.SetBrightness, (self._Layout.BrightnessValue(p_Value),));
+
+    def _Frame_SetColor(self):
+        if self.ControlMode == EControlMode.Temperature:
+            return self._Frame_Color(0xFF, 0xFF, 0xFF, self.Temperature);
+
+        return self._Frame_Color(self.R, self.G, self.B, None);
+
+    # Color frame, temperature mode when p_Temperature is set
+    def _Frame_Color(self, p_R, p_G, p_B, p_Temperature):
+        l_R = p_R;
+        l_G = p_G;
+        l_B = p_B;
+
+        l_TK = 0
+
+        if p_Temperature is not None:
+            l_R  = l_G = l_B = 0xFF;
+            l_TK = int(p_Temperature);
+
+        if not isinstance(l_R, int) or l_R < 0 or l_R > 255:
+           raise ValueError(f'SetColorRGB: l_R out of range {l_R}');
+        if not isinstance(l_G, int) or l_G < 0 or l_G > 255:
+           raise ValueError(f'SetColorRGB: l_G out of range {l_G}');
+        if not isinstance(l_B, int) or l_B < 0 or l_B > 255:
+           raise ValueError(f'SetColorRGB: l_B out of range {l_B}');
+
+        return CODEC.Encode(ELedCommand.SetColor, self._Layout.ColorPayload(l_R, l_G, l_B, l_TK, self.Segment));
+
+    # One frame per distinct color, segments sharing it are set through the mask
+    def _Frame_SetSegments(self, p_Segments):
+        return [
+            CODEC.Encode(ELedCommand.SetColor, self._Layout.ColorPayload(l_R, l_G, l_B, 0, l_Mask))
+            for (l_R, l_G, l_B), l_Mask in GoveeBleCodec.GroupSegments(p_Segments)
+        ];
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    async def _Send_SetPower(self, p_State):
+        l_Frame = self._Frame_SetPower(p_State);
+
         try:
-            return await self._Send(ELedCommand.SetPower, [1 if p_State else 0])
+            return await self._Write(l_Frame);
 
         except Exception as l_Exception:
              print(f"[GoveeBleLight.Client::_Send_SetPower] Error: {l_Exception}");
@@ -332,16 +1162,10 @@ class Client:
         return False;
 
     async def _Send_SetBrightness(self, p_Value):
-        if not 0 <= float(p_Value) <= 1:
-            raise ValueError(f'SetBrightness: Brightness out of range: {p_Value}')
-
-        l_Brightness = round(p_Value * 0xFF);
-
-        if self._Model == "H6008" or self._Model == "H613A" or self._Model == "H613D" or self._Model == "H6172" or self._Model == "H618F":
-            l_Brightness = int(p_Value * 100);
+        l_Frame = self._Frame_SetBrightness(p_Value);
 
         try:
-            return await self._Send(ELedCommand.SetBrightness, [l_Brightness]);
+            return await self._Write(l_Frame);
 
         except Exception as l_Exception:
              print(f"[GoveeBleLight.Client::_Send_SetBrightness] Error: {l_Exception}");
@@ -349,50 +1173,57 @@ class Client:
         return False;
 
     async def _Send_SetColor(self):
-        l_R = self.R;
-        l_G = self.G;
-        l_B = self.B;
+        l_Frame = self._Frame_SetColor();
 
-        l_TK = 0
-        l_WR = 0;
-        l_WG = 0;
-        l_WB = 0;
+        try:
+            return await self._Write(l_Frame);
 
-        if self.ControlMode == EControlMode.Temperature:
-            l_R  = l_G = l_B = 0xFF;
-            l_TK = int(self.Temperature);
+        except Exception as l_Exception:
+             print(f"[GoveeBleLight.Client::_Send_SetColor] Error: {l_Exception}");
 
-        if not isinstance(l_R, int) or l_R < 0 or l_R > 255:
-           raise ValueError(f'SetColorRGB: l_R out of range {l_R}');
-        if not isinstance(l_G, int) or l_G < 0 or l_G > 255:
-           raise ValueError(f'SetColorRGB: l_G out of range {l_G}');
-        if not isinstance(l_B, int) or l_B < 0 or l_B > 255:
-           raise ValueError(f'SetColorRGB: l_B out of range {l_B}');
+        return False;
 
-        l_LedMode = ELedMode.Manual;
+    # Ask for power, brightness or color in turn, the answer is handled by _OnNotify
+    async def _Send_Query(self):
+        l_CMD = (ELedCommand.SetPower, ELedCommand.SetBrightness, ELedCommand.SetColor)[self._PingRoll % 3];
+
+        if self.State == 0 or self._SegmentsPainted:
+            l_CMD = ELedCommand.SetPower;
 
         try:
-            if self._Model == "H6008" or self._Model == "H613A" or self._Model == "H613D" or self._Model == "H6159r2":
-                l_LedMode = ELedMode.Manual2;
+            self._QueryUnanswered += 1;
+            return await self._Write(CODEC.Encode(l_CMD, (), FRAME_HEADER_QUERY));
 
-                return await self._Send(ELedCommand.SetColor, [l_LedMode, l_R, l_G, l_B, (l_TK >> 8) & 0xFF, l_TK & 0xFF, l_WR, l_WG, l_WB]);
-            elif self._Model == "H6172" or self._Model == "H618F":
-                l_LedMode = ELedMode.Segment;
+        except Exception as l_Exception:
+             print(f"[GoveeBleLight.Client::_Send_Query] Error: {l_Exception}");
 
-                return await self._Send(ELedCommand.SetColor, [l_LedMode, 0x01, l_R, l_G, l_B, (l_TK >> 8) & 0xFF, l_TK & 0xFF, l_WR, l_WG, l_WB, (self.Segment >> 8) & 0xFF, self.Segment & 0xFF]);
-            else:
-                # Todo figure out WW control
-                return await self._Send(ELedCommand.SetColor, [l_LedMode, l_R, l_G, l_B]);
+        return False;
+
+    async def _Send_SetSegments(self, p_Segments):
+        l_Frames = self._Frame_SetSegments(p_Segments);
+
+        try:
+            return await self._WriteFrames(l_Frames);
 
         except Exception as l_Exception:
-             print(f"[GoveeBleLight.Client::_Send_SetColor] Error: {l_Exception}");
+             print(f"[GoveeBleLight.Client::_Send_SetSegments] Error: {l_Exception}");
 
         return False;
 
     # ////////////////////////////////////////////////////////////////////////////
     # ////////////////////////////////////////////////////////////////////////////
 
+    # Serialized state, rebuilt only when a field changed
     def BuildMqttPayload(self):
+        l_Key = (self.ControlMode, self.State, self.Brightness, self.R, self.G, self.B, self.Temperature);
+
+        if l_Key != self._PayloadKey:
+            self._Payload       = self._BuildMqttPayload();
+            self._PayloadKey    = l_Key;
+
+        return self._Payload;
+
+    def _BuildMqttPayload(self):
         if self.ControlMode == EControlMode.Color:
             return json.dumps({
                 "state":        "ON" if self.State == 1 else "OFF",
@@ -420,38 +1251,55 @@ class Client:
     # ////////////////////////////////////////////////////////////////////////////
     # ////////////////////////////////////////////////////////////////////////////
 
-    async def _Send(self, p_CMD, p_Payload):
-        if not isinstance(p_CMD, int):
-           raise ValueError('[GoveeBleLight.Client::_Send] Invalid command');
-        if not isinstance(p_Payload, bytes) and not (isinstance(p_Payload, list) and all(isinstance(x, int) for x in p_Payload)):
-            raise ValueError('[GoveeBleLight.Client::_Send] Invalid payload');
-        if len(p_Payload) > 17:
-            raise ValueError('[GoveeBleLight.Client::_Send] Payload too long');
+    async def _Write(self, p_Frame):
+        l_Verify = False;
 
-        p_CMD       = p_CMD & 0xFF;
-        p_Payload   = bytes(p_Payload);
+        try:
+            l_Start = time.time();
+
+            if not self._NoResponse:
+                await self._Client.write_gatt_char(UUID_CONTROL_CHARACTERISTIC, p_Frame);
+            elif self._WriteMode == EWriteMode.NoResponseVerified and (l_Start - self._LastVerified) >= WRITE_VERIFY_INTERVAL:
+                l_Verify            = True;
+                self._LastVerified  = l_Start;
+                await self._Client.write_gatt_char(self._Characteristic, p_Frame, response= True);
+            else:
+                await self._Client.write_gatt_char(self._Characteristic, p_Frame, response= False);
 
-        l_Frame  = bytes([0x33, p_CMD]) + bytes(p_Payload);
-        l_Frame += bytes([0] * (19 - len(l_Frame)));
+            self._LastSent      = time.time();
+            self._WriteLatency  = self._WriteLatency * 0.8 + (self._LastSent - l_Start) * 0.2;
+            self._LinkQuality   = self._LinkQuality * 0.9 + 0.1;
 
-        l_Checksum = 0;
-        for l_Byte in l_Frame:
-            l_Checksum ^= l_Byte;
+            METRICS.ObserveWrite(self._DeviceID, self._Adapter, self._LastSent - l_Start);
+            RECORDER.RecordWrite(self._DeviceID, p_Frame);
 
-        l_Frame += bytes([l_Checksum & 0xFF]);
+            if self._FanOut is not None and self._FanOut.OnWrite(self, l_Start, self._LastSent):
+                self._FanOut = None;
 
-        try:
-            await self._Client.write_gatt_char(UUID_CONTROL_CHARACTERISTIC, l_Frame);
-            self._LastSent = time.time();
+            if self._KeepAlive is not None:
+                self._KeepAlive.ReportWrite(self._Adapter, self._LastSent - l_Start);
 
             return True;
 
         except Exception as l_Exception:
-            print(f"[GoveeBleLight.Client::_Send] Error: {l_Exception}");
+            print(f"[GoveeBleLight.Client::_Write] Error: {l_Exception}");
+
+            # Verification failed, this device drops unacknowledged writes
+            if l_Verify:
+                print("[GoveeBleLight.Client::_Write] Falling back to acknowledged writes for device " + self._DeviceID);
+                self._WriteMode = EWriteMode.Default;
+
+            self._NoResponse    = False;
+            self._LinkQuality   = self._LinkQuality * 0.9;
+
+            METRICS.ObserveDisconnect(self._DeviceID);
+
+            if self._Discovery is not None:
+                self._Discovery.ReportContact(self._DeviceID);
 
             try:
                 if self._Client is not None:
-                    print("[GoveeBleLight.Client::_Send] Disconnecting device " + self._DeviceID);
+                    print("[GoveeBleLight.Client::_Write] Disconnecting device " + self._DeviceID);
                     await self._Client.disconnect();
 
             except:
@@ -461,3 +1309,10 @@ class Client:
             self._Client     = None;
 
         return False;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Close all clients concurrently
+async def CloseAll(p_Clients):
+    await asyncio.gather(*[l_Client.CloseAsync() for l_Client in p_Clients], return_exceptions= True);
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+import asyncio;
+import bisect;
+import json;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+LATENCY_BUCKETS     = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0);
+CONNECT_BUCKETS     = (0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0);
+LOOP_LAG_BUCKETS    = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Cumulative histogram, buckets are the upper bounds
+class Histogram:
+    # Constructor
+    def __init__(self, p_Buckets):
+        self.Buckets    = p_Buckets;
+        self.Counts     = [0] * (len(p_Buckets) + 1);
+        self.Sum        = 0.0;
+        self.Count      = 0;
+
+    def Observe(self, p_Value):
+        self.Counts[bisect.bisect_left(self.Buckets, p_Value)] += 1;
+        self.Sum    += p_Value;
+        self.Count  += 1;
+
+    def Mean(self):
+        return self.Sum / self.Count if self.Count > 0 else 0.0;
+
+    # Prometheus lines, p_Labels is the already formatted label list
+    def Render(self, p_Name, p_Labels, p_Lines):
+        l_Separator = "," if len(p_Labels) > 0 else "";
+        l_Total     = 0;
+
+        for l_Bound, l_Count in zip(self.Buckets, self.Counts):
+            l_Total += l_Count;
+            p_Lines.append(f'{p_Name}_bucket{{{p_Labels}{l_Separator}le="{l_Bound}"}} {l_Total}');
+
+        p_Lines.append(f'{p_Name}_bucket{{{p_Labels}{l_Separator}le="+Inf"}} {self.Count}');
+        p_Lines.append(f'{p_Name}_sum{{{p_Labels}}} {self.Sum}');
+        p_Lines.append(f'{p_Name}_count{{{p_Labels}}} {self.Count}');
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Counters and histograms of every device, disabled until Enable is called
+class Metrics:
+    # Constructor
+    def __init__(self):
+        self.Enabled            = False;
+
+        self._DeviceLatency     = {};
+        self._AdapterLatency    = {};
+        self._Connect           = {};
+        self._Writes            = {};
+        self._KeepAlives        = {};
+        self._ConnectFailures   = {};
+        self._Disconnects       = {};
+        self._Reconnect         = {};
+        self._LoopLag           = Histogram(LOOP_LAG_BUCKETS);
+        self._LoopLagMax        = 0.0;
+        self._QueueDepthMax     = 0;
+        self._Gauges            = {};
+        self._StartTime         = time.time();
+        self._Tasks             = [];
+        self._Server            = None;
+
+    def Enable(self):
+        self.Enabled = True;
+
+    # Gauge read when metrics are rendered, p_Getter returns a number
+    def SetGauge(self, p_Name, p_Help, p_Getter):
+        self._Gauges[p_Name] = (p_Help, p_Getter);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # GATT write went through, called on every write so kept minimal
+    def ObserveWrite(self, p_DeviceID, p_Adapter, p_Latency):
+        if not self.Enabled:
+            return;
+
+        l_Histogram = self._DeviceLatency.get(p_DeviceID);
+        if l_Histogram is None:
+            l_Histogram = self._DeviceLatency[p_DeviceID] = Histogram(LATENCY_BUCKETS);
+
+        l_Histogram.Observe(p_Latency);
+
+        l_Histogram = self._AdapterLatency.get(p_Adapter);
+        if l_Histogram is None:
+            l_Histogram = self._AdapterLatency[p_Adapter] = Histogram(LATENCY_BUCKETS);
+
+        l_Histogram.Observe(p_Latency);
+
+        self._Writes[p_DeviceID] = self._Writes.get(p_DeviceID, 0) + 1;
+
+    # A keep alive frame was written, it is also counted as a write
+    def ObserveKeepAlive(self, p_DeviceID):
+        if not self.Enabled:
+            return;
+
+        self._KeepAlives[p_DeviceID] = self._KeepAlives.get(p_DeviceID, 0) + 1;
+
+    # Connection attempt, p_Reconnect is the consecutive failure count after it
+    def ObserveConnect(self, p_DeviceID, p_Adapter, p_Duration, p_Success, p_Reconnect):
+        if not self.Enabled:
+            return;
+
+        if p_Success:
+            l_Histogram = self._Connect.get(p_Adapter);
+            if l_Histogram is None:
+                l_Histogram = self._Connect[p_Adapter] = Histogram(CONNECT_BUCKETS);
+
+            l_Histogram.Observe(p_Duration);
+        else:
+            self._ConnectFailures[p_DeviceID] = self._ConnectFailures.get(p_DeviceID, 0) + 1;
+
+        self._Reconnect[p_DeviceID] = p_Reconnect;
+
+    def ObserveDisconnect(self, p_DeviceID):
+        if not self.Enabled:
+            return;
+
+        self._Disconnects[p_DeviceID] = self._Disconnects.get(p_DeviceID, 0) + 1;
+
+    def ObserveQueueDepth(self, p_Depth):
+        if self.Enabled and p_Depth > self._QueueDepthMax:
+            self._QueueDepthMax = p_Depth;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Measure how late the loop wakes a sleeping coroutine
+    async def MonitorLoop(self, p_Interval = 0.5):
+        l_Loop = asyncio.get_event_loop();
+
+        while True:
+            l_Expected = l_Loop.time() + p_Interval;
+            await asyncio.sleep(p_Interval);
+
+            l_Lag = max(0.0, l_Loop.time() - l_Expected);
+
+            self._LoopLag.Observe(l_Lag);
+            self._LoopLagMax = max(self._LoopLagMax, l_Lag);
+
+    # Prometheus text endpoint on /metrics
+    async def Serve(self, p_Host, p_Port):
+        self._Server = await asyncio.start_server(self._OnHttpRequest, p_Host, p_Port);
+
+        print(f"[GoveeBleMetrics.Metrics::Serve] Serving metrics on http://{p_Host}:{p_Port}/metrics");
+
+    # Publish a json snapshot every p_Interval seconds
+    async def PublishLoop(self, p_MqttClient, p_Topic, p_Interval):
+        while True:
+            await asyncio.sleep(p_Interval);
+
+            try:
+                p_MqttClient.publish(p_Topic, json.dumps(self.Snapshot()));
+            except Exception as l_Exception:
+                print(f"[GoveeBleMetrics.Metrics::PublishLoop] Error: {l_Exception}");
+
+    def Start(self, p_Loop, p_Port = None, p_MqttClient = None, p_Topic = None, p_Interval = 60.0):
+        self.Enable();
+
+        self._Tasks.append(p_Loop.create_task(self.MonitorLoop()));
+
+        if p_Port is not None:
+            self._Tasks.append(p_Loop.create_task(self.Serve("0.0.0.0", p_Port)));
+        if p_MqttClient is not None and p_Topic is not None:
+            self._Tasks.append(p_Loop.create_task(self.PublishLoop(p_MqttClient, p_Topic, p_Interval)));
+
+    async def Stop(self):
+        for l_Task in self._Tasks:
+            l_Task.cancel();
+
+        await asyncio.gather(*self._Tasks, return_exceptions= True);
+        self._Tasks = [];
+
+        if self._Server is not None:
+            self._Server.close();
+            await self._Server.wait_closed();
+            self._Server = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def RenderPrometheus(self):
+        l_Lines = [];
+
+        def _Counter(p_Name, p_Help, p_Values):
+            l_Lines.append(f"# HELP {p_Name} {p_Help}");
+            l_Lines.append(f"# TYPE {p_Name} counter");
+
+            for l_DeviceID, l_Value in list(p_Values.items()):
+                l_Lines.append(f'{p_Name}{{device="{l_DeviceID}"}} {l_Value}');
+
+        def _Histograms(p_Name, p_Help, p_Label, p_Histograms):
+            l_Lines.append(f"# HELP {p_Name} {p_Help}");
+            l_Lines.append(f"# TYPE {p_Name} histogram");
+
+            for l_Key, l_Histogram in list(p_Histograms.items()):
+                l_Histogram.Render(p_Name, f'{p_Label}="{l_Key if l_Key is not None else "default"}"', l_Lines);
+
+        _Histograms("goveeble_device_write_latency_seconds",    "GATT write latency per device",        "device",  self._DeviceLatency);
+        _Histograms("goveeble_adapter_write_latency_seconds",   "GATT write latency per adapter",       "adapter", self._AdapterLatency);
+        _Histograms("goveeble_connect_duration_seconds",        "Successful connection duration",       "adapter", self._Connect);
+
+        _Counter("goveeble_writes_total",           "GATT writes, keep alives included",            self._Writes);
+        _Counter("goveeble_keepalives_total",       "Keep alive writes",                            self._KeepAlives);
+        _Counter("goveeble_connect_failures_total", "Failed connection attempts",                   self._ConnectFailures);
+        _Counter("goveeble_disconnects_total",      "Links dropped on a write error",                self._Disconnects);
+
+        l_Lines.append("# HELP goveeble_reconnect_attempts Consecutive failed connection attempts");
+        l_Lines.append("# TYPE goveeble_reconnect_attempts gauge");
+        for l_DeviceID, l_Value in list(self._Reconnect.items()):
+            l_Lines.append(f'goveeble_reconnect_attempts{{device="{l_DeviceID}"}} {l_Value}');
+
+        l_Lines.append("# HELP goveeble_loop_lag_seconds Event loop wake up delay");
+        l_Lines.append("# TYPE goveeble_loop_lag_seconds histogram");
+        self._LoopLag.Render("goveeble_loop_lag_seconds", "", l_Lines);
+
+        l_Lines.append("# HELP goveeble_mqtt_queue_depth_max Deepest Mqtt message queue seen");
+        l_Lines.append("# TYPE goveeble_mqtt_queue_depth_max gauge");
+        l_Lines.append(f"goveeble_mqtt_queue_depth_max {self._QueueDepthMax}");
+
+        for l_Name, (l_Help, l_Getter) in list(self._Gauges.items()):
+            try:
+                l_Value = l_Getter();
+            except Exception:
+                continue;
+
+            l_Lines.append(f"# HELP {l_Name} {l_Help}");
+            l_Lines.append(f"# TYPE {l_Name} gauge");
+            l_Lines.append(f"{l_Name} {l_Value}");
+
+        return "\n".join(l_Lines) + "\n";
+
+    # Compact summary for the Mqtt stats topic
+    def Snapshot(self):
+        l_Writes        = sum(self._Writes.values());
+        l_KeepAlives    = sum(self._KeepAlives.values());
+
+        l_Snapshot = {
+            "uptime":           round(time.time() - self._StartTime),
+            "writes":           l_Writes,
+            "keepalives":       l_KeepAlives,
+            "keepalive_ratio":  round(l_KeepAlives / l_Writes, 3) if l_Writes > 0 else 0,
+            "connect_failures": sum(self._ConnectFailures.values()),
+            "disconnects":      sum(self._Disconnects.values()),
+            "queue_depth_max":  self._QueueDepthMax,
+            "loop_lag_max_ms":  round(self._LoopLagMax * 1000, 1),
+            "loop_lag_avg_ms":  round(self._LoopLag.Mean() * 1000, 2),
+            "adapters": {
+                (l_Adapter if l_Adapter is not None else "default"): { "writes": l_Histogram.Count, "latency_avg_ms": round(l_Histogram.Mean() * 1000, 1) }
+                for l_Adapter, l_Histogram in list(self._AdapterLatency.items())
+            },
+            "devices": {
+                l_DeviceID: {
+                    "writes":           l_Histogram.Count,
+                    "latency_avg_ms":   round(l_Histogram.Mean() * 1000, 1),
+                    "reconnects":       self._Reconnect.get(l_DeviceID, 0),
+                    "disconnects":      self._Disconnects.get(l_DeviceID, 0),
+                }
+                for l_DeviceID, l_Histogram in list(self._DeviceLatency.items())
+            },
+        };
+
+        for l_Name, (_, l_Getter) in list(self._Gauges.items()):
+            try:
+                l_Snapshot[l_Name] = l_Getter();
+            except Exception:
+                pass;
+
+        return l_Snapshot;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    async def _OnHttpRequest(self, p_Reader, p_Writer):
+        try:
+            l_Request = await asyncio.wait_for(p_Reader.readline(), 5);
+
+            # Skip headers
+            while True:
+                l_Line = await asyncio.wait_for(p_Reader.readline(), 5);
+                if l_Line in (b"\r\n", b"\n", b""):
+                    break;
+
+            l_Parts = l_Request.decode("latin-1").split();
+
+            if len(l_Parts) >= 2 and l_Parts[0] == "GET" and l_Parts[1].split("?")[0] == "/metrics":
+                l_Body      = self.RenderPrometheus().encode("utf-8");
+                l_Status    = "200 OK";
+            else:
+                l_Body      = b"Not found\n";
+                l_Status    = "404 Not Found";
+
+            p_Writer.write(
+                f"HTTP/1.0 {l_Status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(l_Body)}\r\nConnection: close\r\n\r\n".encode("latin-1")
+                + l_Body
+            );
+            await p_Writer.drain();
+
+        except Exception as l_Exception:
+            print(f"[GoveeBleMetrics.Metrics::_OnHttpRequest] Error: {l_Exception}");
+
+        finally:
+            p_Writer.close();
+
+# Shared by every client
+METRICS = Metrics();
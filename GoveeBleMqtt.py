@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+import asyncio;
+import socket;
+import threading;
+
+import paho.mqtt.client as mqtt;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Drive a paho Mqtt client from an asyncio event loop instead of polling it
+class AsyncioMqttHelper:
+    # Constructor
+    def __init__(self, p_Loop, p_MqttClient, p_ReconnectDelay = 5):
+        self._Loop              = p_Loop;
+        self._LoopThreadID      = threading.get_ident();
+        self._MqttClient        = p_MqttClient;
+        self._ReconnectDelay    = p_ReconnectDelay;
+        self._Socket            = None;
+        self._Reading           = False;
+        self._Paused            = False;
+        self._Task              = None;
+
+        self._MqttClient.on_socket_open             = self._OnSocketOpen;
+        self._MqttClient.on_socket_close            = self._OnSocketClose;
+        self._MqttClient.on_socket_register_write   = self._OnSocketRegisterWrite;
+        self._MqttClient.on_socket_unregister_write = self._OnSocketUnregisterWrite;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Start connecting, reconnect is handled in background
+    def Start(self, p_Host, p_Port, p_KeepAlive):
+        self._MqttClient.connect_async(p_Host, p_Port, p_KeepAlive);
+        self._Task = self._Loop.create_task(self._MiscCoroutine());
+
+    # Stop the background task and disconnect
+    async def Stop(self):
+        if self._Task is not None:
+            self._Task.cancel();
+
+            try:
+                await self._Task;
+            except asyncio.CancelledError:
+                pass;
+
+            self._Task = None;
+
+        try:
+            self._MqttClient.disconnect();
+        except Exception:
+            pass;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Stop reading the socket, Tcp flow control will push back on the broker
+    def PauseReading(self):
+        if self._Paused:
+            return;
+
+        self._Paused = True;
+        self._UpdateReader();
+
+    # Resume reading the socket
+    def ResumeReading(self):
+        if not self._Paused:
+            return;
+
+        self._Paused = False;
+        self._UpdateReader();
+
+    def IsPaused(self):
+        return self._Paused;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Keep alive, timeouts and reconnect
+    async def _MiscCoroutine(self):
+        l_Connected = None;
+
+        while True:
+            if self._MqttClient.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+                l_Connected = True;
+                await asyncio.sleep(1);
+                continue;
+
+            if l_Connected is not None:
+                print(f"[GoveeBleMqtt.AsyncioMqttHelper::_MiscCoroutine] Disconnected from Mqtt, trying to reconnect in {self._ReconnectDelay} seconds...");
+                await asyncio.sleep(self._ReconnectDelay);
+
+            l_Connected = False;
+
+            # Paho connects with a blocking socket, an unreachable broker would freeze every light for the timeout
+            try:
+                await self._Loop.run_in_executor(None, self._MqttClient.reconnect);
+            except Exception as l_Exception:
+                print(f"[GoveeBleMqtt.AsyncioMqttHelper::_MiscCoroutine] Error: {l_Exception}");
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _OnSocketOpen(self, p_MqttClient, p_UserData, p_Socket):
+        def _Open():
+            self._Socket = p_Socket;
+            self._Socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048);
+            self._UpdateReader();
+
+        self._CallSoon(_Open);
+
+    def _OnSocketClose(self, p_MqttClient, p_UserData, p_Socket):
+        def _Close():
+            if self._Reading:
+                self._Loop.remove_reader(p_Socket);
+                self._Reading = False;
+
+            self._Socket = None;
+
+        self._CallSoon(_Close);
+
+    def _OnSocketRegisterWrite(self, p_MqttClient, p_UserData, p_Socket):
+        self._CallSoon(self._Loop.add_writer, p_Socket, self._OnWritable);
+
+    def _OnSocketUnregisterWrite(self, p_MqttClient, p_UserData, p_Socket):
+        self._CallSoon(self._Loop.remove_writer, p_Socket);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _OnReadable(self):
+        self._MqttClient.loop_read();
+
+    def _OnWritable(self):
+        self._MqttClient.loop_write();
+
+    def _UpdateReader(self):
+        if self._Socket is None:
+            return;
+
+        if self._Paused and self._Reading:
+            self._Loop.remove_reader(self._Socket);
+            self._Reading = False;
+        elif not self._Paused and not self._Reading:
+            self._Loop.add_reader(self._Socket, self._OnReadable);
+            self._Reading = True;
+
+    # Paho callbacks can come from other threads (publish from a device thread)
+    def _CallSoon(self, p_Callback, *p_Args):
+        if threading.get_ident() == self._LoopThreadID:
+            p_Callback(*p_Args);
+        else:
+            self._Loop.call_soon_threadsafe(p_Callback, *p_Args);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Parsed command topic
+class Route:
+    # Constructor
+    def __init__(self, p_Topic, p_DeviceID, p_Model, p_StateTopic):
+        self.Topic      = p_Topic;
+        self.DeviceID   = p_DeviceID;
+        self.Model      = p_Model;
+        self.StateTopic = p_StateTopic;
+
+# Map command topics to devices, each topic is parsed once
+class TopicRouter:
+    # Constructor
+    def __init__(self, p_Prefix, p_Suffix = "/command", p_StateSuffix = "/state"):
+        self._Prefix        = p_Prefix;
+        self._Suffix        = p_Suffix;
+        self._StateSuffix   = p_StateSuffix;
+        self._PrefixLen     = len(p_Prefix);
+        self._SuffixLen     = len(p_Suffix);
+        self._Routes        = {};
+
+    # Route of a device from its topic id, MacAddressLowerNoDots_ModelNumber
+    def RouteDevice(self, p_DeviceKey):
+        return self.Route(self._Prefix + p_DeviceKey + self._Suffix);
+
+    # Get the route for a topic, None if the topic isn't a device command
+    def Route(self, p_Topic):
+        l_Route = self._Routes.get(p_Topic);
+        if l_Route is not None:
+            return l_Route;
+
+        if not p_Topic.startswith(self._Prefix) or not p_Topic.endswith(self._Suffix):
+            return None;
+
+        l_DeviceID = p_Topic[self._PrefixLen:len(p_Topic)-self._SuffixLen];
+        l_Model    = "generic";
+
+        if len(l_DeviceID) == 0 or "/" in l_DeviceID:
+            return None;
+
+        if "_" in l_DeviceID:
+            l_Model    = l_DeviceID[l_DeviceID.find('_')+1:];
+            l_DeviceID = l_DeviceID[:l_DeviceID.find('_')];
+
+        l_DeviceID  = ':'.join(l_DeviceID[i:i+2] for i in range(0, len(l_DeviceID), 2));
+        l_Route     = Route(p_Topic, l_DeviceID, l_Model, p_Topic[:len(p_Topic)-self._SuffixLen] + self._StateSuffix);
+
+        self._Routes[p_Topic] = l_Route;
+
+        return l_Route;
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+import asyncio;
+import collections;
+import os;
+import sys;
+import threading;
+import time;
+import traceback;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Functions reported on their own in the summary, matched on the name prefix
+PROFILE_HOT_PATHS   = ("_Flush", "_Write", "_Send_", "_ThreadCoroutine", "OnPayloadReceived", "BuildMqttPayload");
+PROFILE_MAX_TIME    = 300.0;
+PROFILE_TOP         = 15;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# "function (file.py:line)" key of a frame
+def _FrameKey(p_Frame):
+    l_Code = p_Frame.f_code;
+    return f"{l_Code.co_name} ({os.path.basename(l_Code.co_filename)}:{l_Code.co_firstlineno})";
+
+# Innermost last, like a traceback
+def _Stack(p_Frame):
+    l_Stack = [];
+
+    while p_Frame is not None:
+        l_Stack.append(_FrameKey(p_Frame));
+        p_Frame = p_Frame.f_back;
+
+    l_Stack.reverse();
+    return l_Stack;
+
+# Name of the coroutine a task runs, with where it is suspended or running
+def _DescribeTask(p_Task):
+    if p_Task is None:
+        return None;
+
+    l_Coroutine = p_Task.get_coro();
+    l_Name      = getattr(l_Coroutine, "__qualname__", None) or repr(l_Coroutine);
+
+    return f"{p_Task.get_name()} {l_Name}";
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Sample the stack of every thread from a background thread, no tracing hook
+# so the server runs at full speed while being profiled
+class SamplingProfiler:
+    # Constructor
+    def __init__(self, p_Duration, p_Interval = 0.005):
+        self.Duration   = min(max(0.1, p_Duration), PROFILE_MAX_TIME);
+        self.Interval   = max(0.001, p_Interval);
+        self.Samples    = 0;
+
+        self._Stacks    = collections.Counter();
+        self._Thread    = None;
+        self._Stop      = threading.Event();
+
+    def Run(self, p_OnDone):
+        self._Thread = threading.Thread(target= self._Sample, args= (p_OnDone,), name= "GoveeBleProfiler", daemon= True);
+        self._Thread.start();
+
+    def Stop(self):
+        self._Stop.set();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Share of samples spent in a function (inclusive) and on top of the stack (self)
+    def GetStats(self):
+        l_Inclusive = collections.Counter();
+        l_Self      = collections.Counter();
+
+        # First entry is the thread name
+        for l_Stack, l_Count in self._Stacks.items():
+            l_Self[l_Stack[-1]] += l_Count;
+
+            # Recursion counts once per sample
+            for l_Key in set(l_Stack[1:]):
+                l_Inclusive[l_Key] += l_Count;
+
+        return l_Inclusive, l_Self;
+
+    def GetSummary(self):
+        l_Inclusive, l_Self = self.GetStats();
+        l_Total             = max(1, self.Samples);
+
+        def _Share(p_Count):
+            return round(100.0 * p_Count / l_Total, 2);
+
+        l_HotPaths = {};
+
+        for l_Key, l_Count in l_Inclusive.items():
+            l_Name = l_Key.split(" ", 1)[0];
+
+            if l_Name.startswith(PROFILE_HOT_PATHS):
+                l_HotPaths[l_Key] = _Share(l_Count);
+
+        return {
+            "duration":     self.Duration,
+            "interval":     self.Interval,
+            "samples":      self.Samples,
+            "hot_paths":    dict(sorted(l_HotPaths.items(), key= lambda x: -x[1])),
+            "top_self":     { l_Key: _Share(l_Count) for l_Key, l_Count in l_Self.most_common(PROFILE_TOP) },
+            "top_total":    { l_Key: _Share(l_Count) for l_Key, l_Count in l_Inclusive.most_common(PROFILE_TOP) },
+        };
+
+    # Collapsed stacks (flamegraph.pl, speedscope) followed by the per function stats
+    def Write(self, p_Path):
+        l_Inclusive, l_Self = self.GetStats();
+
+        os.makedirs(os.path.dirname(p_Path) or ".", exist_ok= True);
+
+        with open(p_Path + ".folded", "w", encoding= "utf-8") as l_File:
+            for l_Stack, l_Count in self._Stacks.most_common():
+                l_File.write(";".join(l_Stack) + " " + str(l_Count) + "\n");
+
+        with open(p_Path + ".txt", "w", encoding= "utf-8") as l_File:
+            l_File.write(f"{self.Samples} samples, {self.Interval * 1000:.1f}ms interval, {self.Duration:.1f}s\n\n");
+            l_File.write(f"{'total %':>8} {'self %':>8}  function\n");
+
+            for l_Key, l_Count in l_Inclusive.most_common():
+                l_File.write(f"{100.0 * l_Count / max(1, self.Samples):>8.2f} {100.0 * l_Self[l_Key] / max(1, self.Samples):>8.2f}  {l_Key}\n");
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _Sample(self, p_OnDone):
+        l_Self  = threading.get_ident();
+        l_Names = {};
+        l_End   = time.monotonic() + self.Duration;
+
+        while time.monotonic() < l_End and not self._Stop.is_set():
+            for l_ThreadID, l_Frame in sys._current_frames().items():
+                if l_ThreadID == l_Self:
+                    continue;
+
+                # Idle threads blocked in select or a condition are not interesting
+                if l_Frame.f_code.co_name in ("select", "wait", "_worker", "poll"):
+                    continue;
+
+                if l_ThreadID not in l_Names:
+                    l_Names = { l_Thread.ident: l_Thread.name for l_Thread in threading.enumerate() };
+
+                self._Stacks[(l_Names.get(l_ThreadID, str(l_ThreadID)),) + tuple(_Stack(l_Frame))] += 1;
+
+            self.Samples += 1;
+            time.sleep(self.Interval);
+
+        p_OnDone(self);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Always on, a heartbeat on the loop and a watchdog thread grabbing the loop stack
+# when the heartbeat is late, the stack while stalled points at the blocking code
+class LoopWatchdog:
+    # Constructor
+    def __init__(self, p_Threshold = 0.25, p_OnStall = None):
+        self.Threshold  = p_Threshold;
+        self.Stalls     = 0;
+
+        self._OnStall   = p_OnStall;
+        self._Loop      = None;
+        self._LoopID    = None;
+        self._Beat      = 0.0;
+        self._Stall     = None;
+        self._Task      = None;
+        self._Thread    = None;
+        self._Stop      = threading.Event();
+
+    def Start(self, p_Loop):
+        self._Loop      = p_Loop;
+        self._LoopID    = threading.get_ident();
+        self._Beat      = time.monotonic();
+        self._Task      = p_Loop.create_task(self._HeartbeatCoroutine());
+        self._Thread    = threading.Thread(target= self._Watch, name= "GoveeBleLoopWatchdog", daemon= True);
+        self._Thread.start();
+
+    async def Stop(self):
+        self._Stop.set();
+
+        if self._Task is not None:
+            self._Task.cancel();
+            await asyncio.gather(self._Task, return_exceptions= True);
+            self._Task = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    async def _HeartbeatCoroutine(self):
+        l_Interval = self.Threshold / 4;
+
+        while True:
+            self._Beat = time.monotonic();
+            await asyncio.sleep(l_Interval);
+
+            l_Stall = self._Stall;
+            if l_Stall is None:
+                continue;
+
+            # Back on the loop, the stall is over and can be reported from here
+            self._Stall         = None;
+            self.Stalls        += 1;
+            l_Stall["duration"] = round(time.monotonic() - l_Stall.pop("since"), 3);
+
+            print(f"[GoveeBleProfiler.LoopWatchdog] Loop stalled {l_Stall['duration'] * 1000:.0f}ms in {l_Stall['task']}\n  " + "\n  ".join(l_Stall["stack"][-8:]));
+
+            if self._OnStall is not None:
+                try:
+                    self._OnStall(l_Stall);
+                except Exception as l_Exception:
+                    print(f"[GoveeBleProfiler.LoopWatchdog::_HeartbeatCoroutine] Error: {l_Exception}");
+
+    def _Watch(self):
+        while not self._Stop.wait(self.Threshold / 4):
+            l_Late = time.monotonic() - self._Beat;
+
+            if l_Late < self.Threshold or self._Stall is not None:
+                continue;
+
+            l_Frame = sys._current_frames().get(self._LoopID);
+            if l_Frame is None:
+                continue;
+
+            try:
+                l_Task = _DescribeTask(asyncio.current_task(self._Loop));
+            except Exception:
+                l_Task = None;
+
+            self._Stall = {
+                "since":    self._Beat + self.Threshold / 4,
+                "task":     l_Task or "callback",
+                "stack":    [f"{os.path.basename(x.filename)}:{x.lineno} {x.name}: {x.line}" for x in traceback.extract_stack(l_Frame, limit= 24)],
+            };
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+import asyncio;
+import json;
+import struct;
+import threading;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+RECORD_MAGIC    = b"GBLR\x01";
+
+RECORD_MQTT     = 0x4D      # Mqtt message received, key is the topic
+RECORD_WRITE    = 0x57      # GATT frame written, key is the device id
+
+# Kind, seconds since the start, key length, payload length
+_RECORD = struct.Struct(">BdHI");
+_LENGTH = struct.Struct(">H");
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Append Mqtt input and GATT output to a binary log, disabled until Start is called.
+# Records are packed in memory on the hot path, the file is written by a coroutine
+class Recorder:
+    # Constructor
+    def __init__(self):
+        self.Enabled        = False;
+
+        self._Path          = None;
+        self._Start         = 0.0;
+        self._Buffer        = bytearray();
+        self._Records       = 0;
+        self._Lock          = threading.Lock();
+        self._Task          = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def RecordMqtt(self, p_Topic, p_Payload):
+        if self.Enabled:
+            self._Append(RECORD_MQTT, p_Topic, p_Payload);
+
+    def RecordWrite(self, p_DeviceID, p_Frame):
+        if self.Enabled:
+            self._Append(RECORD_WRITE, p_DeviceID, p_Frame);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # p_Metadata is stored in the header, the replay tool reads the zone from it
+    def Start(self, p_Loop, p_Path, p_Metadata = None, p_FlushInterval = 1.0):
+        l_Metadata = json.dumps(dict(p_Metadata or {}, start= time.time())).encode("utf-8");
+
+        with open(p_Path, "wb") as l_File:
+            l_File.write(RECORD_MAGIC + _LENGTH.pack(len(l_Metadata)) + l_Metadata);
+
+        self._Path      = p_Path;
+        self._Start     = time.perf_counter();
+        self.Enabled    = True;
+        self._Task      = p_Loop.create_task(self._Coroutine(p_FlushInterval));
+
+        print(f"[GoveeBleRecorder.Recorder::Start] Recording to {p_Path}");
+
+    async def Stop(self):
+        if not self.Enabled:
+            return;
+
+        self.Enabled = False;
+
+        if self._Task is not None:
+            self._Task.cancel();
+            await asyncio.gather(self._Task, return_exceptions= True);
+            self._Task = None;
+
+        self.Flush();
+
+        print(f"[GoveeBleRecorder.Recorder::Stop] {self._Records} records written to {self._Path}");
+
+    def Flush(self):
+        with self._Lock:
+            l_Data          = bytes(self._Buffer);
+            self._Buffer    = bytearray();
+
+        if len(l_Data) == 0:
+            return;
+
+        try:
+            with open(self._Path, "ab") as l_File:
+                l_File.write(l_Data);
+
+        except Exception as l_Exception:
+            print(f"[GoveeBleRecorder.Recorder::Flush] Error: {l_Exception}");
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _Append(self, p_Kind, p_Key, p_Payload):
+        l_Key = p_Key.encode("utf-8");
+
+        with self._Lock:
+            self._Buffer += _RECORD.pack(p_Kind, time.perf_counter() - self._Start, len(l_Key), len(p_Payload));
+            self._Buffer += l_Key;
+            self._Buffer += p_Payload;
+            self._Records += 1;
+
+    async def _Coroutine(self, p_FlushInterval):
+        while True:
+            await asyncio.sleep(p_FlushInterval);
+            self.Flush();
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Header metadata and [(kind, seconds since the start, key, payload), ...] of a log, a truncated last record is skipped
+def ReadLog(p_Path):
+    with open(p_Path, "rb") as l_File:
+        l_Data = l_File.read();
+
+    if not l_Data.startswith(RECORD_MAGIC):
+        raise ValueError(f'[GoveeBleRecorder::ReadLog] {p_Path} is not a recording');
+
+    l_Offset    = len(RECORD_MAGIC);
+    l_Length,   = _LENGTH.unpack_from(l_Data, l_Offset);
+    l_Offset   += _LENGTH.size;
+    l_Metadata  = json.loads(l_Data[l_Offset:l_Offset + l_Length].decode("utf-8"));
+    l_Offset   += l_Length;
+    l_Records   = [];
+
+    while l_Offset + _RECORD.size <= len(l_Data):
+        l_Kind, l_Time, l_KeyLength, l_PayloadLength = _RECORD.unpack_from(l_Data, l_Offset);
+
+        l_Start = l_Offset + _RECORD.size;
+        l_End   = l_Start + l_KeyLength + l_PayloadLength;
+
+        if l_End > len(l_Data):
+            break;
+
+        l_Records.append((l_Kind, l_Time, l_Data[l_Start:l_Start + l_KeyLength].decode("utf-8"), l_Data[l_Start + l_KeyLength:l_End]));
+        l_Offset = l_End;
+
+    return l_Metadata, l_Records;
+
+# Shared by the server and every client
+RECORDER = Recorder();
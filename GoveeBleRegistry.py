@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+import asyncio;
+import json;
+import os;
+import threading;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Known devices kept on disk as a json lines journal, one record per change
+class DeviceRegistry:
+    # Constructor
+    def __init__(self, p_Path, p_FlushInterval = 1.0, p_CompactRatio = 4):
+        self._Path          = p_Path;
+        self._FlushInterval = p_FlushInterval;
+        self._CompactRatio  = p_CompactRatio;
+        self._Devices       = {};
+        self._Dirty         = set();
+        self._Lines         = 0;
+        self._Lock          = threading.Lock();
+        self._Task          = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Replay the journal, later records of a device override earlier ones
+    def Load(self):
+        if not os.path.exists(self._Path):
+            return self._Devices;
+
+        with open(self._Path, "r", encoding= "utf-8") as l_File:
+            for l_Line in l_File:
+                l_Line = l_Line.strip();
+                if len(l_Line) == 0:
+                    continue;
+
+                self._Lines += 1;
+
+                try:
+                    l_Record = json.loads(l_Line);
+
+                    # Forgotten device
+                    if l_Record.get("removed"):
+                        self._Devices.pop(l_Record["id"], None);
+                    else:
+                        self._Devices.setdefault(l_Record["id"], {}).update(l_Record);
+
+                # A crash can leave a truncated last line
+                except (ValueError, KeyError) as l_Exception:
+                    print(f"[GoveeBleRegistry.DeviceRegistry::Load] Skipping bad record: {l_Exception}");
+
+        print(f"[GoveeBleRegistry.DeviceRegistry::Load] {len(self._Devices)} known devices");
+
+        return self._Devices;
+
+    def GetDevices(self):
+        with self._Lock:
+            return { l_DeviceID: dict(l_Record) for l_DeviceID, l_Record in self._Devices.items() };
+
+    # Merge fields into a device record, written on the next flush
+    def Update(self, p_DeviceID, **p_Fields):
+        with self._Lock:
+            l_Record = self._Devices.setdefault(p_DeviceID, { "id": p_DeviceID });
+
+            for l_Key, l_Value in p_Fields.items():
+                if l_Value is not None and l_Record.get(l_Key) != l_Value:
+                    l_Record[l_Key] = l_Value;
+                    l_Record["time"] = round(time.time());
+                    self._Dirty.add(p_DeviceID);
+
+    # Forget a device, it is not pre-connected on the next start anymore
+    def Remove(self, p_DeviceID):
+        with self._Lock:
+            if self._Devices.pop(p_DeviceID, None) is not None:
+                self._Dirty.add(p_DeviceID);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Start(self, p_Loop):
+        self._Task = p_Loop.create_task(self._Coroutine());
+
+    async def Stop(self):
+        if self._Task is not None:
+            self._Task.cancel();
+
+            try:
+                await self._Task;
+            except asyncio.CancelledError:
+                pass;
+
+            self._Task = None;
+
+        self.Flush();
+
+    # Append changed devices, rewrite the whole file once the journal is mostly stale
+    def Flush(self):
+        with self._Lock:
+            if len(self._Dirty) == 0:
+                return;
+
+            l_Records   = [dict(self._Devices[l_DeviceID]) if l_DeviceID in self._Devices else { "id": l_DeviceID, "removed": True } for l_DeviceID in self._Dirty];
+            l_Compact   = self._Lines + len(l_Records) > max(64, len(self._Devices) * self._CompactRatio);
+            self._Dirty = set();
+
+            if l_Compact:
+                l_Records = [dict(l_Record) for l_Record in self._Devices.values()];
+
+        try:
+            if l_Compact:
+                self._Rewrite(l_Records);
+            else:
+                with open(self._Path, "a", encoding= "utf-8") as l_File:
+                    l_File.write("".join(json.dumps(l_Record) + "\n" for l_Record in l_Records));
+
+                self._Lines += len(l_Records);
+
+        except Exception as l_Exception:
+            print(f"[GoveeBleRegistry.DeviceRegistry::Flush] Error: {l_Exception}");
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _Rewrite(self, p_Records):
+        l_Temp = self._Path + ".tmp";
+
+        with open(l_Temp, "w", encoding= "utf-8") as l_File:
+            l_File.write("".join(json.dumps(l_Record) + "\n" for l_Record in p_Records));
+            l_File.flush();
+            os.fsync(l_File.fileno());
+
+        os.replace(l_Temp, self._Path);
+
+        self._Lines = len(p_Records);
+
+    async def _Coroutine(self):
+        while True:
+            await asyncio.sleep(self._FlushInterval);
+            self.Flush();
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+import asyncio;
+import json;
+import time;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# A packet is a list of records, mac (6 bytes) + color count (1 byte) + count * rgb,
+# one color paints the whole light, more colors paint segments 0..count-1
+STREAM_RECORD_HEADER    = 7
+STREAM_MAX_COLORS       = 16
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# (device id, [(r, g, b), ...], record start, record end) of every record, stops at the first truncated one
+def DecodePacket(p_Data):
+    l_Records   = [];
+    l_Offset    = 0;
+    l_Size      = len(p_Data);
+
+    while l_Offset + STREAM_RECORD_HEADER <= l_Size:
+        l_Count = p_Data[l_Offset + 6];
+        l_End   = l_Offset + STREAM_RECORD_HEADER + l_Count * 3;
+
+        if l_Count == 0 or l_Count > STREAM_MAX_COLORS or l_End > l_Size:
+            break;
+
+        l_DeviceID  = p_Data[l_Offset:l_Offset + 6].hex(":");
+        l_Colors    = [tuple(p_Data[x:x + 3]) for x in range(l_Offset + STREAM_RECORD_HEADER, l_End, 3)];
+
+        l_Records.append((l_DeviceID, l_Colors, l_Offset, l_End));
+        l_Offset = l_End;
+
+    return l_Records;
+
+# Record of one device, p_DeviceID as aa:bb:cc:dd:ee:ff
+def EncodeRecord(p_DeviceID, p_Colors):
+    if len(p_Colors) == 0 or len(p_Colors) > STREAM_MAX_COLORS:
+        raise ValueError('[GoveeBleStream::EncodeRecord] Invalid color count');
+
+    return bytes.fromhex(p_DeviceID.replace(":", "")) + bytes((len(p_Colors),)) + bytes(x for l_Color in p_Colors for x in l_Color);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Frame counters of a device since the last report
+class StreamStats:
+    # Constructor
+    def __init__(self):
+        self.Frames     = 0;
+        self.Drops      = 0;
+        self.Since      = time.time();
+
+# Apply streamed frames straight to the clients, no json and no per frame publish.
+# A client keeps only its newest color, a frame landing before the previous one
+# was written replaces it and counts as dropped
+class StreamReceiver:
+    # Constructor
+    def __init__(self, p_GetClient, p_ReportInterval = 10.0):
+        self._GetClient         = p_GetClient;
+        self._ReportInterval    = p_ReportInterval;
+        self._Stats             = {};
+        self._Unknown           = 0;
+        self._Rejected          = set();
+        self._Transport         = None;
+        self._Task              = None;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Feed(self, p_Data):
+        for l_DeviceID, l_Colors, _, _ in DecodePacket(p_Data):
+            l_Client = self._GetClient(l_DeviceID);
+            if l_Client is None:
+                self._Unknown += 1;
+                continue;
+
+            l_Stats = self._Stats.get(l_DeviceID);
+            if l_Stats is None:
+                l_Stats = self._Stats[l_DeviceID] = StreamStats();
+
+            l_Stats.Frames += 1;
+
+            if l_Client.HasPending():
+                l_Stats.Drops += 1;
+
+            try:
+                l_Client.SetStreaming();
+
+                if len(l_Colors) == 1:
+                    l_Client.SetColorRGB(*l_Colors[0]);
+                else:
+                    l_Client.SetSegmentColors(dict(enumerate(l_Colors)));
+
+            except ValueError as l_Exception:
+                if l_DeviceID not in self._Rejected:
+                    self._Rejected.add(l_DeviceID);
+                    print(f"[GoveeBleStream.StreamReceiver::Feed] Device {l_DeviceID}: {l_Exception}");
+
+    # Received and written frames per second and share of dropped frames of every streaming device
+    def GetStats(self, p_Reset = False):
+        l_Now       = time.time();
+        l_Result    = {};
+
+        for l_DeviceID, l_Stats in list(self._Stats.items()):
+            l_Elapsed = max(0.001, l_Now - l_Stats.Since);
+
+            l_Result[l_DeviceID] = {
+                "fps_in":       round(l_Stats.Frames / l_Elapsed, 1),
+                "fps":          round((l_Stats.Frames - l_Stats.Drops) / l_Elapsed, 1),
+                "drop_rate":    round(l_Stats.Drops / l_Stats.Frames, 3) if l_Stats.Frames > 0 else 0.0,
+            };
+
+            if p_Reset:
+                if l_Stats.Frames == 0:
+                    del self._Stats[l_DeviceID];
+                else:
+                    self._Stats[l_DeviceID] = StreamStats();
+
+        return l_Result;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Report on p_Topic, optionally listen for packets on an Udp port
+    def Start(self, p_Loop, p_MqttClient, p_Topic, p_UdpPort = None):
+        self._Task = p_Loop.create_task(self._ReportCoroutine(p_MqttClient, p_Topic));
+
+        if p_UdpPort is not None:
+            p_Loop.create_task(self._Listen(p_Loop, p_UdpPort));
+
+    async def Stop(self):
+        if self._Transport is not None:
+            self._Transport.close();
+            self._Transport = None;
+
+        if self._Task is not None:
+            self._Task.cancel();
+            await asyncio.gather(self._Task, return_exceptions= True);
+            self._Task = None;
+
+    async def _Listen(self, p_Loop, p_UdpPort):
+        try:
+            self._Transport, _ = await p_Loop.create_datagram_endpoint(lambda: StreamProtocol(self), local_addr= ("0.0.0.0", p_UdpPort));
+            print(f"[GoveeBleStream.StreamReceiver] Listening for frames on udp port {p_UdpPort}");
+
+        except Exception as l_Exception:
+            print(f"[GoveeBleStream.StreamReceiver::_Listen] Error: {l_Exception}");
+
+    async def _ReportCoroutine(self, p_MqttClient, p_Topic):
+        while True:
+            await asyncio.sleep(self._ReportInterval);
+
+            l_Stats = self.GetStats(True);
+            if len(l_Stats) == 0:
+                continue;
+
+            try:
+                p_MqttClient.publish(p_Topic, json.dumps({ "devices": l_Stats, "unknown": self._Unknown }));
+            except Exception as l_Exception:
+                print(f"[GoveeBleStream.StreamReceiver::_ReportCoroutine] Error: {l_Exception}");
+
+# Udp packets to the receiver, one packet can carry many devices
+class StreamProtocol(asyncio.DatagramProtocol):
+    # Constructor
+    def __init__(self, p_Receiver):
+        self._Receiver = p_Receiver;
+
+    def datagram_received(self, p_Data, p_Address):
+        self._Receiver.Feed(p_Data);
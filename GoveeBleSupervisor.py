@@ -0,0 +1,441 @@
+#!/usr/bin/env python
+import asyncio;
+import collections;
+import json;
+import multiprocessing;
+import socket;
+import struct;
+import threading;
+import time;
+
+import GoveeBleMqtt;
+import GoveeBleStream;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+FRAME_MESSAGE   = 0x4D      # Supervisor to worker, topic \0 payload
+FRAME_CONNECTED = 0x43      # Supervisor to worker, broker (re)connected
+FRAME_PUBLISH   = 0x50      # Worker to supervisor, retain byte, topic \0 payload
+
+_HEADER = struct.Struct(">IB");
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+def EncodeFrame(p_Type, p_Body = b""):
+    return _HEADER.pack(len(p_Body), p_Type) + p_Body;
+
+# (type, body), None once the other side closed the channel
+async def ReadFrame(p_Reader):
+    try:
+        l_Length, l_Type = _HEADER.unpack(await p_Reader.readexactly(_HEADER.size));
+        return l_Type, await p_Reader.readexactly(l_Length);
+
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None;
+
+def EncodeMessage(p_Topic, p_Payload):
+    return p_Topic.encode("utf-8") + b"\0" + (p_Payload if isinstance(p_Payload, bytes) else str(p_Payload).encode("utf-8"));
+
+def DecodeMessage(p_Body):
+    l_Topic, _, l_Payload = p_Body.partition(b"\0");
+    return l_Topic.decode("utf-8"), l_Payload;
+
+# Same fields as a paho message, what main.Mqtt_OnMessage expects
+class IpcMessage:
+    # Constructor
+    def __init__(self, p_Topic, p_Payload):
+        self.topic      = p_Topic;
+        self.payload    = p_Payload;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Worker side of the channel, stands in for both the paho client and the asyncio Mqtt helper
+class WorkerLink:
+    # Constructor
+    def __init__(self, p_Loop, p_Socket, p_OnMessage, p_OnConnect, p_OnClosed):
+        self._Loop          = p_Loop;
+        self._LoopThreadID  = threading.get_ident();
+        self._Socket        = p_Socket;
+        self._OnMessage     = p_OnMessage;
+        self._OnConnect     = p_OnConnect;
+        self._OnClosed      = p_OnClosed;
+        self._Writer        = None;
+        self._Resumed       = asyncio.Event();
+        self._Task          = None;
+
+        self._Resumed.set();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Start(self, *_):
+        self._Task = self._Loop.create_task(self._ReadCoroutine());
+
+    async def Stop(self):
+        if self._Task is not None:
+            self._Task.cancel();
+            await asyncio.gather(self._Task, return_exceptions= True);
+            self._Task = None;
+
+        if self._Writer is not None:
+            self._Writer.close();
+            self._Writer = None;
+
+    # Stop reading the channel, the supervisor sees its buffer grow and stops reading the broker
+    def PauseReading(self):
+        self._Resumed.clear();
+
+    def ResumeReading(self):
+        self._Resumed.set();
+
+    def IsPaused(self):
+        return not self._Resumed.is_set();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # paho.mqtt.client.Client.publish, the supervisor publishes for us
+    def publish(self, p_Topic, p_Payload = None, qos = 0, retain = False):
+        l_Frame = EncodeFrame(FRAME_PUBLISH, (b"\1" if retain else b"\0") + EncodeMessage(p_Topic, p_Payload if p_Payload is not None else b""));
+
+        if threading.get_ident() == self._LoopThreadID:
+            self._Send(l_Frame);
+        else:
+            self._Loop.call_soon_threadsafe(self._Send, l_Frame);
+
+    # Subscriptions are held by the supervisor
+    def subscribe(self, p_Topic, qos = 0):
+        pass;
+
+    def _Send(self, p_Frame):
+        if self._Writer is not None:
+            self._Writer.write(p_Frame);
+
+    async def _ReadCoroutine(self):
+        l_Reader, self._Writer = await asyncio.open_connection(sock= self._Socket);
+
+        while True:
+            await self._Resumed.wait();
+
+            l_Frame = await ReadFrame(l_Reader);
+            if l_Frame is None:
+                break;
+
+            l_Type, l_Body = l_Frame;
+
+            try:
+                if l_Type == FRAME_MESSAGE:
+                    self._OnMessage(self, None, IpcMessage(*DecodeMessage(l_Body)));
+                elif l_Type == FRAME_CONNECTED:
+                    self._OnConnect(self, None, None, None);
+
+            except Exception as l_Exception:
+                print(f"[GoveeBleSupervisor.WorkerLink::_ReadCoroutine] Error: {l_Exception}");
+
+        # Supervisor is gone or asked us to stop
+        self._OnClosed();
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# One worker process serving a zone through an adapter
+class Shard:
+    # Constructor
+    def __init__(self, p_Index, p_Zone, p_Adapter):
+        self.Index      = p_Index;
+        self.Zone       = p_Zone;
+        self.Adapter    = p_Adapter;
+        self.Name       = f"zone{p_Zone}" + (f"_{p_Adapter}" if p_Adapter is not None else "");
+        self.Process    = None;
+        self.Writer     = None;
+        self.Devices    = set();
+        self.Backlog    = collections.deque(maxlen= 1024);
+        self.Dropped    = 0;
+        self.Restarts   = 0;
+        self.StartTime  = 0;
+        self.RetryTime  = 0;
+        self.Task       = None;
+
+# Single Mqtt ingress routing commands to worker processes by device ownership
+class Supervisor:
+    # Constructor
+    # p_WorkerOptions is given to every worker, runtime flags parsed by the supervisor process
+    def __init__(self, p_Shards, p_WorkerTarget, p_MqttClient, p_GetTopicPrefix, p_Groups = None, p_BufferLimit = 1 << 20, p_WorkerOptions = None):
+        self._Shards        = [Shard(l_Index, l_Zone, l_Adapter) for l_Index, (l_Zone, l_Adapter) in enumerate(p_Shards)];
+        self._WorkerTarget  = p_WorkerTarget;
+        self._MqttClient    = p_MqttClient;
+        self._GetPrefix     = p_GetTopicPrefix;
+        self._Groups        = p_Groups if p_Groups is not None else {};
+        self._BufferLimit   = p_BufferLimit;
+        self._WorkerOptions = dict(p_WorkerOptions or {});
+        self._Owners        = {};
+        self._Zones         = sorted(set(str(l_Shard.Zone) for l_Shard in self._Shards));
+        self._Routers       = { l_Zone: GoveeBleMqtt.TopicRouter(p_GetTopicPrefix(l_Zone) + "light/") for l_Zone in self._Zones };
+        self._Context       = multiprocessing.get_context("spawn");
+        self._Loop          = None;
+        self._MqttHelper    = None;
+        self._Draining      = 0;
+        self._Stopping      = False;
+        self._Task          = None;
+
+    def GetShards(self):
+        return self._Shards;
+
+    # Topics to subscribe on the broker, every zone served by a worker
+    def GetTopics(self):
+        l_Topics = [];
+
+        for l_Zone in self._Zones:
+            l_Topics += [self._GetPrefix(l_Zone) + "light/+/command", self._GetPrefix(l_Zone) + "group/+/command", self._GetPrefix(l_Zone) + "bulk/command", self._GetPrefix(l_Zone) + "debug/profile", self._GetPrefix(l_Zone) + "stream"];
+
+        return l_Topics;
+
+    # Known owner of a device, from the registry of a worker
+    def Own(self, p_DeviceID, p_ShardIndex):
+        if p_DeviceID in self._Owners:
+            return;
+
+        self._Owners[p_DeviceID] = self._Shards[p_ShardIndex];
+        self._Shards[p_ShardIndex].Devices.add(p_DeviceID);
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def Start(self, p_Loop, p_MqttHelper):
+        self._Loop          = p_Loop;
+        self._MqttHelper    = p_MqttHelper;
+
+        for l_Shard in self._Shards:
+            self._Spawn(l_Shard);
+
+        self._Task = p_Loop.create_task(self._MonitorCoroutine());
+
+    # Close every channel, workers exit on their own, stragglers are terminated
+    async def Stop(self):
+        self._Stopping = True;
+
+        if self._Task is not None:
+            self._Task.cancel();
+            await asyncio.gather(self._Task, return_exceptions= True);
+
+        for l_Shard in self._Shards:
+            if l_Shard.Writer is not None:
+                l_Shard.Writer.close();
+
+        for l_Shard in self._Shards:
+            if l_Shard.Process is None:
+                continue;
+
+            await self._Loop.run_in_executor(None, l_Shard.Process.join, 15);
+
+            if l_Shard.Process.is_alive():
+                print(f"[GoveeBleSupervisor.Supervisor::Stop] Worker {l_Shard.Name} did not exit, terminating");
+                l_Shard.Process.terminate();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def OnBrokerConnected(self):
+        for l_Shard in self._Shards:
+            self._SendTo(l_Shard, EncodeFrame(FRAME_CONNECTED));
+
+    # Route a broker message to the worker(s) owning its devices
+    def Dispatch(self, p_Topic, p_Payload):
+        for l_Zone in self._Zones:
+            l_Prefix = self._GetPrefix(l_Zone);
+
+            if not p_Topic.startswith(l_Prefix):
+                continue;
+
+            l_Route = self._Routers[l_Zone].Route(p_Topic);
+            if l_Route is not None:
+                self._SendMessage(self._GetOwner(l_Zone, l_Route.DeviceID), p_Topic, p_Payload);
+                return;
+
+            # Stream packets are split per worker, devices nobody owns yet are skipped
+            if p_Topic == l_Prefix + "stream":
+                l_PerShard = {};
+
+                for l_DeviceID, _, l_Start, l_End in GoveeBleStream.DecodePacket(p_Payload):
+                    l_Shard = self._Owners.get(l_DeviceID);
+                    if l_Shard is not None:
+                        l_PerShard.setdefault(l_Shard, []).append(p_Payload[l_Start:l_End]);
+
+                for l_Shard, l_Records in l_PerShard.items():
+                    self._SendMessage(l_Shard, p_Topic, b"".join(l_Records));
+
+                return;
+
+            # Every worker of the zone profiles itself
+            if p_Topic == l_Prefix + "debug/profile":
+                for l_Shard in self._Shards:
+                    if str(l_Shard.Zone) == l_Zone:
+                        self._SendMessage(l_Shard, p_Topic, p_Payload);
+
+                return;
+
+            # Group and bulk commands are split into one bulk command per worker
+            if p_Topic == l_Prefix + "bulk/command":
+                l_Commands = json.loads(p_Payload.decode("utf-8","ignore"));
+            elif p_Topic.startswith(l_Prefix + "group/") and p_Topic.endswith("/command"):
+                l_Name = p_Topic[len(l_Prefix + "group/"):-len("/command")];
+
+                if l_Name not in self._Groups:
+                    print("[GoveeBleSupervisor.Supervisor::Dispatch] Unknown group " + l_Name);
+                    return;
+
+                l_Payload   = json.loads(p_Payload.decode("utf-8","ignore"));
+                l_Commands  = { l_DeviceKey: l_Payload for l_DeviceKey in self._Groups[l_Name] };
+            else:
+                return;
+
+            l_PerShard = {};
+
+            for l_DeviceKey, l_Command in l_Commands.items():
+                l_Route = self._Routers[l_Zone].RouteDevice(l_DeviceKey);
+                if l_Route is None:
+                    continue;
+
+                l_Shard = self._GetOwner(l_Zone, l_Route.DeviceID);
+                if l_Shard is not None:
+                    l_PerShard.setdefault(l_Shard, {})[l_DeviceKey] = l_Command;
+
+            for l_Shard, l_ShardCommands in l_PerShard.items():
+                self._SendMessage(l_Shard, l_Prefix + "bulk/command", json.dumps(l_ShardCommands).encode("utf-8"));
+
+            return;
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    # Owner of a device, new devices go to the least loaded worker of their zone
+    def _GetOwner(self, p_Zone, p_DeviceID):
+        l_Shard = self._Owners.get(p_DeviceID);
+        if l_Shard is not None:
+            return l_Shard;
+
+        l_Candidates = [l_Shard for l_Shard in self._Shards if str(l_Shard.Zone) == p_Zone];
+        if len(l_Candidates) == 0:
+            return None;
+
+        l_Shard = min(l_Candidates, key= lambda x: len(x.Devices));
+        self.Own(p_DeviceID, l_Shard.Index);
+
+        print(f"[GoveeBleSupervisor.Supervisor] Device {p_DeviceID} assigned to worker {l_Shard.Name}");
+
+        return l_Shard;
+
+    def _SendMessage(self, p_Shard, p_Topic, p_Payload):
+        if p_Shard is None:
+            return;
+
+        self._SendTo(p_Shard, EncodeFrame(FRAME_MESSAGE, EncodeMessage(p_Topic, p_Payload)));
+
+    def _SendTo(self, p_Shard, p_Frame):
+        # Worker restarting, delivered once it is back
+        if p_Shard.Writer is None:
+            # Backlog full, the oldest frame is dropped
+            if len(p_Shard.Backlog) == p_Shard.Backlog.maxlen:
+                if p_Shard.Dropped == 0:
+                    print(f"[GoveeBleSupervisor.Supervisor::_SendTo] Worker {p_Shard.Name} backlog full, dropping oldest frames");
+
+                p_Shard.Dropped += 1;
+
+            p_Shard.Backlog.append(p_Frame);
+            return;
+
+        p_Shard.Writer.write(p_Frame);
+
+        # Worker is not keeping up, stop reading the broker until its channel drains
+        if p_Shard.Writer.transport.get_write_buffer_size() > self._BufferLimit and self._MqttHelper is not None:
+            self._Draining += 1;
+            self._MqttHelper.PauseReading();
+            self._Loop.create_task(self._Drain(p_Shard.Writer));
+
+    async def _Drain(self, p_Writer):
+        try:
+            await p_Writer.drain();
+        except Exception:
+            pass;
+
+        self._Draining -= 1;
+
+        if self._Draining == 0:
+            self._MqttHelper.ResumeReading();
+
+    # ////////////////////////////////////////////////////////////////////////////
+    # ////////////////////////////////////////////////////////////////////////////
+
+    def _Spawn(self, p_Shard):
+        l_Parent, l_Child = socket.socketpair();
+
+        p_Shard.Process     = self._Context.Process(target= self._WorkerTarget, args= (p_Shard.Zone, p_Shard.Adapter, p_Shard.Index, l_Child, self._WorkerOptions), name= "GoveeBle_" + p_Shard.Name, daemon= True);
+        p_Shard.Process.start();
+        p_Shard.StartTime   = time.time();
+
+        l_Child.close();
+
+        print(f"[GoveeBleSupervisor.Supervisor::_Spawn] Worker {p_Shard.Name} started, pid {p_Shard.Process.pid}");
+
+        p_Shard.Task = self._Loop.create_task(self._ShardCoroutine(p_Shard, l_Parent));
+
+    # Publish for the worker until its channel closes
+    async def _ShardCoroutine(self, p_Shard, p_Socket):
+        l_Reader, l_Writer = await asyncio.open_connection(sock= p_Socket);
+
+        p_Shard.Writer = l_Writer;
+
+        if p_Shard.Dropped > 0:
+            print(f"[GoveeBleSupervisor.Supervisor::_ShardCoroutine] Worker {p_Shard.Name} back, {p_Shard.Dropped} frames dropped while it was down");
+            p_Shard.Dropped = 0;
+
+        while len(p_Shard.Backlog) > 0:
+            l_Writer.write(p_Shard.Backlog.popleft());
+
+        while True:
+            l_Frame = await ReadFrame(l_Reader);
+            if l_Frame is None:
+                break;
+
+            l_Type, l_Body = l_Frame;
+
+            if l_Type == FRAME_PUBLISH:
+                l_Topic, l_Payload = DecodeMessage(l_Body[1:]);
+                self._MqttClient.publish(l_Topic, l_Payload, retain= l_Body[0] == 1);
+
+        p_Shard.Writer = None;
+        l_Writer.close();
+
+    # Restart crashed workers, with backoff when they keep crashing
+    async def _MonitorCoroutine(self):
+        while not self._Stopping:
+            await asyncio.sleep(1);
+
+            l_Now = time.time();
+
+            for l_Shard in self._Shards:
+                if l_Shard.Process is None or l_Shard.Process.is_alive():
+                    continue;
+
+                if l_Shard.RetryTime == 0:
+                    # Ran long enough, it was not a crash loop
+                    if l_Now - l_Shard.StartTime > 60:
+                        l_Shard.Restarts = 0;
+
+                    l_Delay             = min(60, 2 ** l_Shard.Restarts);
+                    l_Shard.RetryTime   = l_Now + l_Delay;
+                    l_Shard.Restarts   += 1;
+
+                    print(f"[GoveeBleSupervisor.Supervisor] Worker {l_Shard.Name} exited with code {l_Shard.Process.exitcode}, restarting in {l_Delay}s");
+
+                if l_Now >= l_Shard.RetryTime:
+                    l_Shard.RetryTime = 0;
+
+                    if l_Shard.Writer is not None:
+                        l_Shard.Writer.close();
+                        l_Shard.Writer = None;
+
+                    self._Spawn(l_Shard);
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+import time;
+
+from GoveeBleColor import convert_K_to_RGB_Fast;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# What a light displays, Temperature is None in color mode
+class LightOutput:
+    # Constructor
+    def __init__(self, p_Brightness, p_R, p_G, p_B, p_Temperature = None):
+        self.Brightness     = p_Brightness;
+        self.R              = p_R;
+        self.G              = p_G;
+        self.B              = p_B;
+        self.Temperature    = p_Temperature;
+
+    def RGB(self):
+        if self.Temperature is not None:
+            return convert_K_to_RGB_Fast(self.Temperature);
+
+        return self.R, self.G, self.B;
+
+    def SameColor(self, p_Other):
+        return p_Other is not None and self.Temperature == p_Other.Temperature and (self.Temperature is not None or (self.R == p_Other.R and self.G == p_Other.G and self.B == p_Other.B));
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Interpolate from a light output to a target over a duration
+class Transition:
+    # Constructor
+    def __init__(self, p_From, p_Duration):
+        self.From       = p_From;
+        self.Duration   = max(0.0, float(p_Duration));
+        self.Start      = time.time();
+
+    def IsDone(self, p_Now):
+        return (p_Now - self.Start) >= self.Duration;
+
+    # Output at p_Now, the target is read on every frame so it can move
+    def Sample(self, p_Now, p_To):
+        if self.Duration <= 0:
+            return p_To;
+
+        l_T = (p_Now - self.Start) / self.Duration;
+        if l_T >= 1:
+            return p_To;
+
+        l_T             = max(0.0, l_T);
+        l_From          = self.From;
+        l_Brightness    = l_From.Brightness + (p_To.Brightness - l_From.Brightness) * l_T;
+
+        # White to white is interpolated in mired, perceptually linear
+        if l_From.Temperature is not None and p_To.Temperature is not None:
+            l_FromMired = 1000000 / l_From.Temperature;
+            l_ToMired   = 1000000 / p_To.Temperature;
+
+            return LightOutput(l_Brightness, None, None, None, 1000000 / (l_FromMired + (l_ToMired - l_FromMired) * l_T));
+
+        l_FromR, l_FromG, l_FromB   = l_From.RGB();
+        l_ToR, l_ToG, l_ToB         = p_To.RGB();
+
+        return LightOutput(
+            l_Brightness,
+            int(round(l_FromR + (l_ToR - l_FromR) * l_T)),
+            int(round(l_FromG + (l_ToG - l_FromG) * l_T)),
+            int(round(l_FromB + (l_ToB - l_FromB) * l_T))
+        );
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Micro benchmark of the frame codec against the previous inline encoder
+import os;
+import sys;
+import timeit;
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."));
+
+import GoveeBleCodec;
+
+from GoveeBleCodec import ELedCommand;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Encoder as it was inlined in GoveeBleLight.Client._Send
+def LegacyEncode(p_CMD, p_Payload):
+    if not isinstance(p_CMD, int):
+       raise ValueError('Invalid command');
+    if not isinstance(p_Payload, bytes) and not (isinstance(p_Payload, list) and all(isinstance(x, int) for x in p_Payload)):
+        raise ValueError('Invalid payload');
+    if len(p_Payload) > 17:
+        raise ValueError('Payload too long');
+
+    p_CMD       = p_CMD & 0xFF;
+    p_Payload   = bytes(p_Payload);
+
+    l_Frame  = bytes([0x33, p_CMD]) + bytes(p_Payload);
+    l_Frame += bytes([0] * (19 - len(l_Frame)));
+
+    l_Checksum = 0;
+    for l_Byte in l_Frame:
+        l_Checksum ^= l_Byte;
+
+    l_Frame += bytes([l_Checksum & 0xFF]);
+
+    return l_Frame;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+def main():
+    l_Iterations    = int(sys.argv[1]) if len(sys.argv) > 1 else 200000;
+    l_Layout        = GoveeBleCodec.GetLayout("H618F");
+    l_Payload       = l_Layout.ColorPayload(255, 128, 64, 0, -1);
+    l_Codec         = GoveeBleCodec.FrameCodec();
+    l_Uncached      = GoveeBleCodec.FrameCodec(0);
+
+    if LegacyEncode(ELedCommand.SetColor, list(l_Payload)) != l_Codec.Encode(ELedCommand.SetColor, l_Payload):
+        print("[Benchmark] Codec output differs from legacy encoder");
+        sys.exit(1);
+
+    l_Cases = [
+        ("legacy",          lambda: LegacyEncode(ELedCommand.SetColor, list(l_Payload))),
+        ("codec miss",      lambda: l_Uncached.Encode(ELedCommand.SetColor, l_Payload)),
+        ("codec hit",       lambda: l_Codec.Encode(ELedCommand.SetColor, l_Payload)),
+    ];
+
+    for l_Name, l_Case in l_Cases:
+        l_Time = min(timeit.repeat(l_Case, number= l_Iterations, repeat= 5));
+        print(f"[Benchmark] {l_Name:<12} {l_Time / l_Iterations * 1e9:8.1f} ns/frame");
+
+if __name__ == "__main__":
+    main();
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# End to end benchmark, Mqtt command to GATT write through main.py on simulated lights
+import asyncio;
+import contextlib;
+import getopt;
+import json;
+import os;
+import sys;
+import threading;
+import time;
+
+import fakes;
+
+import GoveeBleCodec;
+import GoveeBleConnection;
+import GoveeBleKeepAlive;
+import GoveeBleLight;
+import GoveeBleMetrics;
+import GoveeBleMqtt;
+import GoveeBleStream;
+import main as Server;
+
+from GoveeBleCodec import ELedCommand;
+
+MODEL: str = "H6008";
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Match GATT writes with the commands that caused them
+class LatencyProbe:
+    # Constructor
+    def __init__(self):
+        self.Samples    = [];
+        self.Coalesced  = 0;
+
+        self._Pending   = {};
+        self._Lock      = threading.Lock();
+
+    def Expect(self, p_DeviceID, p_Frame):
+        with self._Lock:
+            self._Pending.setdefault(p_DeviceID, []).append((time.perf_counter(), p_Frame));
+
+    def PendingCount(self):
+        with self._Lock:
+            return sum(len(l_Pending) for l_Pending in self._Pending.values());
+
+    # Commands superseded before reaching the link are served by this write too
+    def OnWrite(self, p_DeviceID, p_Frame, p_Time):
+        with self._Lock:
+            l_Pending = self._Pending.get(p_DeviceID);
+            if not l_Pending:
+                return;
+
+            for l_Index in range(len(l_Pending) - 1, -1, -1):
+                if l_Pending[l_Index][1] != p_Frame:
+                    continue;
+
+                for l_Sent, _ in l_Pending[:l_Index + 1]:
+                    self.Samples.append(p_Time - l_Sent);
+
+                self.Coalesced += l_Index;
+                del l_Pending[:l_Index + 1];
+                return;
+
+    def Percentile(self, p_Percent):
+        if len(self.Samples) == 0:
+            return float("nan");
+
+        l_Samples = sorted(self.Samples);
+        return l_Samples[min(len(l_Samples) - 1, int(len(l_Samples) * p_Percent / 100))];
+
+# Highest thread count seen while a scenario runs
+async def SampleThreads(p_Result):
+    while True:
+        p_Result["threads"] = max(p_Result.get("threads", 0), threading.active_count());
+        await asyncio.sleep(0.05);
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Same setup as main.main, minus the broker connection and signals
+def StartServer(p_MqttClient, p_SharedLoop):
+    l_Loop = asyncio.get_event_loop();
+
+    Server.SHARED_LOOP      = p_SharedLoop;
+    Server.CLIENTS          = {};
+    Server.MESSAGE_QUEUE    = asyncio.Queue(maxsize= Server.MQTT_QUEUE_SIZE);
+    Server.MQTT_HELPER      = fakes.FakeMqttHelper();
+    Server.TOPIC_ROUTER     = GoveeBleMqtt.TopicRouter(Server.GetTopicPrefix() + "light/");
+    Server.GROUP_ROUTES     = { l_Name: [Server.TOPIC_ROUTER.RouteDevice(l_DeviceKey) for l_DeviceKey in l_DeviceKeys] for l_Name, l_DeviceKeys in Server.GROUPS.items() };
+    Server.STREAM           = GoveeBleStream.StreamReceiver(lambda p_DeviceID: Server.CLIENTS.get(p_DeviceID));
+    Server.BALANCER         = None;
+    Server.KEEPALIVE        = None;
+
+    if p_SharedLoop:
+        Server.BALANCER     = GoveeBleConnection.AdapterBalancer([], Server.MAX_CONCURRENT_CONNECTS);
+        Server.KEEPALIVE    = GoveeBleKeepAlive.KeepAliveScheduler(Server.KEEPALIVE_INTERVAL, Server.KEEPALIVE_MODEL_INTERVALS);
+        Server.KEEPALIVE.Start(l_Loop);
+
+    return l_Loop.create_task(Server.ProcessMessages(p_MqttClient));
+
+async def StopServer(p_Consumer):
+    await GoveeBleLight.CloseAll(list(Server.CLIENTS.values()));
+
+    if Server.KEEPALIVE is not None:
+        await Server.KEEPALIVE.Stop();
+
+    p_Consumer.cancel();
+
+    Server.CLIENTS = {};
+
+# Publish a command the way the Mqtt client would deliver it
+def SendCommand(p_MqttClient, p_DeviceKey, p_Payload):
+    l_Topic = Server.GetTopicPrefix() + "light/" + p_DeviceKey + "/command";
+    Server.Mqtt_OnMessage(p_MqttClient, None, fakes.FakeMqttMessage(l_Topic, json.dumps(p_Payload).encode("utf-8")));
+
+async def WaitFor(p_Condition, p_Timeout):
+    l_End = time.perf_counter() + p_Timeout;
+
+    while not p_Condition() and time.perf_counter() < l_End:
+        await asyncio.sleep(0.01);
+
+    return p_Condition();
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+async def RunScenario(p_Devices, p_Options):
+    l_Link      = fakes.FakeLink(p_Options["write_latency"], p_Options["write_jitter"], p_Options["connect_latency"], p_Options["connect_failures"], p_Options["disconnects"]);
+    l_Mqtt      = fakes.FakeMqttClient();
+    l_Probe     = LatencyProbe();
+    l_Result    = { "devices": p_Devices };
+    l_Layout    = GoveeBleCodec.GetLayout(MODEL);
+
+    fakes.Install(l_Link);
+
+    l_Consumer  = StartServer(l_Mqtt, p_Options["shared"]);
+    l_Sampler   = asyncio.get_event_loop().create_task(SampleThreads(l_Result));
+    l_Keys      = ["a4c138%06x_%s" % (l_Index, MODEL) for l_Index in range(p_Devices)];
+    l_IDs       = { l_Key: Server.TOPIC_ROUTER.RouteDevice(l_Key).DeviceID for l_Key in l_Keys };
+
+    # Connect storm, every device appears at once
+    l_Start = time.perf_counter();
+
+    for l_Key in l_Keys:
+        SendCommand(l_Mqtt, l_Key, { "state": "ON" });
+
+    l_Result["connected"]       = await WaitFor(lambda: len(l_Link.Connected) >= p_Devices, p_Options["timeout"]);
+    l_Result["connect_time"]    = time.perf_counter() - l_Start;
+    l_Result["peak_connecting"] = l_Link.PeakConnecting;
+    l_Result["connect_retries"] = l_Link.ConnectFailures;
+
+    # Commands, paced at the requested message rate
+    l_Link.ResetCounters();
+    l_Link.OnWrite = l_Probe.OnWrite;
+
+    l_Start     = time.perf_counter();
+    l_CPU       = time.process_time();
+    l_Sent      = 0;
+    l_Period    = 0.01;
+    l_Batch     = max(1, int(p_Options["rate"] * l_Period));
+
+    for l_Step in range(p_Options["commands"]):
+        # A new value on every step so every command changes the light
+        l_Brightness    = 255 - (l_Step * 7) % 200;
+        l_Frame         = GoveeBleCodec.CODEC.Encode(ELedCommand.SetBrightness, (l_Layout.BrightnessValue(l_Brightness / 255),));
+
+        for l_Key in l_Keys:
+            l_Probe.Expect(l_IDs[l_Key], l_Frame);
+            SendCommand(l_Mqtt, l_Key, { "brightness": l_Brightness });
+
+            l_Sent += 1;
+            if l_Sent % l_Batch == 0:
+                await asyncio.sleep(l_Period);
+
+    await WaitFor(lambda: l_Probe.PendingCount() == 0, p_Options["timeout"]);
+
+    l_Elapsed = time.perf_counter() - l_Start;
+
+    l_Result["commands"]    = l_Sent;
+    l_Result["lost"]        = l_Probe.PendingCount();
+    l_Result["coalesced"]   = l_Probe.Coalesced;
+    l_Result["p50"]         = l_Probe.Percentile(50);
+    l_Result["p95"]         = l_Probe.Percentile(95);
+    l_Result["p99"]         = l_Probe.Percentile(99);
+    l_Result["writes_s"]    = l_Link.Writes / l_Elapsed;
+    l_Result["cpu"]         = time.process_time() - l_CPU;
+    l_Result["publishes"]   = l_Mqtt.Publishes;
+
+    # Idle, only keep alives go out
+    l_Link.OnWrite = None;
+    l_Link.ResetCounters();
+
+    l_Start = time.perf_counter();
+    l_CPU   = time.process_time();
+
+    await asyncio.sleep(p_Options["idle"]);
+
+    l_Elapsed = time.perf_counter() - l_Start;
+
+    l_Result["keepalive_s"] = l_Link.Writes / l_Elapsed;
+    l_Result["idle_cpu"]    = (time.process_time() - l_CPU) / l_Elapsed;
+
+    l_Sampler.cancel();
+    await StopServer(l_Consumer);
+
+    return l_Result;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+def PrintResults(p_Results):
+    print(f"{'devices':>8} {'connect':>9} {'peak':>5} {'retry':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'lost':>5} {'coal':>5} {'writes/s':>9} {'cpu s':>7} {'threads':>8} {'ka/s':>7} {'idle cpu':>9}");
+
+    for l_Result in p_Results:
+        print(
+            f"{l_Result['devices']:>8}"
+            f" {l_Result['connect_time']:>8.2f}s{'' if l_Result['connected'] else '!'}"
+            f" {l_Result['peak_connecting']:>5}"
+            f" {l_Result['connect_retries']:>6}"
+            f" {l_Result['p50'] * 1000:>8.1f}"
+            f" {l_Result['p95'] * 1000:>8.1f}"
+            f" {l_Result['p99'] * 1000:>8.1f}"
+            f" {l_Result['lost']:>5}"
+            f" {l_Result['coalesced']:>5}"
+            f" {l_Result['writes_s']:>9.1f}"
+            f" {l_Result['cpu']:>7.2f}"
+            f" {l_Result['threads']:>8}"
+            f" {l_Result['keepalive_s']:>7.1f}"
+            f" {l_Result['idle_cpu'] * 100:>8.1f}%"
+        );
+
+def Usage():
+    print("e2e.py [-d 1,10,100,500] [-c commands] [-r rate] [-i idle] [-l write_latency] [-f connect_failures] [-x disconnects] [-m] [-n] [-t]");
+    print("  -m  record metrics, to measure their overhead");
+    print("  -n  write without response");
+    print("  -t  legacy one thread per device");
+
+async def Run(argv):
+    l_Devices = [1, 10, 100, 500];
+    l_Options = {
+        "commands":         5,
+        "rate":             500,
+        "idle":             5.0,
+        "timeout":          120.0,
+        "write_latency":    0.02,
+        "write_jitter":     0.01,
+        "connect_latency":  0.05,
+        "connect_failures": 0.1,
+        "disconnects":      0.0,
+        "shared":           True,
+    };
+
+    l_Arguments, _ = getopt.getopt(argv, "hd:c:r:i:l:f:x:mnt");
+    for l_Option, l_Argument in l_Arguments:
+        if l_Option == "-h":
+            Usage();
+            sys.exit();
+
+        elif l_Option == "-d":
+            l_Devices = [int(x) for x in l_Argument.split(",")];
+        elif l_Option == "-c":
+            l_Options["commands"] = int(l_Argument);
+        elif l_Option == "-r":
+            l_Options["rate"] = float(l_Argument);
+        elif l_Option == "-i":
+            l_Options["idle"] = float(l_Argument);
+        elif l_Option == "-l":
+            l_Options["write_latency"] = float(l_Argument);
+        elif l_Option == "-f":
+            l_Options["connect_failures"] = float(l_Argument);
+        elif l_Option == "-x":
+            l_Options["disconnects"] = float(l_Argument);
+        elif l_Option == "-m":
+            GoveeBleMetrics.METRICS.Enable();
+        elif l_Option == "-n":
+            GoveeBleLight.WRITE_MODES[MODEL] = GoveeBleLight.EWriteMode.NoResponse;
+        elif l_Option == "-t":
+            l_Options["shared"] = False;
+
+    l_Results = [];
+
+    for l_Count in l_Devices:
+        print(f"[Benchmark] {l_Count} devices...", flush= True);
+
+        # The server logs every command, keep the report readable
+        with open(os.devnull, "w") as l_Null, contextlib.redirect_stdout(l_Null):
+            l_Results.append(await RunScenario(l_Count, l_Options));
+
+    PrintResults(l_Results);
+
+if __name__ == "__main__":
+    asyncio.run(Run(sys.argv[1:]));
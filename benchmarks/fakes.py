@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# Simulated BLE link and Mqtt broker, lets the server run without real lights
+import asyncio;
+import functools;
+import operator;
+import os;
+import random;
+import sys;
+import threading;
+import time;
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."));
+
+import GoveeBleCodec;
+import GoveeBleLight;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Behavior and counters shared by every simulated device
+class FakeLink:
+    # Constructor
+    def __init__(self, p_WriteLatency = 0.02, p_WriteJitter = 0.01, p_ConnectLatency = 0.05, p_ConnectFailureRate = 0.0, p_DisconnectRate = 0.0, p_Seed = 0):
+        self.WriteLatency       = p_WriteLatency;
+        self.WriteJitter        = p_WriteJitter;
+        self.ConnectLatency     = p_ConnectLatency;
+        self.ConnectFailureRate = p_ConnectFailureRate;
+        self.DisconnectRate     = p_DisconnectRate;
+
+        self.Writes             = 0;
+        self.Connects           = 0;
+        self.ConnectFailures    = 0;
+        self.Disconnects        = 0;
+        self.Connecting         = 0;
+        self.PeakConnecting     = 0;
+        self.Connected          = set();
+        self.OnWrite            = None;
+
+        self._Random            = random.Random(p_Seed);
+        self._Lock              = threading.Lock();
+
+    def Random(self):
+        with self._Lock:
+            return self._Random.random();
+
+    def ResetCounters(self):
+        with self._Lock:
+            self.Writes             = 0;
+            self.Connects           = 0;
+            self.ConnectFailures    = 0;
+            self.Disconnects        = 0;
+            self.PeakConnecting     = self.Connecting;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+class FakeCharacteristic:
+    # Constructor
+    def __init__(self, p_UUID):
+        self.uuid       = p_UUID;
+        self.properties = ["read", "write", "write-without-response"];
+
+class FakeServices:
+    def get_characteristic(self, p_UUID):
+        return FakeCharacteristic(p_UUID);
+
+# Stand in for bleak.BleakClient, bound to a FakeLink by Install
+class FakeBleakClient:
+    Link = FakeLink();
+
+    # Constructor
+    def __init__(self, p_Address, adapter = None, disconnected_callback = None, **kwargs):
+        self.address    = p_Address.address if hasattr(p_Address, "address") else p_Address;
+        self.adapter    = adapter;
+        self.services   = FakeServices();
+
+        self._OnDisconnected    = disconnected_callback;
+        self._Connected         = False;
+        self._Notify            = None;
+        self._State             = {};
+
+    @property
+    def is_connected(self):
+        return self._Connected;
+
+    async def connect(self, **kwargs):
+        l_Link = self.Link;
+
+        with l_Link._Lock:
+            l_Link.Connecting     += 1;
+            l_Link.PeakConnecting  = max(l_Link.PeakConnecting, l_Link.Connecting);
+
+        try:
+            await asyncio.sleep(l_Link.ConnectLatency);
+
+            if l_Link.Random() < l_Link.ConnectFailureRate:
+                with l_Link._Lock:
+                    l_Link.ConnectFailures += 1;
+
+                raise Exception(f"[FakeBleakClient] Connection to {self.address} failed");
+
+            self._Connected = True;
+
+            with l_Link._Lock:
+                l_Link.Connects += 1;
+                l_Link.Connected.add(self.address);
+
+        finally:
+            with l_Link._Lock:
+                l_Link.Connecting -= 1;
+
+        return True;
+
+    async def disconnect(self):
+        self._Drop();
+        return True;
+
+    async def start_notify(self, p_Characteristic, p_Callback):
+        self._Notify = p_Callback;
+
+    async def write_gatt_char(self, p_Characteristic, p_Data, response = None):
+        l_Link = self.Link;
+
+        if not self._Connected:
+            raise Exception(f"[FakeBleakClient] Device {self.address} not connected");
+
+        l_Latency = l_Link.WriteLatency + l_Link.WriteJitter * l_Link.Random();
+
+        # Unacknowledged writes return as soon as they are queued
+        await asyncio.sleep(l_Latency if response is not False else l_Latency * 0.1);
+
+        if l_Link.Random() < l_Link.DisconnectRate:
+            with l_Link._Lock:
+                l_Link.Disconnects += 1;
+
+            self._Drop();
+            raise Exception(f"[FakeBleakClient] Device {self.address} disconnected");
+
+        with l_Link._Lock:
+            l_Link.Writes += 1;
+
+        if l_Link.OnWrite is not None:
+            l_Link.OnWrite(self.address, bytes(p_Data), time.perf_counter());
+
+        # The light remembers its last command payloads and answers queries with them
+        if p_Data[0] == GoveeBleCodec.FRAME_HEADER_COMMAND:
+            self._State[p_Data[1]] = bytes(p_Data[2:-1]);
+
+        elif p_Data[0] == GoveeBleCodec.FRAME_HEADER_QUERY and self._Notify is not None:
+            l_Answer = bytes(p_Data[:2]) + self._State.get(p_Data[1], bytes(len(p_Data) - 3));
+            l_Answer = l_Answer + bytes((functools.reduce(operator.xor, l_Answer),));
+
+            asyncio.get_event_loop().call_soon(self._Notify, p_Characteristic, bytearray(l_Answer));
+
+    # Change the light as its remote or app would, without telling the server
+    def SetExternalState(self, p_CMD, p_Payload):
+        self._State[p_CMD] = bytes(p_Payload) + bytes(GoveeBleCodec.FRAME_SIZE - 3 - len(p_Payload));
+
+    def _Drop(self):
+        l_WasConnected  = self._Connected;
+        self._Connected = False;
+
+        with self.Link._Lock:
+            self.Link.Connected.discard(self.address);
+
+        if l_WasConnected and self._OnDisconnected is not None:
+            self._OnDisconnected(self);
+
+# Route every GoveeBleLight.Client connection to the simulated link
+def Install(p_Link):
+    FakeBleakClient.Link        = p_Link;
+    GoveeBleLight.BleakClient   = FakeBleakClient;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Stand in for paho.mqtt.client.Client, only counts publishes
+class FakeMqttClient:
+    # Constructor
+    def __init__(self):
+        self.Publishes  = 0;
+
+        self._Lock      = threading.Lock();
+
+    def publish(self, p_Topic, p_Payload = None, qos = 0, retain = False):
+        with self._Lock:
+            self.Publishes += 1;
+
+    def subscribe(self, p_Topic, qos = 0):
+        pass;
+
+class FakeMqttMessage:
+    # Constructor
+    def __init__(self, p_Topic, p_Payload):
+        self.topic      = p_Topic;
+        self.payload    = p_Payload;
+
+# Stand in for GoveeBleMqtt.AsyncioMqttHelper, the broker never needs to be paused
+class FakeMqttHelper:
+    # Constructor
+    def __init__(self):
+        self.Pauses     = 0;
+
+        self._Paused    = False;
+
+    def PauseReading(self):
+        self.Pauses += 1;
+        self._Paused = True;
+
+    def ResumeReading(self):
+        self._Paused = False;
+
+    def IsPaused(self):
+        return self._Paused;
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# Replay a recorded command stream through main.py on simulated lights, diff the written frames against the recording
+import asyncio;
+import contextlib;
+import difflib;
+import getopt;
+import os;
+import sys;
+import time;
+
+import fakes;
+import e2e;
+
+import GoveeBleCodec;
+import GoveeBleRecorder;
+import main as Server;
+
+from GoveeBleCodec import ELedCommand, ELedMode;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Frames that depend on timing rather than on commands: status queries and keep alive
+# repeats of the previous frame of the device
+def FilterFrames(p_Writes):
+    l_Result    = {};
+    l_Previous  = {};
+
+    for l_Time, l_DeviceID, l_Frame in p_Writes:
+        if l_Frame[0] == GoveeBleCodec.FRAME_HEADER_QUERY or l_Previous.get(l_DeviceID) == l_Frame:
+            continue;
+
+        l_Previous[l_DeviceID] = l_Frame;
+        l_Result.setdefault(l_DeviceID, []).append((l_Time, l_Frame));
+
+    return l_Result;
+
+# Seconds between each frame and the latest command received before it, independent of the replay speed
+def GetLags(p_Frames, p_Commands):
+    l_Lags  = [];
+    l_Index = 0;
+
+    for l_Time, _ in p_Frames:
+        while l_Index < len(p_Commands) and p_Commands[l_Index] <= l_Time:
+            l_Index += 1;
+
+        l_Lags.append(l_Time - p_Commands[l_Index - 1] if l_Index > 0 else 0.0);
+
+    return l_Lags;
+
+def Percentile(p_Samples, p_Percent):
+    if len(p_Samples) == 0:
+        return float("nan");
+
+    l_Samples = sorted(p_Samples);
+    return l_Samples[min(len(l_Samples) - 1, int(len(l_Samples) * p_Percent / 100))];
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Feed the recorded Mqtt messages at their recorded offsets divided by p_Speed, return the command times and [(time, device id, frame), ...]
+async def Replay(p_Metadata, p_Records, p_Options):
+    l_Link      = fakes.FakeLink(p_Options["write_latency"], p_Options["write_jitter"], p_Options["connect_latency"]);
+    l_Mqtt      = fakes.FakeMqttClient();
+    l_Writes    = [];
+    l_Commands  = [];
+    l_Speed     = p_Options["speed"];
+
+    fakes.Install(l_Link);
+
+    Server.SERVER_ZONE_ID   = p_Metadata.get("zone", Server.SERVER_ZONE_ID);
+    Server.GROUPS           = p_Metadata.get("groups") or {};
+
+    l_Consumer  = e2e.StartServer(l_Mqtt, p_Options["shared"]);
+    l_Start     = time.perf_counter();
+
+    l_Link.OnWrite = lambda p_Address, p_Frame, p_Time: l_Writes.append((p_Time - l_Start, p_Address, p_Frame));
+
+    for l_Kind, l_Time, l_Topic, l_Payload in p_Records:
+        if l_Kind != GoveeBleRecorder.RECORD_MQTT:
+            continue;
+
+        l_Delay = l_Start + l_Time / l_Speed - time.perf_counter();
+        if l_Delay > 0:
+            await asyncio.sleep(l_Delay);
+
+        l_Commands.append(time.perf_counter() - l_Start);
+        Server.Mqtt_OnMessage(l_Mqtt, None, fakes.FakeMqttMessage(l_Topic, l_Payload));
+
+    # Let the last commands reach the lights
+    l_End = p_Records[-1][1] / l_Speed if len(p_Records) > 0 else 0.0;
+    await asyncio.sleep(max(0.0, l_Start + l_End - time.perf_counter()) + p_Options["settle"]);
+
+    l_Link.OnWrite = None;
+    await e2e.StopServer(l_Consumer);
+
+    return l_Commands, l_Writes;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# What the light shows once p_Frames are written, one entry per command and per painted segment
+def GetLightState(p_Frames):
+    l_State = {};
+
+    for _, l_Frame in p_Frames:
+        if l_Frame[1] == ELedCommand.SetColor and l_Frame[2] == ELedMode.Segment:
+            l_Mask = (l_Frame[12] << 8) | l_Frame[13];
+
+            for l_Segment in range(16):
+                if l_Mask & (1 << l_Segment):
+                    l_State[("segment", l_Segment)] = bytes(l_Frame[4:7]);
+        else:
+            l_State[l_Frame[1]] = l_Frame;
+
+    return l_State;
+
+# Indexes of the first command of every burst but the first, commands closer than p_Gap belong to the same burst
+def GetBurstEnds(p_Commands, p_Gap):
+    return [l_Index for l_Index in range(1, len(p_Commands)) if p_Commands[l_Index] - p_Commands[l_Index - 1] > p_Gap];
+
+# Per device comparison, True when the replay matches. Frames of commands landing close
+# together are merged by the server depending on timing, so the frame sequences are only
+# reported. What must match is the light state once each burst of commands settled, and
+# the replay must not be slower: merged frames shorten lags, a slower server lengthens them
+def Compare(p_Records, p_Commands, p_Writes, p_Options):
+    # Lags are compared rather than offsets, a write takes as long at any replay speed
+    l_RecordedCommands  = [l_Time for l_Kind, l_Time, _, _ in p_Records if l_Kind == GoveeBleRecorder.RECORD_MQTT];
+    l_Recorded          = FilterFrames([(l_Time, l_Key, l_Payload) for l_Kind, l_Time, l_Key, l_Payload in p_Records if l_Kind == GoveeBleRecorder.RECORD_WRITE]);
+    l_Replayed          = FilterFrames(p_Writes);
+    l_Bursts            = GetBurstEnds(l_RecordedCommands, p_Options["gap"] * p_Options["speed"]);
+    l_RecordedLags      = [];
+    l_ReplayedLags      = [];
+    l_Match             = True;
+
+    print(f"{len(l_Bursts) + 1} command bursts");
+    print(f"{'device':<20} {'recorded':>9} {'replayed':>9} {'merged':>8} {'extra':>6} {'state':>6}");
+
+    for l_DeviceID in sorted(set(l_Recorded.keys()) | set(l_Replayed.keys())):
+        l_Expected  = l_Recorded.get(l_DeviceID, []);
+        l_Actual    = l_Replayed.get(l_DeviceID, []);
+        l_Lags      = (GetLags(l_Expected, l_RecordedCommands), GetLags(l_Actual, p_Commands));
+        l_Matcher   = difflib.SequenceMatcher(None, [x[1] for x in l_Expected], [x[1] for x in l_Actual], autojunk= False);
+        l_Merged    = 0;
+        l_Extra     = 0;
+        l_First     = None;
+
+        for l_Tag, l_ExpectedStart, l_ExpectedEnd, l_ActualStart, l_ActualEnd in l_Matcher.get_opcodes():
+            if l_Tag == "equal":
+                continue;
+
+            l_Merged   += l_ExpectedEnd - l_ExpectedStart;
+            l_Extra    += l_ActualEnd - l_ActualStart;
+
+        # Light state right before each burst and at the end
+        for l_Burst, l_Index in enumerate(l_Bursts + [None]):
+            l_RecordedEnd   = l_RecordedCommands[l_Index] if l_Index is not None else float("inf");
+            l_ReplayedEnd   = p_Commands[l_Index] if l_Index is not None else float("inf");
+            l_RecordedState = GetLightState(x for x in l_Expected if x[0] < l_RecordedEnd);
+            l_ReplayedState = GetLightState(x for x in l_Actual if x[0] < l_ReplayedEnd);
+
+            if l_RecordedState != l_ReplayedState:
+                l_Key   = next(x for x in list(l_RecordedState.keys()) + list(l_ReplayedState.keys()) if l_RecordedState.get(x) != l_ReplayedState.get(x));
+                l_First = (l_Burst, l_RecordedState.get(l_Key, b"").hex() or "-", l_ReplayedState.get(l_Key, b"").hex() or "-");
+                break;
+
+        # Strict, every frame must be written the same
+        if p_Options["strict"] and (l_Merged > 0 or l_Extra > 0):
+            l_Match = False;
+
+        l_RecordedLags += l_Lags[0];
+        l_ReplayedLags += l_Lags[1];
+        l_Match         = l_Match and l_First is None;
+
+        print(f"{l_DeviceID:<20} {len(l_Expected):>9} {len(l_Actual):>9} {l_Merged:>8} {l_Extra:>6} {'ok' if l_First is None else 'diff':>6}");
+
+        if l_First is not None:
+            print(f"  state differs after burst {l_First[0]}: recorded {l_First[1]}, replayed {l_First[2]}");
+
+    print();
+    print(f"{'lag ms':<20} {'p50':>9} {'p95':>9} {'max':>9}");
+
+    for l_Name, l_Samples in (("recorded", l_RecordedLags), ("replayed", l_ReplayedLags)):
+        print(f"{l_Name:<20} {Percentile(l_Samples, 50) * 1000:>9.1f} {Percentile(l_Samples, 95) * 1000:>9.1f} {max(l_Samples, default= float('nan')) * 1000:>9.1f}");
+
+    l_Slower = Percentile(l_ReplayedLags, 95) - Percentile(l_RecordedLags, 95);
+
+    if l_Slower > p_Options["tolerance"]:
+        print(f"\nReplayed p95 lag is {l_Slower * 1000:.0f}ms above the recorded one");
+        l_Match = False;
+
+    return l_Match;
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+def Usage():
+    print("replay.py [-s speed] [-g burst_gap] [-l write_latency] [-j write_jitter] [-c connect_latency] [-w settle] [-d tolerance_ms] [-x] [-t] record.gblr");
+    print("  -s  replay speed, 2 replays twice as fast as recorded");
+    print("  -g  seconds without command, at replay speed, after which the lights must show the same state, 0.25 by default");
+    print("  -x  strict, every recorded frame must be written again, only stable at x1 with the recorded link (-j 0)");
+    print("  -d  milliseconds the replayed p95 command to write lag may exceed the recorded one, 50 by default");
+    print("  -t  legacy one thread per device");
+
+async def Run(argv):
+    l_Options = {
+        "speed":            1.0,
+        "write_latency":    0.02,
+        "write_jitter":     0.01,
+        "connect_latency":  0.05,
+        "settle":           2.0,
+        "tolerance":        0.05,
+        "gap":              0.25,
+        "strict":           False,
+        "shared":           True,
+    };
+
+    l_Arguments, l_Paths = getopt.getopt(argv, "hs:g:l:j:c:w:d:xt");
+    for l_Option, l_Argument in l_Arguments:
+        if l_Option == "-h":
+            Usage();
+            sys.exit();
+
+        elif l_Option == "-s":
+            l_Options["speed"] = max(0.01, float(l_Argument));
+        elif l_Option == "-g":
+            l_Options["gap"] = float(l_Argument);
+        elif l_Option == "-l":
+            l_Options["write_latency"] = float(l_Argument);
+        elif l_Option == "-j":
+            l_Options["write_jitter"] = float(l_Argument);
+        elif l_Option == "-c":
+            l_Options["connect_latency"] = float(l_Argument);
+        elif l_Option == "-w":
+            l_Options["settle"] = float(l_Argument);
+        elif l_Option == "-d":
+            l_Options["tolerance"] = float(l_Argument) / 1000;
+        elif l_Option == "-x":
+            l_Options["strict"] = True;
+        elif l_Option == "-t":
+            l_Options["shared"] = False;
+
+    if len(l_Paths) != 1:
+        Usage();
+        sys.exit(2);
+
+    l_Metadata, l_Records = GoveeBleRecorder.ReadLog(l_Paths[0]);
+    l_Duration            = l_Records[-1][1] if len(l_Records) > 0 else 0.0;
+
+    print(f"[Replay] {len(l_Records)} records over {l_Duration:.1f}s, zone {l_Metadata.get('zone')}, speed x{l_Options['speed']:g}", flush= True);
+
+    # The server logs every command, keep the report readable
+    with open(os.devnull, "w") as l_Null, contextlib.redirect_stdout(l_Null):
+        l_Commands, l_Writes = await Replay(l_Metadata, l_Records, l_Options);
+
+    if not Compare(l_Records, l_Commands, l_Writes, l_Options):
+        sys.exit(1);
+
+if __name__ == "__main__":
+    asyncio.run(Run(sys.argv[1:]));
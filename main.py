@@ -3,23 +3,81 @@ import asyncio;
 import json;
 import paho.mqtt.client as mqtt;
 import GoveeBleLight;
+import GoveeBleMqtt;
+import GoveeBleConnection;
+import GoveeBleKeepAlive;
+import GoveeBleGroup;
+import GoveeBleMetrics;
+import GoveeBleRegistry;
+import GoveeBleDiscovery;
+import GoveeBleSupervisor;
+import GoveeBleProfiler;
+import GoveeBleStream;
+import GoveeBleCoordinator;
+import GoveeBleRecorder;
+import socket;
+import time;
 import sys;
 import getopt;
-import time;
 import signal;
+import os;
 
 SERVER_ZONE_ID: int = 1;
-ADAPTER: str = None;
+ADAPTER: str = None;                # Comma separated for multiple adapters, hci0,hci1,hci2
+SHARED_LOOP: bool = True;
+MAX_CONCURRENT_CONNECTS: int = 2;
+MAX_CONNECTIONS: int = None;            # Links open at once per adapter, least recently commanded idle lights are disconnected past it
+POOL_PINNED: list = [];                 # Lights never disconnected by the pool, ["a4c13825cd56_H6008"]
+KEEPALIVE_INTERVAL: float = 1.0;
+KEEPALIVE_MODEL_INTERVALS: dict = {};   # Per model override, { "H6008": 2.0 }
+PUBLISH_MIN_INTERVAL: float = 0.25;
+OPTIMISTIC_PUBLISH: bool = False;       # Publish commanded states right away instead of once written, HA no longer waits for the light
+OPTIMISTIC_TIMEOUT: float = 30.0;       # Seconds before a command that can't be written is dropped and the real state published with an error
+WRITE_MODES: dict = {};                 # Per model write without response, { "H6008": GoveeBleLight.EWriteMode.NoResponse }
 MQTT_SERVER: str = "192.168.14.12";
 MQTT_PORT: int = 1883;
 MQTT_USER: str = None;
 MQTT_PASS: str = None;
+MQTT_QUEUE_SIZE: int = 1024;
+METRICS_PORT: int = None;               # Prometheus endpoint on http://host:port/metrics, 9102
+METRICS_INTERVAL: float = None;         # Seconds between json stats on goveeblemqtt/zone<id>/stats, 60
+DISCOVERY: bool = True;                 # Background scan, connections reuse the discovered device instead of scanning
+DISCOVERY_TTL: float = 120.0;           # Seconds a discovered device is reused
+DISCOVERY_OUT_OF_RANGE: float = 300.0;  # Seconds without advertisement before a device is not retried anymore
+REGISTRY_PATH: str = "devices.jsonl";   # Known devices and their last state, pre-connected at startup, None to disable
+GROUPS: dict = {};                      # { "livingroom": ["a4c13825cd56_H6008", "a4c13825cd57_H6159"] }
+SHARDS: list = [];                      # Supervisor mode, one worker process per (zone, adapter), [(1, "hci0"), (2, "hci1")]
+STALL_THRESHOLD: float = 0.25;          # Loop stalls longer than this are reported on goveeblemqtt/zone<id>/debug/stall, None to disable
+STREAM_UDP_PORT: int = None;            # Udp port receiving binary color frames, same format as goveeblemqtt/zone<id>/stream, 21324
+STREAM_REPORT_INTERVAL: float = 10.0;   # Seconds between stream fps and drop rate reports on goveeblemqtt/zone<id>/stream/stats
+COORDINATION: bool = False;             # Share devices with the other servers of the broker, commands on goveeblemqtt/any/light/<id>/command go to the best placed one
+NODE_NAME: str = None;                  # Name of this server among the coordinated ones, hostname_zone<id> by default
+COORDINATION_INTERVAL: float = 10.0;    # Seconds between two adverts of the devices this server hears
+HANDOFF_MARGIN: float = 8.0;            # dB a server must be better placed by to take a device over
+PROFILE_PATH: str = "profiles";         # Where profiles requested on goveeblemqtt/zone<id>/debug/profile are written
+RECORD_PATH: str = None;                # Binary log of received commands and written frames for benchmarks/replay.py, "records/zone.gblr"
 
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
 CLIENTS         = {};
-MESSAGE_QUEUE   = [];
+MESSAGE_QUEUE   = None;
+MQTT_HELPER     = None;
+TOPIC_ROUTER    = None;
+GROUP_ROUTES    = {};
+ADAPTERS        = [];
+BALANCER        = None;
+KEEPALIVE       = None;
+REGISTRY        = None;
+DISCOVERY_CACHE = None;
+SUPERVISOR      = None;
+WORKER_NAME     = None;
+WATCHDOG        = None;
+STREAM          = None;
+COORDINATOR     = None;
+ANY_ROUTER      = None;
+PROFILER        = None;
+STOP_EVENT      = None;
 RUNNING         = True;
 
 # ////////////////////////////////////////////////////////////////////////////
@@ -29,74 +87,291 @@ RUNNING         = True;
 async def main(argv):
     global SERVER_ZONE_ID;
     global ADAPTER;
-    global CLIENTS;
-    global MESSAGE_QUEUE;
-    global RUNNING;
+    global SHARED_LOOP;
+    global ADAPTERS;
+    global SHARDS;
 
-    l_Options, _ = getopt.getopt(argv,"hz:a:",["adapter=","zone="])
+    l_Options, _ = getopt.getopt(argv,"hz:a:ts:",["adapter=","zone=","threaded","shards="])
     for l_Option, l_Argument in l_Options:
         if l_Option == '-h':
-            print('main.py -a <adapter> -z <zone>');
+            print('main.py -a <adapter[,adapter...]> -z <zone> [-t] [-s <zone:adapter[,zone:adapter...]>]');
             sys.exit();
 
+        elif l_Option in ("-t", "--threaded"):
+            SHARED_LOOP = False
+
         elif l_Option in ("-a", "--adapter"):
             ADAPTER = l_Argument
 
         elif l_Option in ("-z", "--zone"):
             SERVER_ZONE_ID = l_Argument
 
-    print("[Main] Starting with zone " + str(SERVER_ZONE_ID));
+        elif l_Option in ("-s", "--shards"):
+            SHARDS = [(l_Shard.split(":")[0].strip(), (l_Shard.split(":")[1].strip() or None) if ":" in l_Shard else None) for l_Shard in l_Argument.split(",") if len(l_Shard.strip()) > 0];
+
+    if len(SHARDS) > 0:
+        print("[Main] Starting supervisor with workers " + ", ".join(f"zone{l_Zone}:{l_Adapter}" for l_Zone, l_Adapter in SHARDS));
+
+        await RunSupervisor();
+        sys.exit(0);
+
     if ADAPTER is not None:
-        print("[Main] Starting with adapter " + ADAPTER);
+        ADAPTERS = [l_Adapter.strip() for l_Adapter in ADAPTER.split(",") if len(l_Adapter.strip()) > 0];
+
+    print("[Main] Starting with zone " + str(SERVER_ZONE_ID));
+    if len(ADAPTERS) > 0:
+        print("[Main] Starting with adapters " + ", ".join(ADAPTERS));
+    if not SHARED_LOOP:
+        print("[Main] Starting with one thread per device");
+
+        if len(ADAPTERS) > 1:
+            print("[Main] Multiple adapters require the shared loop, only " + ADAPTERS[0] + " will be used");
 
     signal.signal(signal.SIGINT, Signal_OnSigInt);
 
+    await Serve(None);
+
+    sys.exit(0);
+
+# Run the server until stopped, Mqtt goes through the supervisor when p_Socket is set
+async def Serve(p_Socket):
+    global CLIENTS;
+    global MESSAGE_QUEUE;
+    global MQTT_HELPER;
+    global TOPIC_ROUTER;
+    global GROUP_ROUTES;
+    global BALANCER;
+    global KEEPALIVE;
+    global REGISTRY;
+    global DISCOVERY_CACHE;
+    global WATCHDOG;
+    global STREAM;
+    global COORDINATOR;
+    global ANY_ROUTER;
+    global STOP_EVENT;
+
+    GoveeBleLight.WRITE_MODES.update(WRITE_MODES);
+    GoveeBleLight.PUBLISH_MIN_INTERVAL = PUBLISH_MIN_INTERVAL;
+    GoveeBleLight.OPTIMISTIC_TIMEOUT   = OPTIMISTIC_TIMEOUT;
+
+    l_Loop          = asyncio.get_event_loop();
+    MESSAGE_QUEUE   = asyncio.Queue(maxsize= MQTT_QUEUE_SIZE);
+    TOPIC_ROUTER    = GoveeBleMqtt.TopicRouter(GetTopicPrefix() + "light/");
+    STOP_EVENT      = asyncio.Event();
+    GROUP_ROUTES    = { l_Name: [TOPIC_ROUTER.RouteDevice(l_DeviceKey) for l_DeviceKey in l_DeviceKeys] for l_Name, l_DeviceKeys in GROUPS.items() };
+
+    # Connection attempts are only coordinated when every device shares the loop
+    if SHARED_LOOP:
+        l_Pinned = [l_Route.DeviceID for l_Route in (TOPIC_ROUTER.RouteDevice(l_DeviceKey) for l_DeviceKey in POOL_PINNED) if l_Route is not None];
+        BALANCER = GoveeBleConnection.AdapterBalancer(ADAPTERS, MAX_CONCURRENT_CONNECTS, p_MaxConnections= MAX_CONNECTIONS, p_Pinned= l_Pinned);
+
+        # The background scan feeds the balancer, no one shot survey needed
+        if DISCOVERY:
+            DISCOVERY_CACHE = GoveeBleDiscovery.DiscoveryCache(ADAPTERS, DISCOVERY_TTL, DISCOVERY_OUT_OF_RANGE, BALANCER.ReportRSSI);
+            DISCOVERY_CACHE.Start(l_Loop);
+        elif len(ADAPTERS) > 1:
+            l_Loop.create_task(BALANCER.Survey());
+
+        KEEPALIVE = GoveeBleKeepAlive.KeepAliveScheduler(KEEPALIVE_INTERVAL, KEEPALIVE_MODEL_INTERVALS);
+        KEEPALIVE.Start(l_Loop);
+
+    if REGISTRY_PATH is not None:
+        REGISTRY = GoveeBleRegistry.DeviceRegistry(REGISTRY_PATH);
+        REGISTRY.Load();
+        REGISTRY.Start(l_Loop);
+
+    if p_Socket is not None:
+        MQTT_HELPER     = GoveeBleSupervisor.WorkerLink(l_Loop, p_Socket, Mqtt_OnMessage, Mqtt_OnConnect, STOP_EVENT.set);
+        l_MqttClient    = MQTT_HELPER;
+    else:
+        l_MqttClient = mqtt.Client();
+        l_MqttClient.on_connect = Mqtt_OnConnect;
+        l_MqttClient.on_message = Mqtt_OnMessage;
+
+        if MQTT_USER != None and MQTT_PASS != None:
+            l_MqttClient.username_pw_set(MQTT_USER, MQTT_PASS);
+
+        # Other servers take the devices over when this one vanishes
+        if COORDINATION:
+            COORDINATOR = GoveeBleCoordinator.Coordinator(
+                NODE_NAME or socket.gethostname() + "_zone" + str(SERVER_ZONE_ID),
+                SERVER_ZONE_ID,
+                l_MqttClient,
+                Coordinator_GetVisible,
+                lambda p_DeviceID: CLIENTS[p_DeviceID].GetState() if p_DeviceID in CLIENTS else None,
+                lambda p_DeviceID, p_Model, p_State: Coordinator_OnOwn(l_MqttClient, p_DeviceID, p_Model, p_State),
+                Coordinator_OnRelease,
+                COORDINATION_INTERVAL,
+                HANDOFF_MARGIN);
+            ANY_ROUTER = GoveeBleMqtt.TopicRouter(GoveeBleCoordinator.ANY_ZONE_PREFIX + "light/");
+
+            l_MqttClient.will_set(COORDINATOR.GetTopic(), b"", retain= True);
+
+            print("[Main] Coordinating devices as node " + COORDINATOR.Node);
+
+        MQTT_HELPER = GoveeBleMqtt.AsyncioMqttHelper(l_Loop, l_MqttClient);
+
+    MQTT_HELPER.Start(MQTT_SERVER, MQTT_PORT, 60);
+
+    if REGISTRY is not None:
+        WarmStart(l_MqttClient);
+
+    if RECORD_PATH is not None:
+        l_Path = RECORD_PATH if WORKER_NAME is None else os.path.splitext(RECORD_PATH)[0] + "_" + WORKER_NAME + os.path.splitext(RECORD_PATH)[1];
+        os.makedirs(os.path.dirname(l_Path) or ".", exist_ok= True);
+        GoveeBleRecorder.RECORDER.Start(l_Loop, l_Path, { "zone": SERVER_ZONE_ID, "worker": WORKER_NAME, "groups": GROUPS });
+
+    l_Consumer = l_Loop.create_task(ProcessMessages(l_MqttClient));
+
+    if COORDINATOR is not None:
+        COORDINATOR.Start(l_Loop);
+    elif COORDINATION:
+        print("[Main] Coordination is not available to supervisor workers");
+
+    STREAM = GoveeBleStream.StreamReceiver(CLIENTS.get, STREAM_REPORT_INTERVAL);
+    STREAM.Start(l_Loop, l_MqttClient, GetTopicPrefix() + "stream/stats" + ("/" + WORKER_NAME if WORKER_NAME is not None else ""), STREAM_UDP_PORT);
+
+    if STALL_THRESHOLD is not None:
+        WATCHDOG = GoveeBleProfiler.LoopWatchdog(STALL_THRESHOLD, lambda p_Stall: l_MqttClient.publish(GetDebugTopic("stall"), json.dumps(p_Stall)));
+        WATCHDOG.Start(l_Loop);
+
+    if METRICS_PORT is not None or METRICS_INTERVAL is not None:
+        GoveeBleMetrics.METRICS.SetGauge("goveeble_mqtt_queue_depth", "Pending Mqtt messages", MESSAGE_QUEUE.qsize);
+        GoveeBleMetrics.METRICS.SetGauge("goveeble_devices", "Registered devices", lambda: len(CLIENTS));
+        GoveeBleMetrics.METRICS.SetGauge("goveeble_devices_out_of_range", "Devices no scanner hears anymore", lambda: len(DISCOVERY_CACHE.GetOutOfRange()) if DISCOVERY_CACHE is not None else 0);
+        GoveeBleMetrics.METRICS.SetGauge("goveeble_devices_connected", "Connected devices", lambda: sum(1 for l_Client in list(CLIENTS.values()) if l_Client.IsConnected()));
+
+        if BALANCER is not None:
+            GoveeBleMetrics.METRICS.SetGauge("goveeble_pool_hits", "Commands sent on an open link", lambda: BALANCER.GetPoolStats().get("hits", 0));
+            GoveeBleMetrics.METRICS.SetGauge("goveeble_pool_misses", "Commands that had to connect first", lambda: BALANCER.GetPoolStats().get("misses", 0));
+            GoveeBleMetrics.METRICS.SetGauge("goveeble_pool_evictions", "Idle devices disconnected to make room", lambda: BALANCER.GetPoolStats().get("evictions", 0));
+            GoveeBleMetrics.METRICS.SetGauge("goveeble_pool_hot", "Connected devices kept connected for being used often", lambda: BALANCER.GetPoolStats().get("hot", 0));
+        GoveeBleMetrics.METRICS.Start(l_Loop, METRICS_PORT, l_MqttClient if METRICS_INTERVAL is not None else None, GetTopicPrefix() + "stats" + ("/" + WORKER_NAME if WORKER_NAME is not None else ""), METRICS_INTERVAL);
+
+    if RUNNING:
+        await STOP_EVENT.wait();
+
+    l_Consumer.cancel();
+
+    print("[Main] Exiting...");
+
+    if COORDINATOR is not None:
+        await COORDINATOR.Stop();
+
+    await GoveeBleLight.CloseAll(CLIENTS.values());
+    await GoveeBleRecorder.RECORDER.Stop();
+
+    if KEEPALIVE is not None:
+        await KEEPALIVE.Stop();
+
+    if REGISTRY is not None:
+        await REGISTRY.Stop();
+
+    if DISCOVERY_CACHE is not None:
+        await DISCOVERY_CACHE.Stop();
+
+    if WATCHDOG is not None:
+        await WATCHDOG.Stop();
+
+    await STREAM.Stop();
+
+    if PROFILER is not None:
+        PROFILER.Stop();
+
+    await GoveeBleMetrics.METRICS.Stop();
+    await MQTT_HELPER.Stop();
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Single Mqtt connection, commands are routed to one worker process per shard
+async def RunSupervisor():
+    global MQTT_HELPER;
+    global SUPERVISOR;
+    global STOP_EVENT;
+
+    signal.signal(signal.SIGINT, Signal_OnSigInt);
+
+    l_Loop      = asyncio.get_event_loop();
+    STOP_EVENT  = asyncio.Event();
+
     l_MqttClient = mqtt.Client();
-    l_MqttClient.on_connect = Mqtt_OnConnect;
-    l_MqttClient.on_message = Mqtt_OnMessage;
+    l_MqttClient.on_connect = Supervisor_OnConnect;
+    l_MqttClient.on_message = Supervisor_OnMessage;
 
     if MQTT_USER != None and MQTT_PASS != None:
         l_MqttClient.username_pw_set(MQTT_USER, MQTT_PASS);
 
-    l_MqttClient.connect(MQTT_SERVER, MQTT_PORT, 60);
+    SUPERVISOR = GoveeBleSupervisor.Supervisor(SHARDS, RunWorker, l_MqttClient, GetTopicPrefix, GROUPS, p_WorkerOptions= { "shared_loop": SHARED_LOOP });
 
-    while RUNNING:
-        try:
-            if l_MqttClient.loop() != mqtt.MQTT_ERR_SUCCESS:
-                print("[Main] Disconnected from Mqtt, trying to reconnect in 5 seconds...");
-                time.sleep(5);
+    # Devices stay on the worker that already knows them
+    if REGISTRY_PATH is not None:
+        for l_Shard in SUPERVISOR.GetShards():
+            for l_DeviceID in GoveeBleRegistry.DeviceRegistry(GetShardRegistryPath(l_Shard.Name)).Load():
+                SUPERVISOR.Own(l_DeviceID, l_Shard.Index);
 
-                if l_MqttClient.connect(MQTT_SERVER, MQTT_PORT, 60) == mqtt.MQTT_ERR_SUCCESS:
-                    pass;
+    MQTT_HELPER = GoveeBleMqtt.AsyncioMqttHelper(l_Loop, l_MqttClient);
 
-            while len(MESSAGE_QUEUE) > 0:
-                l_Message   = MESSAGE_QUEUE.pop(0);
-                l_Topic     = l_Message.topic;
-                l_Prefix    = "goveeblemqtt/zone" + str(SERVER_ZONE_ID) + "/light/";
-                l_Suffix    = "/command";
+    SUPERVISOR.Start(l_Loop, MQTT_HELPER);
+    MQTT_HELPER.Start(MQTT_SERVER, MQTT_PORT, 60);
 
-                if not l_Topic.startswith(l_Prefix) and not l_Topic.endwith(l_Suffix):
-                    continue;
+    if RUNNING:
+        await STOP_EVENT.wait();
 
-                l_DeviceID = l_Topic[len(l_Prefix):len(l_Topic)-len(l_Suffix)];
-                l_Model    = "generic";
-                l_Payload  = json.loads(l_Message.payload.decode("utf-8","ignore"));
+    print("[Main] Exiting...");
 
-                if "_" in l_DeviceID:
-                    l_Model    = l_DeviceID[l_DeviceID.find('_')+1:];
-                    l_DeviceID = l_DeviceID[:l_DeviceID.find('_')];
+    await SUPERVISOR.Stop();
+    await MQTT_HELPER.Stop();
 
-                OnPayloadReceived(l_MqttClient, l_Topic, l_DeviceID, l_Model, l_Payload);
+# Worker process entry point, serves one shard of the supervisor.
+# Spawned workers start from a fresh import, p_Options carries the command line flags
+def RunWorker(p_Zone, p_Adapter, p_Index, p_Socket, p_Options = None):
+    global SERVER_ZONE_ID;
+    global SHARED_LOOP;
+    global ADAPTERS;
+    global REGISTRY_PATH;
+    global METRICS_PORT;
+    global STREAM_UDP_PORT;
+    global WORKER_NAME;
 
-        except:
-            pass;
+    # Ctrl+C reaches the whole process group, the supervisor decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN);
 
-    print("[Main] Exiting...");
+    SERVER_ZONE_ID  = p_Zone;
+    ADAPTERS        = [p_Adapter] if p_Adapter is not None else [];
+    WORKER_NAME     = GoveeBleSupervisor.Shard(p_Index, p_Zone, p_Adapter).Name;
+    SHARED_LOOP     = (p_Options or {}).get("shared_loop", SHARED_LOOP);
 
-    for l_Client in CLIENTS:
-        CLIENTS[l_Client].Close();
+    if REGISTRY_PATH is not None:
+        REGISTRY_PATH = GetShardRegistryPath(WORKER_NAME);
+    if METRICS_PORT is not None:
+        METRICS_PORT = METRICS_PORT + 1 + p_Index;
+    if STREAM_UDP_PORT is not None:
+        STREAM_UDP_PORT = STREAM_UDP_PORT + 1 + p_Index;
 
-    sys.exit(0);
+    print(f"[RunWorker] Worker {WORKER_NAME} running, pid {os.getpid()}");
+
+    asyncio.run(Serve(p_Socket));
+
+# devices.jsonl -> devices_zone1_hci0.jsonl
+def GetShardRegistryPath(p_ShardName):
+    l_Root, l_Extension = os.path.splitext(REGISTRY_PATH);
+    return l_Root + "_" + p_ShardName + l_Extension;
+
+def Supervisor_OnConnect(p_MqttClient, _, __, ___):
+    print("[Supervisor_OnConnect] Connected to Mqtt broker")
+
+    for l_Topic in SUPERVISOR.GetTopics():
+        print("[Supervisor_OnConnect] Subscribing to topic: " + l_Topic);
+        p_MqttClient.subscribe(l_Topic)
+
+    SUPERVISOR.OnBrokerConnected();
+
+def Supervisor_OnMessage(p_MqttClient, _, p_Message):
+    try:
+        SUPERVISOR.Dispatch(p_Message.topic, p_Message.payload);
+    except Exception as l_Exception:
+        print(f"[Supervisor_OnMessage] Error on topic {p_Message.topic}: {l_Exception}");
 
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
@@ -109,70 +384,350 @@ def Signal_OnSigInt(p_Signal, p_Frame):
 
     print("[Signal_OnSigInt] Exiting...");
 
+    if STOP_EVENT is not None:
+        asyncio.get_event_loop().call_soon_threadsafe(STOP_EVENT.set);
+
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
+# Consume the Mqtt message queue
+async def ProcessMessages(p_MqttClient):
+    while True:
+        GoveeBleMetrics.METRICS.ObserveQueueDepth(MESSAGE_QUEUE.qsize());
+
+        l_Message = await MESSAGE_QUEUE.get();
+
+        # Enough room again, let the broker send more
+        if MQTT_HELPER.IsPaused() and MESSAGE_QUEUE.qsize() <= MQTT_QUEUE_SIZE // 2:
+            MQTT_HELPER.ResumeReading();
+
+        try:
+            if COORDINATOR is not None:
+                if l_Message.topic.startswith(GoveeBleCoordinator.COORDINATION_TOPIC):
+                    COORDINATOR.OnAdvert(l_Message.topic[len(GoveeBleCoordinator.COORDINATION_TOPIC):], l_Message.payload);
+                    continue;
+
+                # Zone agnostic, every server gets it and only the owner applies it
+                l_Route = ANY_ROUTER.Route(l_Message.topic);
+                if l_Route is not None:
+                    COORDINATOR.Learn(l_Route.DeviceID, l_Route.Model);
+
+                    if COORDINATOR.ClaimForCommand(l_Route.DeviceID):
+                        OnPayloadReceived(p_MqttClient, l_Route, json.loads(l_Message.payload.decode("utf-8","ignore")));
+
+                    continue;
+
+            l_Route = TOPIC_ROUTER.Route(l_Message.topic);
+            if l_Route is not None:
+                OnPayloadReceived(p_MqttClient, l_Route, json.loads(l_Message.payload.decode("utf-8","ignore")));
+                continue;
+
+            l_Prefix = GetTopicPrefix();
+
+            if l_Message.topic == l_Prefix + "debug/profile":
+                OnProfileRequested(p_MqttClient, l_Message.payload.decode("utf-8","ignore"));
+
+            # Bulk, { "MacAddressLowerNoDots_ModelNumber": { command }, ... }
+            elif l_Message.topic == l_Prefix + "bulk/command":
+                l_Payload   = json.loads(l_Message.payload.decode("utf-8","ignore"));
+                l_Commands  = [(TOPIC_ROUTER.RouteDevice(l_DeviceKey), l_Command) for l_DeviceKey, l_Command in l_Payload.items()];
+
+                OnGroupPayloadReceived(p_MqttClient, "bulk", [l_Command for l_Command in l_Commands if l_Command[0] is not None]);
+
+            # Group, one command applied to every device of a configured group
+            elif l_Message.topic.startswith(l_Prefix + "group/") and l_Message.topic.endswith("/command"):
+                l_Name = l_Message.topic[len(l_Prefix + "group/"):-len("/command")];
+
+                if l_Name not in GROUP_ROUTES:
+                    print("[ProcessMessages] Unknown group " + l_Name);
+                    continue;
+
+                l_Payload = json.loads(l_Message.payload.decode("utf-8","ignore"));
+
+                OnGroupPayloadReceived(p_MqttClient, l_Name, [(l_Route, l_Payload) for l_Route in GROUP_ROUTES[l_Name] if l_Route is not None]);
+
+        except Exception as l_Exception:
+            print(f"[ProcessMessages] Error on topic {l_Message.topic}: {l_Exception}");
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+def GetTopicPrefix(p_Zone = None):
+    return "goveeblemqtt/zone" + str(SERVER_ZONE_ID if p_Zone is None else p_Zone) + "/";
+
+# Workers of a supervisor report on their own sub topic
+def GetDebugTopic(p_Name):
+    return GetTopicPrefix() + "debug/" + p_Name + ("/" + WORKER_NAME if WORKER_NAME is not None else "");
+
 # On Mqtt connect
 def Mqtt_OnConnect(p_MqttClient, _, __, ___):
-    l_Topic = "goveeblemqtt/zone" + str(SERVER_ZONE_ID) + "/light/+/command";
+    l_Topics = [
+        GetTopicPrefix() + "light/+/command",
+        GetTopicPrefix() + "group/+/command",
+        GetTopicPrefix() + "bulk/command",
+        GetTopicPrefix() + "debug/profile",
+        GetTopicPrefix() + "stream",
+    ];
 
     print("[Mqtt_OnConnect] Connected to Mqtt broker")
-    print("[Mqtt_OnConnect] Subscribing to topic: " + l_Topic);
 
-    p_MqttClient.subscribe(l_Topic)
+    if COORDINATOR is not None:
+        l_Topics += [GoveeBleCoordinator.COORDINATION_TOPIC + "+", GoveeBleCoordinator.ANY_ZONE_PREFIX + "light/+/command"];
+
+    for l_Topic in l_Topics:
+        print("[Mqtt_OnConnect] Subscribing to topic: " + l_Topic);
+        p_MqttClient.subscribe(l_Topic)
+
+    # Retained states are up to date as soon as the broker is reachable
+    for l_Device in list(CLIENTS.values()):
+        l_Device.PublishState();
+
+    if COORDINATOR is not None:
+        COORDINATOR.OnBrokerConnected();
 # On Mqtt message
 def Mqtt_OnMessage(p_MqttClient, _, p_Message):
-    global MESSAGE_QUEUE;
-    MESSAGE_QUEUE.append(p_Message);
+    GoveeBleRecorder.RECORDER.RecordMqtt(p_Message.topic, p_Message.payload);
+
+    # Stream frames skip the queue, only the newest frame of a device matters
+    if p_Message.topic == GetTopicPrefix() + "stream":
+        STREAM.Feed(p_Message.payload);
+        return;
+
+    try:
+        MESSAGE_QUEUE.put_nowait(p_Message);
+    except asyncio.QueueFull:
+        print("[Mqtt_OnMessage] Message queue full, dropping message on topic " + p_Message.topic);
+
+    # Queue is full, stop reading until the consumer catches up
+    if MESSAGE_QUEUE.full():
+        MQTT_HELPER.PauseReading();
 
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
-def OnPayloadReceived(p_MqttClient, p_Topic, p_DeviceID, p_Model, p_Paypload):
+# Register a device on first use, never blocks
+def GetOrCreateClient(p_MqttClient, p_Route, p_Adapter = None):
     global CLIENTS;
-    global MESSAGE_QUEUE;
 
-    l_RequestedDeviceID = p_DeviceID;
-    l_Device            = None;
+    l_Device = CLIENTS.get(p_Route.DeviceID);
+    if l_Device is not None:
+        return l_Device;
 
-    print(p_DeviceID + " " + str(p_Paypload));
+    print("[GetOrCreateClient] Registering device " + p_Route.DeviceID + " model " + p_Route.Model);
 
-    try:
-        p_DeviceID = ':'.join(p_DeviceID[i:i+2] for i in range(0, len(p_DeviceID), 2));
+    if SHARED_LOOP:
+        l_Device = GoveeBleLight.Client(p_Route.DeviceID, p_Route.Model, p_MqttClient, p_Route.StateTopic, p_Adapter, asyncio.get_event_loop(), BALANCER, KEEPALIVE, REGISTRY, DISCOVERY_CACHE);
+    else:
+        l_Device = GoveeBleLight.Client(p_Route.DeviceID, p_Route.Model, p_MqttClient, p_Route.StateTopic, ADAPTERS[0] if len(ADAPTERS) > 0 else None, None, None, None, REGISTRY);
+
+    CLIENTS[p_Route.DeviceID] = l_Device;
 
-        if not p_DeviceID in CLIENTS:
-            l_Topic = p_Topic[0:p_Topic.rfind("/") + 1] + "state";
-            CLIENTS[p_DeviceID] = GoveeBleLight.Client(p_DeviceID, p_Model, p_MqttClient, l_Topic, ADAPTER);
-            time.sleep(2);
+    if REGISTRY is not None:
+        REGISTRY.Update(p_Route.DeviceID, model= p_Route.Model);
 
-        l_Device = CLIENTS[p_DeviceID];
+    return l_Device;
 
-        if "state" in p_Paypload:
-            l_ExpectedState = 1 if p_Paypload["state"] == "ON" else 0;
+# Create every known device with its last state, they connect before the first command
+def WarmStart(p_MqttClient):
+    l_Devices = REGISTRY.GetDevices();
 
-            if l_Device.State != l_ExpectedState:
-                l_Device.SetPower(l_ExpectedState);
+    print(f"[WarmStart] Pre-connecting {len(l_Devices)} known devices");
 
-        if "brightness" in p_Paypload:
-            l_Device.SetBrightness(p_Paypload["brightness"] / 255);
+    for l_DeviceID, l_Record in l_Devices.items():
+        if "model" not in l_Record:
+            continue;
 
-        if "segment" in p_Paypload:
-            l_Device.SetSegment(p_Paypload["segment"]);
+        # The elected owner pre-connects it, with this state if no other server has a newer one
+        if l_Record.get("coordinated"):
+            if COORDINATOR is not None:
+                COORDINATOR.Learn(l_DeviceID, l_Record["model"], l_Record.get("state"));
+
+            continue;
+
+        l_Route = TOPIC_ROUTER.RouteDevice(l_DeviceID.replace(":", "").lower() + "_" + l_Record["model"]);
+        if l_Route is None:
+            continue;
+
+        try:
+            l_Device = GetOrCreateClient(p_MqttClient, l_Route, l_Record.get("adapter"));
 
-        if "color_temp" in p_Paypload:
-            l_Device.SetColorTempMired(p_Paypload["color_temp"]);
+            if "state" in l_Record:
+                l_Device.RestoreState(l_Record["state"]);
 
-        if "color" in p_Paypload:
-            l_R = p_Paypload["color"]["r"];
-            l_G = p_Paypload["color"]["g"];
-            l_B = p_Paypload["color"]["b"];
+        except Exception as l_Exception:
+            print(f"[WarmStart] {l_DeviceID}: {l_Exception}");
 
-            if l_Device.R != l_R or l_Device.G != l_G or l_Device.B != l_B:
-                l_Device.SetColorRGB(l_R, l_G, l_B);
+def OnPayloadReceived(p_MqttClient, p_Route, p_Paypload):
+    l_DeviceID  = p_Route.DeviceID;
+
+    print(l_DeviceID + " " + str(p_Paypload));
+
+    try:
+        l_IsNew     = not l_DeviceID in CLIENTS;
+        l_Device    = GetOrCreateClient(p_MqttClient, p_Route);
+
+        ApplyPayload(l_Device, l_IsNew, p_Paypload);
+
+        if OPTIMISTIC_PUBLISH:
+            l_Device.PublishOptimistic();
 
     except Exception as l_Exception:
         print(f"[OnPayloadReceived] OnPayloadReceived: Something Bad happened: {l_Exception}")
 
+# Apply one command to many devices, their writes are released together
+def OnGroupPayloadReceived(p_MqttClient, p_Name, p_Commands):
+    print(f"[OnGroupPayloadReceived] {p_Name}: {len(p_Commands)} devices");
+
+    l_FanOut = GoveeBleGroup.FanOut(p_Name);
+
+    try:
+        for l_Route, l_Payload in p_Commands:
+            try:
+                l_IsNew     = not l_Route.DeviceID in CLIENTS;
+                l_Device    = GetOrCreateClient(p_MqttClient, l_Route);
+
+                l_FanOut.Add(l_Device);
+                ApplyPayload(l_Device, l_IsNew, l_Payload);
+
+                if OPTIMISTIC_PUBLISH:
+                    l_Device.PublishOptimistic();
+
+            except Exception as l_Exception:
+                print(f"[OnGroupPayloadReceived] {l_Route.DeviceID}: Something Bad happened: {l_Exception}")
+
+    finally:
+        l_FanOut.Release(asyncio.get_event_loop());
+
+# Devices this server hears, with their signal strength and the link quality of connected ones
+def Coordinator_GetVisible():
+    l_Visible = {};
+
+    if DISCOVERY_CACHE is not None:
+        for l_DeviceID, l_RSSI in DISCOVERY_CACHE.GetVisible().items():
+            l_Visible[l_DeviceID.lower()] = { "rssi": l_RSSI };
+
+    # Connected devices stop advertising, their last signal strength is kept
+    for l_DeviceID, l_Device in list(CLIENTS.items()):
+        l_Info = l_Visible.setdefault(l_DeviceID, {});
+
+        if l_Info.get("rssi") is None and BALANCER is not None:
+            l_Info["rssi"] = BALANCER.GetRSSI(l_DeviceID, l_Device.GetAdapter());
+
+        l_Info["quality"] = round(l_Device.GetLinkQuality(), 3);
+
+    return l_Visible;
+
+# Elected owner of a device, restore the state the previous owner left
+def Coordinator_OnOwn(p_MqttClient, p_DeviceID, p_Model, p_State):
+    l_Route = ANY_ROUTER.RouteDevice(p_DeviceID.replace(":", "") + "_" + (p_Model or "generic"));
+    if l_Route is None:
+        return;
+
+    l_Device = GetOrCreateClient(p_MqttClient, l_Route);
+
+    # Created from a zone command, the owner publishes on the zone agnostic topic
+    if l_Device.GetStateTopic() != l_Route.StateTopic:
+        l_Device.SetStateTopic(l_Route.StateTopic);
+
+    if p_State is not None:
+        l_Device.RestoreState(p_State);
+
+    if REGISTRY is not None:
+        REGISTRY.Update(p_DeviceID, model= l_Route.Model, coordinated= True);
+
+# Another server owns the device now, free the link for it
+def Coordinator_OnRelease(p_DeviceID):
+    l_Device = CLIENTS.pop(p_DeviceID, None);
+
+    if l_Device is not None:
+        asyncio.get_event_loop().create_task(Coordinator_Forget(p_DeviceID, l_Device));
+
+# Forgotten once closed, a last state saved while closing would bring it back to the registry
+async def Coordinator_Forget(p_DeviceID, p_Device):
+    await p_Device.CloseAsync();
+
+    if REGISTRY is not None:
+        REGISTRY.Remove(p_DeviceID);
+
+# Sample every thread for a while, { "duration": 10, "interval": 0.005 } or just the duration
+def OnProfileRequested(p_MqttClient, p_Payload):
+    global PROFILER;
+
+    if PROFILER is not None:
+        print("[OnProfileRequested] A profile is already running");
+        return;
+
+    l_Options = json.loads(p_Payload) if len(p_Payload.strip()) > 0 else {};
+    if not isinstance(l_Options, dict):
+        l_Options = { "duration": float(l_Options) };
+
+    l_Loop      = asyncio.get_event_loop();
+    PROFILER    = GoveeBleProfiler.SamplingProfiler(float(l_Options.get("duration", 10)), float(l_Options.get("interval", 0.005)));
+
+    print(f"[OnProfileRequested] Profiling for {PROFILER.Duration:.1f}s");
+
+    PROFILER.Run(lambda p_Profiler: l_Loop.call_soon_threadsafe(OnProfileDone, p_MqttClient, p_Profiler));
+
+# Full profile to disk, summary to Mqtt
+def OnProfileDone(p_MqttClient, p_Profiler):
+    global PROFILER;
+
+    PROFILER = None;
+
+    l_Summary   = p_Profiler.GetSummary();
+    l_Path      = os.path.join(PROFILE_PATH, "profile_" + (WORKER_NAME or "zone" + str(SERVER_ZONE_ID)) + time.strftime("_%Y%m%d_%H%M%S"));
+
+    try:
+        p_Profiler.Write(l_Path);
+        l_Summary["path"] = os.path.abspath(l_Path);
+    except Exception as l_Exception:
+        print(f"[OnProfileDone] Error writing the profile: {l_Exception}");
+
+    print(f"[OnProfileDone] {p_Profiler.Samples} samples, hot paths: {l_Summary['hot_paths']}");
+
+    p_MqttClient.publish(GetDebugTopic("profile/result"), json.dumps(l_Summary));
+
+def ApplyPayload(p_Device, p_IsNew, p_Paypload):
+    # Commands are kept by the client until its link is up
+    if not p_Device.IsConnected():
+        print(f"[ApplyPayload] Device {p_Device.GetDeviceID()} not connected yet, command buffered");
+
+    # Before any Set*, the transition starts from what the light shows now
+    p_Device.SetTransition(p_Paypload.get("transition", 0));
+
+    if "state" in p_Paypload:
+        l_ExpectedState = 1 if p_Paypload["state"] == "ON" else 0;
+
+        # Real state of a new device is unknown, always send it
+        if p_IsNew or p_Device.State != l_ExpectedState:
+            p_Device.SetPower(l_ExpectedState);
+
+    if "brightness" in p_Paypload:
+        p_Device.SetBrightness(p_Paypload["brightness"] / 255);
+
+    if "segment" in p_Paypload:
+        p_Device.SetSegment(p_Paypload["segment"]);
+
+    if "color_temp" in p_Paypload:
+        p_Device.SetColorTempMired(p_Paypload["color_temp"]);
+
+    if "color" in p_Paypload:
+        l_R = p_Paypload["color"]["r"];
+        l_G = p_Paypload["color"]["g"];
+        l_B = p_Paypload["color"]["b"];
+
+        if p_IsNew or p_Device.R != l_R or p_Device.G != l_G or p_Device.B != l_B:
+            p_Device.SetColorRGB(l_R, l_G, l_B);
+
+    # { "0": { "r": 255, "g": 0, "b": 0 }, ... } or a list of colors indexed by segment, null skips
+    if "segments" in p_Paypload:
+        l_Segments = p_Paypload["segments"];
+
+        if isinstance(l_Segments, list):
+            l_Segments = { l_Index: l_Color for l_Index, l_Color in enumerate(l_Segments) if l_Color is not None };
+
+        p_Device.SetSegmentColors({ int(l_Index): (l_Color["r"], l_Color["g"], l_Color["b"]) for l_Index, l_Color in l_Segments.items() });
+
 # ////////////////////////////////////////////////////////////////////////////
 # ////////////////////////////////////////////////////////////////////////////
 
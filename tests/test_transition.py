@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Transitions on simulated lights, run with python -m pytest tests
+import asyncio;
+import os;
+import sys;
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"));
+
+import fakes;
+import e2e;
+
+from GoveeBleCodec import ELedCommand;
+
+DEVICE_KEY = "a4c138000001_H6008";
+
+# ////////////////////////////////////////////////////////////////////////////
+# ////////////////////////////////////////////////////////////////////////////
+
+# Color frames written while fading from red to blue, the fade command sent p_Count times back to back
+async def _FadeColorFrames(p_Count):
+    l_Link      = fakes.FakeLink(0.01, 0.0, 0.02);
+    l_Mqtt      = fakes.FakeMqttClient();
+    l_Frames    = [];
+
+    fakes.Install(l_Link);
+
+    l_Consumer = e2e.StartServer(l_Mqtt, True);
+
+    e2e.SendCommand(l_Mqtt, DEVICE_KEY, { "state": "ON", "color": { "r": 255, "g": 0, "b": 0 } });
+    await asyncio.sleep(0.5);
+
+    l_Link.OnWrite = lambda p_Address, p_Frame, p_Time: l_Frames.append(p_Frame) if p_Frame[1] == ELedCommand.SetColor else None;
+
+    for _ in range(p_Count):
+        e2e.SendCommand(l_Mqtt, DEVICE_KEY, { "color": { "r": 0, "g": 0, "b": 255 }, "transition": 1 });
+
+    await asyncio.sleep(1.5);
+
+    l_Link.OnWrite = None;
+    await e2e.StopServer(l_Consumer);
+
+    return l_Frames;
+
+def test_fade_writes_intermediate_colors():
+    assert len(set(asyncio.run(_FadeColorFrames(1)))) >= 5;
+
+# A repeated fade command landing before the first frame keeps fading instead of jumping to the target
+def test_repeated_fade_command_still_fades():
+    assert len(set(asyncio.run(_FadeColorFrames(2)))) >= 5;